@@ -0,0 +1,489 @@
+"""
+Module for benchmarking the sample, render and send stages of the pipeline,
+and the CPU cost of the process table backends.
+
+Each stage runs in a fresh process on synthetic data, so its peak RSS is its
+own, and reports its throughput and latency percentiles as JSON:
+
+    python bench.py --processes 5000 --log-lines 200000 --output bench.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import random
+import socket
+import logging
+import tempfile
+import argparse
+import platform
+import subprocess
+import functools
+import threading
+import socketserver
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import psutil
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+import logger
+import convert
+import mail
+from sampler import ProcessTable, ProcessSampler
+from dedup import DedupCache
+from store import SampleStore
+from iostats import IOUsage
+from writer import AsyncLogWriter
+from proc_events import create_process_table
+
+STAGES = ("scan", "sample", "render", "send", "backends")
+BACKENDS = ("poll", "netlink")
+# Starts short-lived processes at the given rate per second until killed,
+# writing the pid and start time of each one to a file.
+SPAWNER = """
+import sys, time, subprocess
+command, delay = sys.argv[1], 1 / float(sys.argv[2])
+with open(sys.argv[3], 'a') as log:
+    while True:
+        started = time.time()
+        child = subprocess.Popen([command])
+        log.write(f"{child.pid} {started}\\n")
+        log.flush()
+        child.wait()
+        time.sleep(delay)
+"""
+PERCENTILES = (50, 90, 99)
+
+
+def peak_rss():
+    """
+    Returns the peak resident set size of the current process in bytes.
+    """
+    if resource is None:
+        return psutil.Process().memory_info().peak_wset
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def latency_stats(seconds):
+    """
+    Returns the nearest-rank percentiles and maximum of latencies in milliseconds.
+    """
+    if not seconds:
+        return {}
+    ordered = sorted(seconds)
+    stats = {
+        f"p{percentile}": round(ordered[max(0, -(-len(ordered) * percentile // 100) - 1)] * 1000, 3)
+        for percentile in PERCENTILES
+    }
+    stats["max"] = round(ordered[-1] * 1000, 3)
+    return stats
+
+
+def stage_result(count, unit, elapsed, latencies, **extra):
+    """
+    Returns the result of a stage: throughput in units per second, latency percentiles and peak RSS.
+    """
+    result = {
+        "count": count,
+        "unit": unit,
+        "seconds": round(elapsed, 3),
+        "throughput": round(count / elapsed, 3) if elapsed else None,
+        "latency_ms": latency_stats(latencies),
+        "peak_rss_bytes": peak_rss(),
+    }
+    result.update(extra)
+    return result
+
+
+class SyntheticProcessTable(ProcessTable):
+    """
+    Process table of a made-up host with ``size`` processes, of which ``churn``
+    are replaced every tick. Executables are drawn from a pool a quarter the
+    size of the table, so repeated names exercise the dedup cache.
+    """
+
+    def __init__(self, size=1000, churn=10, seed=0):
+        super().__init__(('pid', 'exe'))
+        self.churn = churn
+        self._random = random.Random(seed)
+        self._exes = [f"/usr/lib/bench/{index:05d}/worker" for index in range(max(1, size // 4))]
+        self._next_pid = 1
+        for _ in range(size):
+            self._spawn()
+
+    def _spawn(self):
+        pid = self._next_pid
+        self._next_pid += 1
+        info = {'pid': pid, 'exe': self._random.choice(self._exes), 'create_time': time.time()}
+        self._entries[(pid, info['create_time'])] = (info, None)
+        return info
+
+    def update(self):
+        """
+        Replaces ``churn`` random processes and returns (processes, spawned, exited, handles).
+        """
+        exited = [self._entries.pop(key)[0]
+                  for key in self._random.sample(list(self._entries), min(self.churn, len(self._entries)))]
+        spawned = [self._spawn() for _ in exited]
+        return [info for info, _ in self._entries.values()], spawned, exited, {}
+
+
+def write_synthetic_log(path, lines, seed=0):
+    """
+    Writes a sample log of the given number of lines in the format the logger writes.
+    """
+    rng = random.Random(seed)
+    exes = [f"/usr/lib/bench/{index:05d}/worker" for index in range(max(1, lines // 50))]
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write("2026-01-01 00:00:00,000 - INFO - Computer Name: bench\n")
+        file.write("2026-01-01 00:00:00,000 - INFO - System Startup: 01-01-2026\n")
+        for index in range(lines):
+            timestamp = f"2026-01-01 {index // 3600 % 24:02d}:{index // 60 % 60:02d}:{index % 60:02d},000"
+            kind = rng.random()
+            exe = rng.choice(exes)
+            if index % 100 == 0:
+                message = f"Process Check: 01-01-2026_{index // 3600 % 24:02d}-{index // 60 % 60:02d}"
+            elif kind < 0.6:
+                message = f"Process: {exe}"
+            elif kind < 0.9:
+                usage = IOUsage(index, exe, rng.randrange(1 << 24), rng.randrange(1 << 24),
+                                rng.randrange(1000), rng.randrange(1000), rng.randrange(200), None)
+                message = f"File Operation: {logger.format_io_usage(usage)}"
+            else:
+                message = f"Process Exit: {exe}"
+            file.write(f"{timestamp} - INFO - {message}\n")
+
+
+def bench_scan(options, work_dir):
+    """
+    Times full scans of the real process table of this host.
+    """
+    table = ProcessTable(('pid', 'exe'))
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(options["ticks"]):
+        tick_start = time.perf_counter()
+        table.update()
+        latencies.append(time.perf_counter() - tick_start)
+    return stage_result(len(latencies), "scans", time.perf_counter() - start, latencies, processes=len(table))
+
+
+def bench_sample(options, work_dir):
+    """
+    Times sampler ticks over a synthetic process table, with the process logger
+    and the binary sample store attached as in the daemon.
+    """
+    path = os.path.join(work_dir, "sample.txt")
+    writer = AsyncLogWriter(path).start()
+    logger.sample_log.addHandler(writer.handler)
+    logger.sample_log.setLevel(logging.INFO)
+    logger.sample_log.propagate = False
+    store = SampleStore(os.path.join(work_dir, "sample.samples"))
+
+    sampler = ProcessSampler(table=SyntheticProcessTable(options["processes"], options["churn"]))
+    sampler.register(functools.partial(logger.log_processes, last_logged_processes=DedupCache(ttl=600)))
+    sampler.register(store.record_snapshot)
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(options["ticks"]):
+        tick_start = time.perf_counter()
+        sampler.tick()
+        latencies.append(time.perf_counter() - tick_start)
+    store.close()
+    logger.sample_log.removeHandler(writer.handler)
+    writer.stop()
+    elapsed = time.perf_counter() - start
+    return stage_result(
+        len(latencies), "ticks", elapsed, latencies,
+        processes_per_second=round(len(latencies) * options["processes"] / elapsed, 1),
+        records_written=writer.written, records_dropped=writer.dropped
+    )
+
+
+def bench_render(options, work_dir):
+    """
+    Times rendering of a synthetic sample log to PDF.
+    """
+    input_file = os.path.join(work_dir, "render.txt")
+    write_synthetic_log(input_file, options["log_lines"])
+    size = os.path.getsize(input_file)
+    latencies = []
+    for run in range(options["render_runs"]):
+        output_file = os.path.join(work_dir, f"render_{run}.pdf")
+        run_start = time.perf_counter()
+        if options["report_mode"] == "raw":
+            convert.render_text_pdf(input_file, output_file)
+        else:
+            convert.render_summary_pdf(input_file, output_file, appendix=options["appendix"])
+        latencies.append(time.perf_counter() - run_start)
+    elapsed = sum(latencies)
+    return stage_result(
+        len(latencies), "reports", elapsed, latencies,
+        lines_per_second=round(len(latencies) * options["log_lines"] / elapsed, 1),
+        bytes_per_second=round(len(latencies) * size / elapsed, 1),
+        input_bytes=size, output_bytes=os.path.getsize(output_file)
+    )
+
+
+class SinkHandler(socketserver.StreamRequestHandler):
+    """
+    Speaks just enough SMTP to accept messages, recording when each one arrives.
+    """
+
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b"\r\n")
+
+    def handle(self):
+        self.reply("220 bench SMTP sink")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command in (b"EHLO", b"HELO"):
+                self.reply("250 bench")
+            elif command == b"DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                size = 0
+                for data in self.rfile:
+                    if data == b".\r\n":
+                        break
+                    size += len(data)
+                self.server.received.append((time.perf_counter(), size))
+                self.reply("250 Accepted")
+            elif command == b"QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("250 OK")
+
+
+class SinkServer(socketserver.ThreadingTCPServer):
+    """
+    Local stand-in for the SMTP server, listening on a free port of 127.0.0.1.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), SinkHandler)
+        self.received = []
+        threading.Thread(target=self.serve_forever, name="bench-smtp", daemon=True).start()
+
+
+def bench_send(options, work_dir):
+    """
+    Times mailing of rendered reports to a local SMTP stand-in over one connection.
+    The latency of a message is the time since the previous one was accepted.
+    """
+    source = os.path.join(work_dir, "send.txt")
+    write_synthetic_log(source, options["log_lines"])
+    report = os.path.join(work_dir, "send.pdf")
+    convert.render_summary_pdf(source, report)
+    pdf_files = []
+    for index in range(options["reports"]):
+        pdf_file = os.path.join(work_dir, f"report_{index:04d}.pdf")
+        shutil.copyfile(report, pdf_file)
+        pdf_files.append(pdf_file)
+
+    server = SinkServer()
+    config = {
+        "fromaddr": "bench@localhost", "toaddr": "bench@localhost",
+        "smtp_host": "127.0.0.1", "smtp_port": server.server_address[1],
+        "smtp_starttls": False, "smtp_login": False,
+        "attachment_compression": options["compression"],
+    }
+    start = time.perf_counter()
+    failed = mail.deliver_reports(pdf_files, config, digest=options["digest"], retries=0)
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+    server.server_close()
+
+    arrivals = [start] + [arrived for arrived, _ in server.received]
+    latencies = [after - before for before, after in zip(arrivals, arrivals[1:])]
+    sent = sum(size for _, size in server.received)
+    return stage_result(
+        len(server.received), "messages", elapsed, latencies,
+        reports=len(pdf_files) - len(failed), failed=len(failed),
+        bytes_per_second=round(sent / elapsed, 1), message_bytes=sent
+    )
+
+
+def read_spawn_log(path, start, end):
+    """
+    Returns the pids the spawner started between two epoch times.
+    """
+    pids = set()
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            for line in file:
+                pid, _, started = line.partition(" ")
+                try:
+                    if start <= float(started) < end:
+                        pids.add(int(pid))
+                except ValueError:
+                    pass  # A line the spawner was writing when it was killed
+    except FileNotFoundError:
+        pass
+    return pids
+
+
+def run_backend(backend, seconds, interval, spawn_log=None):
+    """
+    Samples the real process table with a backend every ``interval`` seconds
+    for ``seconds`` and returns the CPU time this process spent on it, the
+    listener thread of the event backend included. The processes present at
+    the first tick are not counted as new. Given the spawner's log, it also
+    reports how many of the processes it started were seen.
+    """
+    table = create_process_table(('pid', 'exe'), backend)
+    latencies = []
+    seen = set()
+    new_processes = 0
+    try:
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        wall_start = time.time()
+        while time.perf_counter() - start < seconds:
+            tick_start = time.perf_counter()
+            _, spawned, _, _ = table.update()
+            latencies.append(time.perf_counter() - tick_start)
+            if len(latencies) > 1:
+                new_processes += len(spawned)
+                seen.update(info['pid'] for info in spawned)
+            wall_end = time.time()
+            time.sleep(max(interval - (time.perf_counter() - tick_start), 0))
+        cpu_seconds = time.process_time() - cpu_start
+        elapsed = time.perf_counter() - start
+    finally:
+        if hasattr(table, "close"):
+            table.close()
+    extra = {}
+    if spawn_log is not None:
+        # Only children started after the first tick and before the last one
+        # could be seen.
+        started = read_spawn_log(spawn_log, wall_start, wall_end)
+        extra = {"spawned": len(started), "spawned_seen": len(started & seen)}
+    return stage_result(
+        len(latencies), "ticks", elapsed, latencies,
+        cpu_seconds=round(cpu_seconds, 3), cpu_percent=round(cpu_seconds / elapsed * 100, 3),
+        processes=len(table), new_processes=new_processes, **extra
+    )
+
+
+def bench_backends(options, work_dir):
+    """
+    Compares the CPU cost of the polling and event process table backends on
+    this host, with a separate process starting short-lived processes at
+    ``spawn_rate`` per second. Each backend reports how many of those it saw.
+    A backend that is unavailable reports its error.
+    """
+    command = shutil.which("true") or shutil.which("hostname")
+    spawner = spawn_log = None
+    if options["spawn_rate"] > 0 and command:
+        spawn_log = os.path.join(work_dir, "spawned.txt")
+        spawner = subprocess.Popen([sys.executable, "-c", SPAWNER, command, str(options["spawn_rate"]), spawn_log])
+    results = {}
+    try:
+        for backend in BACKENDS:
+            try:
+                results[backend] = run_backend(
+                    backend, options["backend_seconds"], options["backend_interval"], spawn_log
+                )
+            except OSError as e:
+                results[backend] = {"error": f"{type(e).__name__}: {e}"}
+    finally:
+        if spawner is not None:
+            spawner.kill()
+            spawner.wait()
+    return {"spawn_rate": options["spawn_rate"], "interval": options["backend_interval"], "backends": results}
+
+
+def _run_stage(name, options):
+    """
+    Runs one stage in a scratch directory and returns its result.
+    """
+    logging.basicConfig(level=logging.WARNING)
+    with tempfile.TemporaryDirectory(prefix=f"track-bench-{name}-") as work_dir:
+        return globals()[f"bench_{name}"](options, work_dir)
+
+
+def run_benchmarks(options, stages=STAGES):
+    """
+    Runs the given stages, each in a fresh process, and returns the report as a dict.
+    """
+    report = {
+        "host": {
+            "hostname": socket.gethostname(),
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "memory_bytes": psutil.virtual_memory().total,
+        },
+        "options": options,
+        "stages": {},
+    }
+    context = multiprocessing.get_context("spawn")
+    for name in stages:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            try:
+                report["stages"][name] = pool.submit(_run_stage, name, options).result()
+            except Exception as e:  # One failing stage must not hide the others
+                report["stages"][name] = {"error": f"{type(e).__name__}: {e}"}
+    return report
+
+
+def parse_args(argv=None):
+    """
+    Parses the command line options of the benchmark.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the sample, render and send stages and the process backends.")
+    parser.add_argument("--stages", default=",".join(STAGES),
+                        help="comma-separated stages to run (default: %(default)s)")
+    parser.add_argument("--processes", type=int, default=1000, help="synthetic process table size")
+    parser.add_argument("--churn", type=int, default=10, help="processes replaced per tick")
+    parser.add_argument("--ticks", type=int, default=100, help="ticks for the scan and sample stages")
+    parser.add_argument("--log-lines", type=int, default=100000, help="lines of the synthetic sample log")
+    parser.add_argument("--render-runs", type=int, default=3, help="renders of the synthetic log")
+    parser.add_argument("--report-mode", choices=("summary", "raw"), default="summary")
+    parser.add_argument("--appendix", action="store_true", help="add the raw log appendix to summaries")
+    parser.add_argument("--reports", type=int, default=20, help="reports to mail")
+    parser.add_argument("--compression", choices=("gzip", "zip"), default=None)
+    parser.add_argument("--digest", action="store_true", help="mail reports in digests")
+    parser.add_argument("--backend-seconds", type=float, default=30, help="sampling time per process backend")
+    parser.add_argument("--backend-interval", type=float, default=1, help="sampling interval of the backends")
+    parser.add_argument("--spawn-rate", type=float, default=20,
+                        help="short-lived processes started per second during the backends stage")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Runs the benchmark and writes its JSON report.
+    """
+    args = parse_args(argv)
+    stages = [name.strip() for name in args.stages.split(",") if name.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        print(f"Unknown stage(s): {', '.join(sorted(unknown))}", file=sys.stderr)
+        return 2
+    options = {key: value for key, value in vars(args).items() if key not in ("stages", "output")}
+    report = run_benchmarks(options, stages)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+    return 1 if any("error" in result for result in report["stages"].values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
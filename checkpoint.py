@@ -0,0 +1,201 @@
+"""
+Module for checkpointing the collection state, so a restarted agent resumes
+its current segment instead of starting over.
+
+The sample store and the text log are append-only and serve as the spool.
+The checkpoint records which segment they belong to and until when it runs,
+together with the sampler's process table and the dedup cache, and is
+written atomically every ``interval`` seconds. Recovery reads the checkpoint,
+the active entries of the segment manifest and the tails of the segment's own
+files, so it takes as long with a year of logs as with an hour.
+"""
+
+import os
+import json
+import time
+import logging
+import psutil
+
+from segments import ACTIVE, PENDING, segment_name
+from store import truncate_partial, write_text_view
+from metrics import REGISTRY
+
+CHECKPOINT_FILE = "checkpoint.json"
+VERSION = 1
+# Processes are only restored within the same boot; psutil's boot time can
+# drift by a fraction of a second between reads.
+BOOT_TIME_TOLERANCE = 1.0
+
+# How long a checkpoint waits for the text log writer to catch up.
+SYNC_TIMEOUT = 5.0
+
+CHECKPOINT_SECONDS = REGISTRY.histogram("track_checkpoint_seconds", "Wall time of writing one checkpoint.")
+
+
+def checkpoint_path(logs_dir):
+    """
+    Returns the path of the checkpoint of a Logs directory.
+    """
+    return os.path.join(logs_dir, CHECKPOINT_FILE)
+
+
+def load_checkpoint(logs_dir):
+    """
+    Returns the checkpoint of a Logs directory, or None if there is no usable one.
+    """
+    try:
+        with open(checkpoint_path(logs_dir), 'r', encoding='utf-8') as file:
+            state = json.load(file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.error("Could not read checkpoint %s: %s", checkpoint_path(logs_dir), str(e))
+        return None
+    if not isinstance(state, dict) or state.get("version") != VERSION:
+        logging.warning("Ignoring checkpoint %s of another version", checkpoint_path(logs_dir))
+        return None
+    return state
+
+
+def write_checkpoint(logs_dir, state):
+    """
+    Writes a checkpoint atomically and makes sure it reaches the disk.
+    """
+    path = checkpoint_path(logs_dir)
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(dict(state, version=VERSION), file, separators=(',', ':'))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+
+
+def capture_state(manifest, segment_path, until, table, dedup, store=None, resources=None, writer=None):
+    """
+    Returns the checkpoint state of a collector. The sample store and the
+    text log writer are synced first, so the checkpoint never refers to
+    samples or log lines that are not on disk. If the writer cannot catch up,
+    the dedup cache is left out, so a resumed run logs its processes again
+    rather than skipping lines that were lost. Without a current segment,
+    only the sampler and dedup state are kept.
+    """
+    durable = True
+    if writer is not None and not writer.sync(SYNC_TIMEOUT):
+        logging.warning("Text log %s is not on disk; checkpointing without the dedup cache", writer.path)
+        durable = False
+    if store is not None:
+        store.sync()
+    state = {
+        "saved": time.time(),
+        "boot_time": psutil.boot_time(),
+        "segment": manifest.relative(segment_path) if segment_path else None,
+        "until": until,
+        "processes": table.state(),
+        "dedup": dedup.state() if durable else [],
+    }
+    if resources is not None and segment_path:
+        state["resource_exes"] = resources.spool(segment_path)
+    return state
+
+
+def restore_state(checkpoint, table, dedup):
+    """
+    Restores the dedup cache from a checkpoint, and the process table too if
+    the system has not been rebooted since.
+    """
+    elapsed = max(time.time() - checkpoint.get("saved", 0), 0)
+    dedup.restore(checkpoint.get("dedup", []), elapsed)
+    if abs(checkpoint.get("boot_time", 0) - psutil.boot_time()) <= BOOT_TIME_TOLERANCE:
+        table.restore(checkpoint.get("processes", []))
+
+
+def resume_files(segment_path):
+    """
+    Repairs the tails of a segment's files after a crash, so appending to them
+    can resume: partial sample records are cut off and a torn last text line
+    is terminated.
+    """
+    truncate_partial(os.path.splitext(segment_path)[0] + '.samples')
+    try:
+        with open(segment_path, 'rb+') as file:
+            file.seek(0, os.SEEK_END)
+            if file.tell():
+                file.seek(-1, os.SEEK_END)
+                if file.read(1) != b'\n':
+                    file.write(b'\n')
+    except FileNotFoundError:
+        pass
+
+
+def finish_segment(segment_path):
+    """
+    Completes a segment cut short by a crash so it can be published: a text
+    view is rendered from the sample store if no text log was written.
+    Returns the time the segment was last written to.
+    """
+    samples_path = os.path.splitext(segment_path)[0] + '.samples'
+    if not os.path.exists(segment_path) and os.path.exists(samples_path):
+        truncate_partial(samples_path)
+        write_text_view(samples_path, segment_path)
+    mtimes = [os.path.getmtime(path) for path in (segment_path, samples_path) if os.path.exists(path)]
+    return max(mtimes) if mtimes else time.time()
+
+
+def recover(manifest, checkpoint, now=None):
+    """
+    Marks the segments an earlier run left active as pending, except the one
+    the checkpoint can resume because its period has not ended yet.
+    Returns (path of the segment to resume or None, paths of the segments
+    marked pending).
+    """
+    now = now or time.time()
+    manifest.load()
+    resume = None
+    if checkpoint and checkpoint.get("segment") and (checkpoint.get("until") or 0) > now:
+        entry = manifest.get(checkpoint["segment"])
+        if entry is not None and entry["status"] == ACTIVE:
+            resume = manifest.absolute(entry["text"])
+    stale = [manifest.absolute(entry["text"]) for entry in manifest.with_status(ACTIVE)
+             if resume is None or entry["name"] != segment_name(resume)]
+    ends = {path: finish_segment(path) for path in stale}
+    with manifest.edit():
+        for path, end in ends.items():
+            manifest.update(path, PENDING, end=end)
+    if resume is not None:
+        resume_files(resume)
+        logging.info("Resuming segment %s", resume)
+    if stale:
+        logging.info("Marked %d interrupted segment(s) pending", len(stale))
+    return resume, stale
+
+
+class Checkpointer:
+    """
+    Sampler consumer that writes a checkpoint every ``interval`` seconds.
+    ``state`` is a callable returning the state to save.
+    """
+
+    def __init__(self, logs_dir, state, interval=30, clock=time.monotonic):
+        self.logs_dir = logs_dir
+        self.state = state
+        self.interval = interval
+        self._clock = clock
+        self._last = None
+
+    def __call__(self, snapshot=None):
+        """
+        Writes a checkpoint if the interval has passed since the previous one.
+        """
+        if self._last is None or self._clock() - self._last >= self.interval:
+            self.save()
+
+    def save(self):
+        """
+        Writes a checkpoint now.
+        """
+        self._last = self._clock()
+        try:
+            with CHECKPOINT_SECONDS.time():
+                write_checkpoint(self.logs_dir, self.state())
+        except OSError as e:
+            logging.error("Could not write checkpoint to %s: %s", self.logs_dir, str(e))
@@ -0,0 +1,458 @@
+"""
+Module for aggregating samples from many hosts into a single fleet report.
+
+Agents forward compact batches of samples over HTTP to a collector, which
+stores them per host and renders and mails one report for the whole fleet
+every period, instead of every host mailing its own.
+"""
+
+import os
+import re
+import sys
+import gzip
+import json
+import math
+import zlib
+import signal
+import socket
+import logging
+import threading
+import urllib.error
+import urllib.request
+from collections import deque
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import mail
+import convert
+import summary
+from dedup import DedupCache
+from store import SampleStore, read_samples, PROCESS, SPAWN, EXIT
+from segments import next_boundary
+from metrics import REGISTRY
+
+DEFAULT_PORT = 8765
+SAMPLES_PATH = "/samples"
+TOKEN_HEADER = "X-Track-Token"
+# Largest batch the collector accepts, compressed and decompressed.
+MAX_BATCH_BYTES = 16 * 1024 * 1024
+MAX_DECOMPRESSED_BYTES = 128 * 1024 * 1024
+# Field ranges of a sample record in the store's binary format.
+MAX_PID = 2 ** 32 - 1
+MAX_KIND = 255
+
+FORWARDED = REGISTRY.counter(
+    "track_forwarded_samples_total", "Samples forwarded to the collector, by outcome.", ("outcome",)
+)
+RECEIVED = REGISTRY.counter("track_collector_samples_total", "Samples received by the collector.", ("host",))
+
+
+def resource_path(relative_path):
+    """
+    Returns the absolute path to a resource file.
+    """
+    try:
+        base_path = sys._MEIPASS
+    except AttributeError:
+        base_path = os.path.abspath(os.path.dirname(__file__))
+    return os.path.join(base_path, relative_path)
+
+
+def setup_logging():
+    """
+    Sets up the logging configuration.
+    It creates a log directory with the current date and logs to collector.log in it.
+    """
+    log_dir = os.path.join(resource_path("Logs"), datetime.now().strftime('%d-%m-%Y'))
+    os.makedirs(log_dir, exist_ok=True)
+    logging.basicConfig(
+        filename=os.path.join(log_dir, "collector.log"), level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+
+def encode_batch(host, samples):
+    """
+    Encodes (timestamp, pid, exe, kind) samples of a host as gzip-compressed
+    JSON, with every executable path listed once and referred to by index.
+    """
+    strings = {}
+    records = [
+        [round(timestamp, 3), pid, strings.setdefault(exe, len(strings)), kind]
+        for timestamp, pid, exe, kind in samples
+    ]
+    payload = {"host": host, "strings": list(strings), "records": records}
+    return gzip.compress(json.dumps(payload, separators=(',', ':')).encode('utf-8'))
+
+
+def decode_sample(strings, timestamp, pid, index, kind):
+    """
+    Decodes one record of a batch, checking that it fits the sample store.
+    Raises ValueError if a field is out of range.
+    """
+    timestamp, pid, index, kind = float(timestamp), int(pid), int(index), int(kind)
+    if not math.isfinite(timestamp) or timestamp < 0:
+        raise ValueError(f"timestamp {timestamp} out of range")
+    if not 0 <= pid <= MAX_PID:
+        raise ValueError(f"pid {pid} out of range")
+    if not 0 <= kind <= MAX_KIND:
+        raise ValueError(f"kind {kind} out of range")
+    if not 0 <= index < len(strings):
+        raise ValueError(f"string index {index} out of range")
+    exe = strings[index]
+    if exe is not None and not isinstance(exe, str):
+        raise ValueError(f"executable {exe!r} is not a string")
+    return timestamp, pid, exe, kind
+
+
+class BatchTooLarge(ValueError):
+    """
+    Raised for a batch that decompresses to more than the collector accepts.
+    """
+
+
+def decompress_batch(data, max_size=MAX_DECOMPRESSED_BYTES):
+    """
+    Returns a gzip-compressed batch decompressed, stopping at ``max_size``
+    bytes so a small batch cannot expand to fill the collector's memory.
+    Raises BatchTooLarge past that size and ValueError for invalid data.
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        data = decompressor.decompress(data, max_size)
+    except zlib.error as e:
+        raise ValueError(f"Malformed sample batch: {e}") from e
+    if decompressor.unconsumed_tail or (not decompressor.eof and len(data) >= max_size):
+        raise BatchTooLarge(f"Sample batch larger than {max_size} bytes decompressed")
+    if not decompressor.eof:
+        raise ValueError("Malformed sample batch: truncated")
+    return data
+
+
+def decode_batch(data, max_size=MAX_DECOMPRESSED_BYTES):
+    """
+    Decodes a batch made by encode_batch into (host, list of samples).
+    Raises ValueError if the batch is malformed, before any sample is used,
+    or BatchTooLarge if it decompresses to more than ``max_size`` bytes.
+    """
+    payload = json.loads(decompress_batch(data, max_size))
+    try:
+        strings = payload["strings"]
+        samples = [decode_sample(strings, *record) for record in payload["records"]]
+        host = str(payload["host"])
+    except (KeyError, IndexError, TypeError, OverflowError) as e:
+        raise ValueError(f"Malformed sample batch: {e}") from e
+    if not host:
+        raise ValueError("Sample batch without a host name")
+    return host, samples
+
+
+class SampleForwarder:
+    """
+    Sampler consumer that forwards the samples the process log would record
+    to a collector. Samples are queued in memory and posted in batches every
+    ``flush_interval`` seconds from a background thread, so a slow or missing
+    collector never delays sampling. Batches that cannot be delivered are
+    retried, keeping at most ``max_pending`` samples; batches the collector
+    rejects with a 4xx status are dropped and counted.
+    """
+
+    def __init__(self, url, host=None, token=None, flush_interval=10, max_pending=100000,
+                 timeout=10, dedup_ttl=600):
+        self.url = url
+        self.host = host or socket.gethostname()
+        self.token = token
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self.dropped = 0
+        self._dedup = DedupCache(ttl=dedup_ttl)
+        self._pending = deque(maxlen=max_pending)
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def __call__(self, snapshot):
+        """
+        Queues the samples of a snapshot, deduplicated like the process log.
+        """
+        samples = [(snapshot.time, info['pid'], info.get('exe'), PROCESS)
+                   for info in snapshot.processes if self._dedup.should_log(info.get('exe'))]
+        # Processes that started and exited between two snapshots.
+        samples.extend((snapshot.time, info['pid'], info.get('exe'), SPAWN)
+                       for info in snapshot.spawned if info['pid'] not in snapshot.handles)
+        samples.extend((snapshot.time, info['pid'], info.get('exe'), EXIT) for info in snapshot.exited)
+        with self._lock:
+            overflow = len(self._pending) + len(samples) - self._pending.maxlen
+            if overflow > 0:
+                self.dropped += overflow
+                FORWARDED.labels(outcome="dropped").inc(overflow)
+            self._pending.extend(samples)
+
+    def flush(self):
+        """
+        Posts the queued samples to the collector. Returns True if there was
+        nothing to send or the collector accepted them.
+        """
+        with self._lock:
+            samples = list(self._pending)
+            self._pending.clear()
+        if not samples:
+            return True
+        request = urllib.request.Request(
+            self.url, data=encode_batch(self.host, samples), method="POST",
+            headers={"Content-Type": "application/json", "Content-Encoding": "gzip"}
+        )
+        if self.token:
+            request.add_header(TOKEN_HEADER, self.token)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout):
+                pass
+        except urllib.error.HTTPError as e:
+            if e.code < 500:
+                # The collector refused the batch itself, e.g. a bad token or
+                # an oversized batch; sending it again would fail the same way.
+                logging.error("Collector %s rejected %d sample(s): %s", self.url, len(samples), str(e))
+                FORWARDED.labels(outcome="rejected").inc(len(samples))
+                return False
+            self._requeue(samples, e)
+            return False
+        except OSError as e:
+            self._requeue(samples, e)
+            return False
+        FORWARDED.labels(outcome="sent").inc(len(samples))
+        return True
+
+    def _requeue(self, samples, error):
+        """
+        Puts a batch that could not be delivered back in front of anything
+        queued meanwhile, to be retried with the next flush.
+        """
+        logging.warning("Could not forward %d sample(s) to %s: %s", len(samples), self.url, str(error))
+        with self._lock:
+            newer = list(self._pending)
+            self._pending.clear()
+            self._pending.extend(samples)
+            self._pending.extend(newer)
+
+    def start(self):
+        """
+        Starts the background sender thread.
+        """
+        self._thread = threading.Thread(target=self._run, name="track-forwarder", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops the sender thread after a last attempt to send the queued samples.
+        """
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop_event.wait(self.flush_interval):
+            self.flush()
+        self.flush()
+
+
+def host_file_name(host):
+    """
+    Returns a host name made safe for use in a file name.
+    """
+    return re.sub(r'[^A-Za-z0-9._-]', '_', host)
+
+
+class FleetCollector:
+    """
+    Stores the samples received from each host in a sample file per host and
+    period under Logs/fleet/<date>, and renders them as one fleet report.
+    """
+
+    def __init__(self, logs_dir=None):
+        self.fleet_dir = os.path.join(logs_dir or resource_path("Logs"), "fleet")
+        self._stores = {}
+        self._lock = threading.Lock()
+
+    def receive(self, host, samples):
+        """
+        Appends the samples of a host to its sample file for the current period.
+        """
+        with self._lock:
+            store = self._stores.get(host)
+            if store is None:
+                now = datetime.now()
+                period_dir = os.path.join(self.fleet_dir, now.strftime('%d-%m-%Y'))
+                os.makedirs(period_dir, exist_ok=True)
+                path = os.path.join(period_dir, f"{host_file_name(host)}_{now.strftime('%d-%m-%Y_%H-%M')}.samples")
+                store = self._stores[host] = SampleStore(path)
+                logging.info("Collecting samples of %s into %s", host, path)
+            for timestamp, pid, exe, kind in samples:
+                store.append(timestamp, pid, exe, kind)
+            store.flush()
+        RECEIVED.labels(host=host).inc(len(samples))
+
+    def roll(self):
+        """
+        Closes the sample files of the current period and returns a mapping of
+        host name to sample file. The next samples start new files.
+        """
+        with self._lock:
+            stores, self._stores = self._stores, {}
+        for store in stores.values():
+            store.close()
+        return {host: store.path for host, store in stores.items()}
+
+    def render(self, paths):
+        """
+        Renders the fleet report for a mapping of host name to sample file and
+        returns the path of the PDF.
+        """
+        host_summaries = {host: summary.summarize_samples(read_samples(path), host)
+                          for host, path in paths.items()}
+        first_path = min(paths.values())
+        output_file_path = os.path.join(
+            os.path.dirname(first_path), f"fleet_report_{datetime.now().strftime('%d-%m-%Y_%H-%M')}.pdf"
+        )
+        convert.render_fleet_pdf(host_summaries, output_file_path)
+        logging.info("Rendered fleet report of %d host(s) to %s", len(paths), output_file_path)
+        return output_file_path
+
+
+class _SamplesHandler(BaseHTTPRequestHandler):
+    """
+    Accepts sample batches posted by agents.
+    """
+
+    def do_POST(self):
+        if self.path != SAMPLES_PATH:
+            self.send_error(404)
+            return
+        token = self.server.token
+        if token and self.headers.get(TOKEN_HEADER) != token:
+            self.send_error(403)
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            length = -1
+        if not 0 < length <= MAX_BATCH_BYTES:
+            self.send_error(413 if length > 0 else 411)
+            return
+        try:
+            host, samples = decode_batch(self.rfile.read(length))
+        except ValueError as e:
+            logging.warning("Rejected batch from %s: %s", self.client_address[0], str(e))
+            self.send_error(413 if isinstance(e, BatchTooLarge) else 400)
+            return
+        self.server.collector.receive(host, samples)
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        logging.debug("Collector request: " + format, *args)
+
+
+class CollectorServer(ThreadingHTTPServer):
+    """
+    HTTP endpoint of the collector. It listens on localhost unless another host is given.
+    """
+    daemon_threads = True
+
+    def __init__(self, collector, port=DEFAULT_PORT, host="127.0.0.1", token=None):
+        super().__init__((host, port), _SamplesHandler)
+        self.collector = collector
+        self.token = token
+        self._thread = None
+
+    def start(self):
+        """
+        Starts serving on a background thread.
+        """
+        self._thread = threading.Thread(target=self.serve_forever, name="track-collector", daemon=True)
+        self._thread.start()
+        logging.info("Collecting samples on http://%s:%d%s", *self.server_address[:2], SAMPLES_PATH)
+        return self
+
+    def stop(self):
+        """
+        Stops serving and closes the socket.
+        """
+        if self._thread is not None:
+            self.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.server_close()
+
+
+def publish_fleet_report(collector, config):
+    """
+    Closes the current period and mails its fleet report. Returns 0 on success.
+    """
+    paths = collector.roll()
+    if not paths:
+        logging.info("No samples received this period")
+        return 0
+    try:
+        pdf_file = collector.render(paths)
+    except (OSError, ValueError) as e:
+        logging.error("Could not render the fleet report: %s", str(e))
+        return 1
+    failed = mail.deliver_reports(
+        [pdf_file], config, "Fleet Report", retries=config.get("smtp_retries", 3), title="Fleet Report"
+    )
+    return 1 if failed else 0
+
+
+def _publish(collector, config):
+    """
+    Publishes the fleet report of the current period, logging any error
+    instead of raising it, so one bad period does not stop the collector.
+    """
+    try:
+        return publish_fleet_report(collector, config)
+    except Exception:
+        logging.exception("Could not publish the fleet report")
+        return 1
+
+
+def run_collector(config, stop_event, collector=None):
+    """
+    Serves the collector endpoint and publishes a fleet report at every
+    segment_minutes boundary until stop_event is set, then once more for the
+    samples received since the last report.
+    """
+    collector = collector or FleetCollector()
+    server = CollectorServer(
+        collector, port=int(config.get("collector_port", DEFAULT_PORT)),
+        host=config.get("collector_bind", "127.0.0.1"), token=config.get("collector_token")
+    ).start()
+    try:
+        while not stop_event.is_set():
+            boundary = next_boundary(minutes=config.get("segment_minutes", 60))
+            if stop_event.wait((boundary - datetime.now()).total_seconds()):
+                break
+            _publish(collector, config)
+    finally:
+        server.stop()
+        _publish(collector, config)
+    return 0
+
+
+def main():
+    """
+    This is the main function of the script.
+    It runs the collector until it is interrupted.
+    """
+    setup_logging()
+    config = mail.load_config(resource_path('config.json'))
+    stop_event = threading.Event()
+    signal.signal(signal.SIGINT, lambda signum, frame: stop_event.set())
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    return run_collector(config, stop_event)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,13 +3,38 @@ Module for converting text files to PDF format and logging the process.
 """
 
 import os
+import time
+import bisect
+import itertools
 import shutil
 import sys
 import logging
 import datetime
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.units import inch
+from concurrent.futures import ProcessPoolExecutor
+import summary
+from segments import SegmentManifest, open_manifest, PENDING, CONVERTED, MAILED
+from metrics import REGISTRY
+
+FONT_NAME = "Helvetica"
+BOLD_FONT_NAME = "Helvetica-Bold"
+TABLE_FONT_NAME = "Courier"
+FONT_SIZE = 9
+LEADING = 11
+# reportlab is imported when something is rendered, as it dominates the import
+# time of this module. Page sizes are in points, as in reportlab.
+PAGE_SIZE = (612.0, 792.0)  # US Letter
+MARGIN = 72.0  # One inch
+READ_BUFFER_SIZE = 1024 * 1024
+# Characters after which a wrapped line may be broken, besides spaces.
+BREAK_CHARS = ' /\\,;'
+TOP_EXECUTABLES = 20
+# reportlab keeps every page in memory until the PDF is saved, so a report is
+# cut off after this many pages: about 55 MiB peak however long the log is.
+MAX_PAGES = 2000
+
+RENDER_SECONDS = REGISTRY.histogram(
+    "track_render_seconds", "Time taken to render a sample log to PDF.", ("mode",)
+)
 
 
 def resource_path(relative_path):
@@ -38,51 +63,401 @@ def setup_logging():
     )
 
 
-def convert_txt_to_pdf():
+_char_widths = {}
+
+
+def char_width(char, font_name=FONT_NAME):
     """
-    Converts text files to PDF format and moves the original text files to a report directory.
+    Returns the width of a character at font size 1, caching the result.
     """
-    setup_logging()
-    logging.info("Starting conversion process")
+    key = (char, font_name)
+    width = _char_widths.get(key)
+    if width is None:
+        from reportlab.pdfbase.pdfmetrics import stringWidth
+        width = _char_widths[key] = stringWidth(char, font_name, 1)
+    return width
 
-    current_date = datetime.datetime.now().strftime('%d-%m-%Y')
-    log_dir = os.path.join(resource_path("Logs"), current_date)
+
+def wrap_line(line, max_width, font_name=FONT_NAME, font_size=FONT_SIZE):
+    """
+    Splits a line into pieces that fit within max_width points when drawn,
+    preferring to break after spaces and path separators.
+    """
+    # No character is wider than about one em, so short lines need no measuring.
+    if len(line) * font_size * 1.1 <= max_width:
+        return [line]
+    limit = max_width / font_size
+    offsets = list(itertools.accumulate(char_width(char, font_name) for char in line))
+    if offsets[-1] <= limit:
+        return [line]
+    pieces = []
+    start = 0
+    consumed = 0.0
+    while start < len(line):
+        end = max(start + 1, bisect.bisect_right(offsets, consumed + limit, lo=start))
+        if end < len(line):
+            best = max(line.rfind(char, start, end) for char in BREAK_CHARS)
+            if best >= start + (end - start) // 2:
+                end = best + 1
+        pieces.append(line[start:end])
+        consumed = offsets[end - 1]
+        start = end
+    return pieces
+
+
+class PageWriter:
+    """
+    Writes wrapped lines to a PDF one page at a time. Each page is drawn as a
+    single text object once it is full, so only the lines of the current page
+    are held as Python objects. reportlab still keeps every finished page, as
+    a compressed content stream, until the PDF is saved, so memory is bounded
+    by cutting the PDF off after ``max_pages``: later lines are only counted,
+    and the last page says how many were left out.
+    """
+
+    def __init__(self, output_file_path, max_pages=MAX_PAGES):
+        from reportlab.pdfgen import canvas
+        self.pdf = canvas.Canvas(output_file_path, pagesize=PAGE_SIZE, pageCompression=1)
+        page_width, self.page_height = PAGE_SIZE
+        self.max_width = page_width - 2 * MARGIN
+        self.lines_per_page = int((self.page_height - 2 * MARGIN) // LEADING)
+        self.max_pages = max(max_pages, 2)
+        self.pages = 0
+        self.omitted = 0
+        self._lines = []
+
+    @property
+    def truncated(self):
+        """
+        Returns True once every page but the one for the truncation notice is used.
+        """
+        return self.pages >= self.max_pages - 1
+
+    def write(self, line, font_name=FONT_NAME):
+        """
+        Writes a line, wrapping it to the page width.
+        """
+        if self.truncated:
+            self.omitted += 1
+            return
+        for piece in wrap_line(line, self.max_width, font_name):
+            self._lines.append((font_name, piece))
+            if len(self._lines) == self.lines_per_page:
+                self.new_page()
+
+    def new_page(self):
+        """
+        Draws the lines written so far and starts a new page.
+        """
+        if not self._lines:
+            return
+        text = self.pdf.beginText(MARGIN, self.page_height - MARGIN)
+        # Consecutive lines in the same font are drawn with a single textLines call.
+        for font_name, group in itertools.groupby(self._lines, key=lambda item: item[0]):
+            text.setFont(font_name, FONT_SIZE, LEADING)
+            text.textLines([piece for _, piece in group], trim=0)
+        self.pdf.drawText(text)
+        self.pdf.showPage()
+        self.pages += 1
+        self._lines.clear()
+
+    def save(self):
+        """
+        Draws the last page, or the truncation notice, and writes the PDF file.
+        """
+        if self.truncated:
+            self._lines = [
+                (BOLD_FONT_NAME, f"Report truncated after {self.pages} pages"),
+                (FONT_NAME, f"{self.omitted} further line(s) were not rendered."),
+                (FONT_NAME, "The complete log is kept in the reports/text directory."),
+            ]
+            self.pages -= 1  # The notice page is always drawn
+        self.new_page()
+        self.pdf.save()
+
+
+def write_text_file(writer, input_file):
+    """
+    Writes every line of a text file, reading it in buffered chunks.
+    """
+    with open(input_file, 'r', encoding='utf-8', errors='replace', buffering=READ_BUFFER_SIZE) as file:
+        for line in file:
+            writer.write(line.rstrip())
+
+
+def render_text_pdf(input_file, output_file_path, max_pages=MAX_PAGES):
+    """
+    Renders a text file to PDF page by page. The file is read in buffered chunks,
+    long lines are wrapped by their measured width and each page is drawn as a
+    single text object. reportlab keeps the compressed pages until save(), so
+    the PDF is cut off after ``max_pages`` to bound memory use.
+    """
+    writer = PageWriter(output_file_path, max_pages)
+    write_text_file(writer, input_file)
+    writer.save()
+
+
+def write_table(writer, title, rows):
+    """
+    Writes a table of (exe, count, first seen, last seen) rows in a fixed-width font.
+    Only the time of day of the first and last sightings is shown.
+    """
+    writer.write(title, BOLD_FONT_NAME)
+    if not rows:
+        writer.write("  None recorded")
+        writer.write("")
+        return
+    writer.write(f"{'Count':>7}  {'First':<8}  {'Last':<8}  Executable", TABLE_FONT_NAME)
+    for exe, count, first, last in rows:
+        writer.write(f"{count:>7}  {first[11:19]:<8}  {last[11:19]:<8}  {exe}", TABLE_FONT_NAME)
+    writer.write("")
+
+
+def format_bytes(count):
+    """
+    Formats a byte count with a binary unit.
+    """
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if count < 1024:
+            return f"{count:.0f} {unit}" if unit == "B" else f"{count:.1f} {unit}"
+        count /= 1024
+    return f"{count:.1f} TiB"
+
+
+def write_io_table(writer, title, rows):
+    """
+    Writes a table of (exe, bytes read, bytes written) rows in a fixed-width font.
+    """
+    writer.write(title, BOLD_FONT_NAME)
+    writer.write(f"{'Read':>10}  {'Written':>10}  Executable", TABLE_FONT_NAME)
+    for exe, read_bytes, write_bytes in rows:
+        writer.write(f"{format_bytes(read_bytes):>10}  {format_bytes(write_bytes):>10}  {exe}", TABLE_FONT_NAME)
+    writer.write("")
+
+
+def render_summary_pdf(input_file, output_file_path, top=TOP_EXECUTABLES, appendix=False, max_pages=MAX_PAGES):
+    """
+    Renders a summary report of a sample log: host details, the top executables
+    and per-executable counts with first and last seen times. The raw log lines
+    are only included when an appendix is requested, within ``max_pages``.
+    """
+    log_summary = summary.summarize_log(input_file)
+    writer = PageWriter(output_file_path, max_pages)
+
+    writer.write(f"Activity Report - {log_summary['computer_name'] or 'Unknown host'}", BOLD_FONT_NAME)
+    writer.write(f"Period: {log_summary['start']} to {log_summary['end']}")
+    writer.write(f"System Startup: {log_summary['system_startup']}")
+    writer.write(f"Checks: {log_summary['checks']}    Log lines: {log_summary['lines']}")
+    writer.write("")
+
+    if log_summary["io"]:
+        write_io_table(writer, f"Top {top} I/O Consumers", summary.top_io(log_summary["io"], top))
+
+    for section, title in (("processes", "Processes"), ("file_operations", "File Operations"),
+                           ("exits", "Process Exits")):
+        stats = log_summary[section]
+        if section == "exits" and not stats:
+            continue
+        if len(stats) > top:
+            write_table(writer, f"Top {top} {title}", summary.top_executables(stats, top))
+        write_table(writer, f"All {title} ({len(stats)} executables)", summary.top_executables(stats))
+
+    if appendix:
+        writer.new_page()
+        writer.write("Appendix: Raw Log", BOLD_FONT_NAME)
+        write_text_file(writer, input_file)
+    writer.save()
+
+
+def render_fleet_pdf(host_summaries, output_file_path, top=TOP_EXECUTABLES):
+    """
+    Renders one report for many hosts from a mapping of host name to summary:
+    a comparison table of the hosts, then the top executables of each host.
+    """
+    writer = PageWriter(output_file_path)
+    starts = [s["start"] for s in host_summaries.values() if s["start"]]
+    ends = [s["end"] for s in host_summaries.values() if s["end"]]
+    writer.write(f"Fleet Report - {len(host_summaries)} host(s)", BOLD_FONT_NAME)
+    writer.write(f"Period: {min(starts, default=None)} to {max(ends, default=None)}")
+    writer.write("")
+
+    writer.write("Hosts", BOLD_FONT_NAME)
+    writer.write(f"{'Executables':>11}  {'Sightings':>9}  {'Exits':>7}  {'Last':<8}  Host", TABLE_FONT_NAME)
+    for host, host_summary in sorted(host_summaries.items()):
+        processes = host_summary["processes"]
+        sightings = sum(count for count, _, _ in processes.values())
+        exits = sum(count for count, _, _ in host_summary["exits"].values())
+        last = (host_summary["end"] or "")[11:19]
+        writer.write(f"{len(processes):>11}  {sightings:>9}  {exits:>7}  {last:<8}  {host}", TABLE_FONT_NAME)
+    writer.write("")
+
+    for host, host_summary in sorted(host_summaries.items()):
+        writer.write(f"Host: {host}", BOLD_FONT_NAME)
+        writer.write(f"Period: {host_summary['start']} to {host_summary['end']}")
+        writer.write("")
+        write_table(writer, f"Top {top} Processes", summary.top_executables(host_summary["processes"], top))
+        if host_summary["exits"]:
+            write_table(writer, f"Top {top} Process Exits", summary.top_executables(host_summary["exits"], top))
+    writer.save()
+
+
+def convert_file(input_file, mode="summary", appendix=False, max_pages=MAX_PAGES):
+    """
+    Converts a single text file to PDF and moves the text file to the report directory
+    next to it. Returns the path of the generated PDF, or of the PDF an earlier
+    run generated, wherever it is now.
+    In "summary" mode the PDF holds a summary report, in "raw" mode every log line.
+    """
+    log_dir = os.path.dirname(input_file)
     report_dir = os.path.join(log_dir, "reports", "text")
+    os.makedirs(report_dir, exist_ok=True)
+
+    output_file_path = os.path.splitext(input_file)[0] + '.pdf'
+    existing_path = find_converted(input_file, output_file_path)
+    if existing_path:
+        # A previous run rendered the PDF but stopped before moving the text file.
+        logging.info("%s is already converted to %s", input_file, existing_path)
+        output_file_path = existing_path
+    elif mode == "summary":
+        logging.info("Converting %s to %s", input_file, output_file_path)  # Updated logging
+        with RENDER_SECONDS.labels(mode=mode).time():
+            render_summary_pdf(input_file, output_file_path, appendix=appendix, max_pages=max_pages)
+    elif mode == "raw":
+        logging.info("Converting %s to %s", input_file, output_file_path)  # Updated logging
+        with RENDER_SECONDS.labels(mode=mode).time():
+            render_text_pdf(input_file, output_file_path, max_pages)
+    else:
+        raise ValueError(f"Unknown report mode: {mode}")
+
+    shutil.move(input_file, report_dir)
+    logging.info("Moved %s to %s", input_file, report_dir)  # Updated logging
+    return output_file_path
 
+
+def find_converted(input_file, output_file_path):
+    """
+    Returns the path of the PDF for a text file if it exists and is newer than
+    the text file, either next to it or already moved to the PDF report
+    directory by mail.py, and None otherwise.
+    """
+    mailed_path = os.path.join(
+        os.path.dirname(input_file), "reports", "pdf", os.path.basename(output_file_path)
+    )
     try:
-        os.makedirs(report_dir, exist_ok=True)
-        logging.info(f"Directories created: {report_dir}")
+        input_mtime = os.path.getmtime(input_file)
+    except OSError:
+        return None
+    for path in (output_file_path, mailed_path):
+        try:
+            if os.path.getmtime(path) >= input_mtime:
+                return path
+        except OSError:
+            pass
+    return None
+
 
-        txt_files = [f for f in os.listdir(log_dir) if f.endswith('.txt')]
-        if not txt_files:
-            logging.warning("No text files found in the directory.")
-            return 0
+def is_mailed(pdf_file):
+    """
+    Returns True if a PDF is in the report directory mail.py moves sent reports to.
+    """
+    report_dir = os.path.dirname(os.path.abspath(pdf_file))
+    return os.path.basename(report_dir) == "pdf" and os.path.basename(os.path.dirname(report_dir)) == "reports"
 
-        input_file = os.path.join(log_dir, txt_files[0])
-        output_file = txt_files[0].replace('.txt', '.pdf')
-        output_file_path = os.path.join(log_dir, output_file)
 
-        logging.info("Converting %s to %s", input_file, output_file_path)  # Updated logging
+def find_pending_logs(logs_dir=None, exclude=()):
+    """
+    Returns every text log still waiting for conversion, oldest first, as
+    listed in the segment manifest of the Logs directory. Segments that are
+    still being written are not included.
+    """
+    logs_dir = logs_dir or resource_path("Logs")
+    exclude = {os.path.abspath(path) for path in exclude}
+    return [
+        path for path in open_manifest(logs_dir).files(PENDING)
+        if os.path.abspath(path) not in exclude and os.path.exists(path)
+    ]
+
+
+def mark_converted(converted, logs_dir=None):
+    """
+    Records (text file, PDF path) pairs as converted in the segment manifest,
+    with the new location of each text file in its report directory. A PDF
+    that an earlier run already mailed is recorded as mailed.
+    """
+    manifest = SegmentManifest(logs_dir or resource_path("Logs"))
+    with manifest.edit():
+        for input_file, pdf_file in converted:
+            text_file = os.path.join(os.path.dirname(input_file), "reports", "text", os.path.basename(input_file))
+            status = MAILED if is_mailed(pdf_file) else CONVERTED
+            if manifest.get(input_file) is None:
+                manifest.add(text_file, status=status)  # Converted outside the pipeline
+            manifest.update(input_file, status, text=text_file, pdf=pdf_file)
+
+
+def _convert_worker(input_file, mode, appendix, max_pages=MAX_PAGES):
+    """
+    Converts one file in a worker process, returning
+    (input file, PDF path or None, error, seconds taken).
+    """
+    start = time.perf_counter()
+    try:
+        return input_file, convert_file(input_file, mode, appendix, max_pages), None, time.perf_counter() - start
+    except (OSError, ValueError) as e:
+        logging.error("Could not convert %s: %s", input_file, str(e))
+        return input_file, None, str(e), time.perf_counter() - start
+
+
+def convert_all(input_files=None, mode="summary", appendix=False, workers=None, max_pages=MAX_PAGES):
+    """
+    Converts every pending text log on a process pool sized to the machine.
+    Logs that were already converted are only moved, so the call is safe to repeat.
+    Returns (list of generated PDF paths, list of (input file, error) failures).
+    """
+    if input_files is None:
+        input_files = find_pending_logs()
+    if not input_files:
+        return [], []
+    workers = min(len(input_files), workers or os.cpu_count() or 1)
+    logging.info("Converting %d file(s) on %d worker(s)", len(input_files), workers)
+
+    if workers == 1:
+        results = [_convert_worker(path, mode, appendix, max_pages) for path in input_files]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=setup_logging) as pool:
+            results = list(pool.map(
+                _convert_worker, input_files,
+                [mode] * len(input_files), [appendix] * len(input_files), [max_pages] * len(input_files)
+            ))
+        # Metrics recorded in the workers stay there, so count the renders here.
+        for _, pdf_file, _, seconds in results:
+            if pdf_file:
+                RENDER_SECONDS.labels(mode=mode).observe(seconds)
+
+    converted = [pdf_file for _, pdf_file, _, _ in results if pdf_file]
+    failed = [(path, error) for path, pdf_file, error, _ in results if not pdf_file]
+    # Workers only render; the manifest is updated here so it has a single writer.
+    mark_converted((path, pdf_file) for path, pdf_file, _, _ in results if pdf_file)
+    return converted, failed
+
+
+def convert_txt_to_pdf(input_file=None, mode="summary", appendix=False):
+    """
+    Converts text files to PDF format and moves the original text files to a report directory.
+    If no input file is given, every pending text file under Logs is converted.
+    """
+    setup_logging()
+    logging.info("Starting conversion process")
 
-        pdf = canvas.Canvas(output_file_path, pagesize=letter)
-        with open(input_file, 'r', encoding='utf-8') as file:
-            y_position = 10 * inch
-            for line in file:
-                if len(line) > 80:
-                    lines = [line[i:i + 60] for i in range(0, len(line), 60)]
-                    for line in lines:
-                        pdf.drawString(1 * inch, y_position, line.rstrip())
-                        y_position -= 0.5 * inch
-                else:
-                    pdf.drawString(1 * inch, y_position, line.rstrip())
-                    y_position -= 0.5 * inch
-                if y_position < 1 * inch:
-                    pdf.showPage()
-                    y_position = 10 * inch
-        pdf.save()
-
-        shutil.move(input_file, report_dir)
-        logging.info("Moved %s to %s", input_file, report_dir)  # Updated logging
+    try:
+        if input_file is not None:
+            mark_converted([(input_file, convert_file(input_file, mode, appendix))])
+        else:
+            converted, failed = convert_all(mode=mode, appendix=appendix)
+            if not converted and not failed:
+                logging.warning("No text files found in the directory.")
+            if failed:
+                logging.error("%d file(s) could not be converted", len(failed))
+                return 1
 
         logging.info("Conversion process completed successfully")
         return 0
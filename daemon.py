@@ -0,0 +1,445 @@
+"""
+Module for running the collect, render and deliver stages in one resident process.
+"""
+
+import os
+import sys
+import time
+import queue
+import signal
+import logging
+import threading
+from datetime import datetime
+
+import logger
+import convert
+import mail
+from store import SampleStore, SampleStoreHandler, write_text_view
+from sampler import AdaptiveInterval
+from dedup import DedupCache
+from writer import AsyncLogWriter
+from segments import SegmentManifest, open_manifest, next_boundary, segment_name, PENDING
+from checkpoint import Checkpointer, capture_state, load_checkpoint, restore_state, recover
+from metrics import MetricsServer, MetricsFileWriter
+from collector import SampleForwarder
+
+
+def setup_logging():
+    """
+    Sets up the logging configuration.
+    It creates a log directory with the current date and sets up a basic configuration for logging.
+    """
+    current_date = datetime.now().strftime('%d-%m-%Y')
+    log_dir = os.path.join(logger.resource_path("Logs"), current_date)
+    os.makedirs(log_dir, exist_ok=True)
+    log_file = os.path.join(log_dir, "daemon.log")
+    logging.basicConfig(
+        filename=log_file, level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+
+class TrackDaemon:
+    """
+    Samples continuously into segments that are rolled over at every
+    ``segment_minutes`` boundary, or earlier once a segment reaches
+    ``segment_max_bytes``. Finished segments are listed in the segment
+    manifest and rendered and mailed by a background worker, so collection
+    never pauses between segments.
+    """
+
+    def __init__(self, config_file=None):
+        self.config_file = config_file or logger.resource_path('config.json')
+        self.config = {}
+        self.stop_event = threading.Event()
+        self.reload_event = threading.Event()
+        self._config_mtime = None
+        self._finished = queue.Queue()
+        self._writer = None
+        self._store = None
+        self._store_handler = None
+        self._path = None
+        self._until = None
+        self._resume = None
+        self.manifest = SegmentManifest(logger.resource_path("Logs"))
+        self.load_config()
+        self.dedup = DedupCache(ttl=600)
+        # The process backend is chosen once; changing it requires a restart.
+        self.sampler = logger.build_sampler(backend=self.config.get("process_backend", "poll"), dedup=self.dedup)
+        self.sampler.register(self.record_samples)
+        self.sampler.register(self.check_config)
+        self.sampler.register(self.rotate_if_full)
+        # Like the backend, forwarding to a collector is set up once at start.
+        self.forwarder = None
+        if self.config.get("collector_url"):
+            self.forwarder = self.sampler.register(SampleForwarder(
+                self.config["collector_url"],
+                token=self.config.get("collector_token"),
+                flush_interval=self.config.get("collector_flush_interval", 10)
+            ))
+        # Off by default: it reads every process on every tick, so its cost
+        # grows with the process count. NumPy is only imported when enabled.
+        self.resources = None
+        if self.config.get("resource_sampling", False):
+            try:
+                from timeseries import ResourceSampler
+            except ImportError as e:
+                logging.error("Resource sampling needs NumPy, run req.py to install it: %s", str(e))
+            else:
+                self.resources = self.sampler.register(ResourceSampler())
+        # Registered last, so each checkpoint covers everything its tick recorded.
+        self.checkpointer = self.sampler.register(Checkpointer(self.manifest.logs_dir, self.checkpoint_state))
+        self.apply_config()
+
+    def load_config(self):
+        """
+        Reads config.json. Returns False and keeps the previous configuration if it cannot be read.
+        """
+        try:
+            self._config_mtime = os.path.getmtime(self.config_file)
+            self.config = mail.load_config(self.config_file)
+        except (OSError, ValueError) as e:
+            logging.error("Could not load configuration from %s: %s", self.config_file, str(e))
+            return False
+        logging.info("Configuration loaded from %s", self.config_file)
+        return True
+
+    def reload_config(self):
+        """
+        Reloads config.json and applies it to the running sampler.
+        """
+        if self.load_config():
+            self.apply_config()
+
+    def apply_config(self):
+        """
+        Applies the sampling settings of the configuration.
+        """
+        if self.config.get("adaptive_sampling", True):
+            self.sampler.adaptive = AdaptiveInterval(
+                floor=self.config.get("sample_interval_floor", 5),
+                ceiling=self.config.get("sample_interval_ceiling", 60),
+                cpu_budget=self.config.get("sample_cpu_budget", 0.01)
+            )
+        else:
+            self.sampler.adaptive = None
+            self.sampler.interval = self.config.get("sample_interval", 60)
+        self.checkpointer.interval = self.config.get("checkpoint_interval", 30)
+
+    def check_config(self, snapshot=None):
+        """
+        Reloads the configuration if a reload was requested or config.json changed.
+        It is registered as a sampler consumer so it runs once per tick.
+        """
+        if self.reload_event.is_set():
+            self.reload_event.clear()
+            self.reload_config()
+            return
+        try:
+            mtime = os.path.getmtime(self.config_file)
+        except OSError:
+            return
+        if mtime != self._config_mtime:
+            self.reload_config()
+
+    def install_signal_handlers(self):
+        """
+        Stops on SIGINT/SIGTERM and reloads the configuration on SIGHUP where available.
+        """
+        signal.signal(signal.SIGINT, lambda signum, frame: self.stop())
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, lambda signum, frame: self.reload_event.set())
+
+    def stop(self):
+        """
+        Requests a clean shutdown. The current sample file is still rendered and mailed.
+        """
+        logging.info("Shutdown requested")
+        self.stop_event.set()
+
+    def record_samples(self, snapshot):
+        """
+        Records process spawns and exits in the current binary sample store.
+        """
+        if self._store is not None:
+            self._store.record_snapshot(snapshot)
+
+    def _open_segment(self, resume=None):
+        """
+        Opens a new binary sample store, adds the segment to the manifest and,
+        unless the text log is disabled in the configuration, points the sample
+        logger at a new text file. Given the path of a segment recovered from a
+        checkpoint, appends to its files instead, with a text log only if it
+        already had one.
+        """
+        if resume is None:
+            with self.manifest.edit():
+                self._path = self.manifest.new_path(logger.sample_file_path())
+                self.manifest.add(self._path)
+            text_log = self.config.get("text_log", True)
+        else:
+            self._path = resume
+            text_log = os.path.exists(resume)
+        self._store = SampleStore(os.path.splitext(self._path)[0] + '.samples')
+        if text_log:
+            self._writer = AsyncLogWriter(
+                self._path,
+                max_queue=self.config.get("log_queue_size", 10000),
+                flush_interval=self.config.get("log_flush_interval", 1.0),
+                block_timeout=self.config.get("log_block_timeout")
+            ).start()
+            logger.sample_log.addHandler(self._writer.handler)
+            logger.sample_log.setLevel(logging.INFO)
+        else:
+            # Sample log records go into the sample store instead, and the
+            # text view is rendered from it when the segment is closed.
+            self._store_handler = SampleStoreHandler(self._store)
+            logger.sample_log.addHandler(self._store_handler)
+            logger.sample_log.setLevel(logging.INFO)
+        if resume is None:
+            logging.info("Collecting samples into %s", self._path)
+            logger.log_system_startup()
+        else:
+            logging.info("Resumed collecting samples into %s", self._path)
+
+    def _close_segment(self):
+        """
+        Detaches and closes the current sample files, rendering the text view
+        from the sample store if no text log was written, and queues the
+        segment for publishing.
+        """
+        path = self._path
+        if self._writer is not None:
+            logger.sample_log.removeHandler(self._writer.handler)
+            self._writer.stop()
+            self._writer = None
+        if self._store_handler is not None:
+            logger.sample_log.removeHandler(self._store_handler)
+            self._store_handler = None
+        self._store.close()
+        if not os.path.exists(path):
+            write_text_view(self._store.path, path)
+        if self.resources is not None:
+            self.save_resources(path)
+        self._store = None
+        self._path = None
+        with self.manifest.edit():
+            self.manifest.update(path, PENDING, end=time.time(), size=os.path.getsize(path))
+        self._finished.put(path)
+
+    def checkpoint_state(self):
+        """
+        Returns the state to checkpoint: the current segment and when it ends,
+        and the sampler, dedup and resource series state.
+        """
+        return capture_state(
+            self.manifest, self._path, self._until, self.sampler.table, self.dedup,
+            store=self._store, resources=self.resources, writer=self._writer
+        )
+
+    def save_resources(self, path):
+        """
+        Saves the resource series of a segment next to it and downsamples the
+        series of older segments.
+        """
+        import timeseries
+        try:
+            self.resources.save(path)
+            timeseries.downsample(
+                logger.resource_path("Logs"),
+                raw_days=self.config.get("resource_raw_days", 1),
+                minute_days=self.config.get("resource_minute_days", 7)
+            )
+        except (OSError, ValueError) as e:
+            logging.error("Could not save the resource series of %s: %s", path, str(e))
+
+    def segment_size(self):
+        """
+        Returns the number of bytes written to the current segment so far.
+        """
+        if self._writer is not None:
+            return self._writer.bytes_written
+        return self._store.size if self._store is not None else 0
+
+    def rotate_if_full(self, snapshot=None):
+        """
+        Rolls over to a new segment once the current one reaches segment_max_bytes,
+        so a busy hour cannot produce one oversized file.
+        It is registered as a sampler consumer so it runs once per tick.
+        """
+        limit = self.config.get("segment_max_bytes", 64 * 1024 * 1024)
+        if self._path is None or not limit or self.segment_size() < limit:
+            return
+        logging.info("Segment %s reached %d bytes, rolling over", self._path, self.segment_size())
+        self._close_segment()
+        self._open_segment()
+
+    def collect(self):
+        """
+        Samples until shutdown, queueing each finished segment for publishing.
+        """
+        while not self.stop_event.is_set():
+            self._open_segment(self._resume)
+            self._resume = None
+            try:
+                boundary = next_boundary(minutes=self.config.get("segment_minutes", 60))
+                self._until = boundary.timestamp()
+                self.sampler.run((boundary - datetime.now()).total_seconds(), self.stop_event)
+            finally:
+                self._close_segment()
+
+    def publish(self, path):
+        """
+        Renders a finished sample file to PDF and mails it. With digest set,
+        reports are mailed together once digest_size of them are waiting;
+        the rest go out with the next digest or at the next start.
+        """
+        try:
+            pdf_file = convert.convert_file(
+                path,
+                mode=self.config.get("report_mode", "summary"),
+                appendix=self.config.get("report_appendix", False),
+                max_pages=self.config.get("report_max_pages", convert.MAX_PAGES)
+            )
+        except (OSError, ValueError) as e:
+            logging.error("Could not convert %s: %s", path, str(e))
+            return 1
+        convert.mark_converted([(path, pdf_file)])
+        if convert.is_mailed(pdf_file):
+            return 0  # Mailed by an earlier run that stopped before updating the manifest
+        if self.config.get("digest", False):
+            waiting = len(mail.find_pending_reports(self.manifest.logs_dir))
+            if waiting < self.config.get("digest_size", 10):
+                logging.info("%d report(s) waiting for the next digest", waiting)
+                return 0
+            return mail.send_email("Activity Report", config=self.config)
+        return mail.send_email("Activity Report", pdf_file=pdf_file, config=self.config)
+
+    def catch_up(self, pending):
+        """
+        Converts segments left over from earlier runs in parallel and mails
+        them together with any reports that were never sent.
+        """
+        logging.info("Catching up on %d pending sample file(s)", len(pending))
+        _, failed = convert.convert_all(
+            pending,
+            mode=self.config.get("report_mode", "summary"),
+            appendix=self.config.get("report_appendix", False),
+            max_pages=self.config.get("report_max_pages", convert.MAX_PAGES)
+        )
+        for path, error in failed:
+            logging.error("Could not convert %s: %s", path, error)
+        # Mails every pending report, including ones converted but never sent.
+        mail.send_email("Activity Report", config=self.config)
+
+    def _publish_worker(self, pending):
+        """
+        Publishes leftover sample files, then finished sample files until
+        collection stops. When samples are forwarded to a collector, the fleet
+        report replaces the local one unless local_reports is set, and
+        finished segments stay pending in the manifest.
+        """
+        local = self.forwarder is None or self.config.get("local_reports", False)
+        if local:
+            try:
+                self.catch_up(pending)
+            except Exception:  # Whatever fails, keep publishing later segments
+                logging.exception("Could not catch up on pending segments")
+        while True:
+            path = self._finished.get()
+            if path is None:
+                return
+            if not local:
+                continue
+            try:
+                self.publish(path)
+            except Exception:
+                # The segment stays in the manifest and is retried on the next start.
+                logging.exception("Could not publish %s", path)
+
+    def recover(self):
+        """
+        Restores the state of the last checkpoint and picks the segment to
+        resume, if its period has not ended. Segments still marked active
+        otherwise were cut short by an earlier run and are marked pending.
+        """
+        checkpoint = load_checkpoint(self.manifest.logs_dir)
+        if checkpoint is None:
+            recover(self.manifest, None)
+            return
+        restore_state(checkpoint, self.sampler.table, self.dedup)
+        resumable = checkpoint if self.config.get("resume_segments", True) else None
+        self._resume, stale = recover(self.manifest, resumable)
+        if self.resources is None:
+            return
+        import timeseries
+        exes = checkpoint.get("resource_exes", [])
+        # Only the checkpointed segment has the names its spooled samples refer to.
+        for path in stale:
+            if checkpoint.get("segment") and segment_name(path) == segment_name(checkpoint["segment"]):
+                timeseries.save_spool(path, exes)
+        if self._resume is not None:
+            self.resources.resume(self._resume, exes)
+
+    def start_metrics(self):
+        """
+        Starts the metrics exporters enabled in the configuration: a Prometheus
+        endpoint on localhost at metrics_port and/or a file at metrics_file.
+        Returns the started exporters.
+        """
+        exporters = []
+        if self.config.get("metrics_port"):
+            try:
+                exporters.append(MetricsServer(int(self.config["metrics_port"])).start())
+            except OSError as e:
+                logging.error("Could not serve metrics on port %s: %s", self.config["metrics_port"], str(e))
+        if self.config.get("metrics_file"):
+            exporters.append(MetricsFileWriter(
+                logger.resource_path(self.config["metrics_file"]), interval=self.config.get("metrics_interval", 15)
+            ).start())
+        return exporters
+
+    def run(self):
+        """
+        Runs collection on the calling thread and publishing on a worker thread.
+        """
+        exporters = self.start_metrics()
+        if self.forwarder is not None:
+            self.forwarder.start()
+        logger.sample_log.propagate = False
+        self.manifest = open_manifest(self.manifest.logs_dir)
+        self.recover()
+        pending = convert.find_pending_logs()
+        publisher = threading.Thread(
+            target=self._publish_worker, args=(pending,), name="track-publisher"
+        )
+        publisher.start()
+        try:
+            self.collect()
+        finally:
+            # Keeps the dedup and process state for the next start.
+            self.checkpointer.save()
+            self._finished.put(None)
+            publisher.join()
+            if self.forwarder is not None:
+                self.forwarder.stop()
+            for exporter in exporters:
+                exporter.stop()
+        logging.info("Daemon stopped")
+        return 0
+
+
+def main():
+    """
+    This is the main function of the script.
+    It starts the daemon and runs until it is asked to stop.
+    """
+    setup_logging()
+    daemon = TrackDaemon()
+    daemon.install_signal_handlers()
+    return daemon.run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""
+Module for bounded, time-based deduplication of log entries.
+"""
+
+import time
+from collections import OrderedDict
+from metrics import REGISTRY
+
+DEDUP_CHECKS = REGISTRY.counter(
+    "track_dedup_checks_total", "Dedup checks, by whether the key was logged recently (hit) or not (miss).",
+    ("result",)
+)
+_HITS = DEDUP_CHECKS.labels(result="hit")
+_MISSES = DEDUP_CHECKS.labels(result="miss")
+
+
+class DedupCache:
+    """
+    Remembers which keys were logged recently so they are not logged again
+    until ``ttl`` seconds have passed.
+
+    Every entry shares the same ttl, so keeping the keys in the order they
+    were last logged also keeps them in expiry order: expired entries are
+    always at the front and are dropped in bulk, and once ``max_size`` is
+    reached the oldest entry is evicted first. Checks are O(1) and use the
+    monotonic clock, so wall clock changes do not affect them.
+    """
+
+    def __init__(self, ttl=600, max_size=65536, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._clock = clock
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        logged_at = self._entries.get(key)
+        return logged_at is not None and self._clock() - logged_at <= self.ttl
+
+    def expire(self, now=None):
+        """
+        Drops every entry older than the ttl and returns how many were dropped.
+        """
+        if now is None:
+            now = self._clock()
+        deadline = now - self.ttl
+        entries = self._entries
+        dropped = 0
+        while entries:
+            key, logged_at = next(iter(entries.items()))
+            if logged_at >= deadline:
+                break
+            del entries[key]
+            dropped += 1
+        return dropped
+
+    def state(self):
+        """
+        Returns the entries within the ttl as [key, age in seconds] pairs,
+        oldest first, e.g. for a checkpoint.
+        """
+        now = self._clock()
+        self.expire(now)
+        return [[key, now - logged_at] for key, logged_at in self._entries.items()]
+
+    def restore(self, entries, elapsed=0):
+        """
+        Adds entries returned by state() ``elapsed`` seconds ago, keeping
+        them in expiry order.
+        """
+        now = self._clock()
+        for key, age in entries:
+            self._entries[key] = now - age - elapsed
+            self._entries.move_to_end(key)
+        self.expire(now)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def should_log(self, key):
+        """
+        Returns True and records the key if it has not been logged within the
+        ttl, otherwise returns False.
+        """
+        now = self._clock()
+        logged_at = self._entries.get(key)
+        if logged_at is not None and now - logged_at <= self.ttl:
+            _HITS.inc()
+            return False
+        _MISSES.inc()
+        self._entries[key] = now
+        self._entries.move_to_end(key)
+        self.expire(now)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return True
@@ -0,0 +1,104 @@
+"""
+Module for sampling per-process I/O activity from the shared process snapshot.
+"""
+
+import time
+from collections import namedtuple
+import psutil
+
+# I/O of one process over one interval. ``open_files`` is None unless the
+# process was among the top consumers and its open files were looked up.
+IOUsage = namedtuple('IOUsage', [
+    'pid', 'exe', 'read_bytes', 'write_bytes', 'read_count', 'write_count', 'fds', 'open_files'
+])
+
+
+def format_io_usage(usage):
+    """
+    Formats the I/O of a process over one interval for the sample log.
+    """
+    text = f"{usage.exe} | read={usage.read_bytes} write={usage.write_bytes} " \
+           f"reads={usage.read_count} writes={usage.write_count}"
+    if usage.fds is not None:
+        text += f" fds={usage.fds}"
+    if usage.open_files:
+        text += f" files={';'.join(usage.open_files[:5])}"
+    return text
+
+
+def count_descriptors(proc):
+    """
+    Returns the number of open file descriptors (POSIX) or handles (Windows) of a process.
+    """
+    if psutil.WINDOWS:
+        return proc.num_handles()
+    return proc.num_fds()
+
+
+class IOSampler:
+    """
+    Tracks per-process I/O counters between snapshots and reports the processes
+    with the most I/O in each interval. Processes whose counters did not change
+    are skipped, descriptor counts are only read for the top consumers, and the
+    expensive open files lookup only runs for the top few, at most once every
+    ``open_files_interval`` seconds per process.
+    """
+
+    def __init__(self, top=10, open_files_top=3, open_files_interval=300, clock=time.monotonic):
+        self.top = top
+        self.open_files_top = open_files_top
+        self.open_files_interval = open_files_interval
+        self.supported = hasattr(psutil.Process, 'io_counters')
+        self._clock = clock
+        self._counters = {}
+        self._open_files_checked = {}
+
+    def sample(self, snapshot):
+        """
+        Returns the IOUsage of the top I/O consumers since the previous snapshot,
+        ordered by bytes read and written.
+        """
+        for info in snapshot.exited:
+            key = (info['pid'], info.get('create_time'))
+            self._counters.pop(key, None)
+            self._open_files_checked.pop(key, None)
+        if not self.supported:
+            return []
+
+        active = []
+        for info in snapshot.processes:
+            proc = snapshot.handles.get(info['pid'])
+            if proc is None:
+                continue
+            key = (info['pid'], info.get('create_time'))
+            try:
+                counters = proc.io_counters()
+            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+                continue
+            current = (counters.read_bytes, counters.write_bytes, counters.read_count, counters.write_count)
+            previous = self._counters.get(key)
+            self._counters[key] = current
+            if previous is None or previous == current:
+                continue  # First sighting only sets the baseline
+            delta = tuple(now - before for now, before in zip(current, previous))
+            active.append((delta[0] + delta[1], info, proc, delta))
+
+        active.sort(key=lambda item: item[0], reverse=True)
+        now = self._clock()
+        usage = []
+        for rank, (_, info, proc, delta) in enumerate(active[:self.top]):
+            key = (info['pid'], info.get('create_time'))
+            try:
+                fds = count_descriptors(proc)
+            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+                fds = None
+            open_files = None
+            if rank < self.open_files_top and \
+               now - self._open_files_checked.get(key, float('-inf')) >= self.open_files_interval:
+                self._open_files_checked[key] = now
+                try:
+                    open_files = [f.path for f in proc.open_files()]
+                except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+                    pass
+            usage.append(IOUsage(info['pid'], info.get('exe'), *delta, fds, open_files))
+        return usage
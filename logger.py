@@ -5,12 +5,26 @@ Module for system monitoring and logging.
 
 import os
 import time
-from datetime import datetime, timedelta
+import atexit
+from datetime import datetime
 import sys
 import logging
 import socket
-import threading
+import functools
+import itertools
 import psutil
+from sampler import ProcessSampler, AdaptiveInterval
+from dedup import DedupCache
+from store import SampleStore
+from iostats import IOSampler, format_io_usage
+from proc_events import create_process_table
+from writer import AsyncLogWriter
+from segments import SegmentManifest, PENDING
+from checkpoint import Checkpointer, capture_state, load_checkpoint, restore_state, recover
+
+# Sample records go through their own logger so a long-running process can
+# point them at the current sample file without touching its other logging.
+sample_log = logging.getLogger("track.samples")
 
 def resource_path(relative_path):
     """
@@ -22,99 +36,134 @@ def resource_path(relative_path):
         base_path = os.path.abspath(os.path.dirname(__file__))
     return os.path.join(base_path, relative_path)
 
-def setup_logging():
+def sample_file_path(now=None):
     """
-    Sets up the logging configuration.
+    Returns the path of the sample log file for the given time, creating its
+    date directory if needed.
     """
-    current_date = datetime.now().strftime('%d-%m-%Y')
-    log_dir = os.path.join(resource_path("Logs"), current_date)
+    now = now or datetime.now()
+    log_dir = os.path.join(resource_path("Logs"), now.strftime('%d-%m-%Y'))
     os.makedirs(log_dir, exist_ok=True)
-    log_file = os.path.join(
-        log_dir, 
-        f"system_monitor_{datetime.now().strftime('%d-%m-%Y_%H-%M')}.txt"
-    )
+    return os.path.join(log_dir, f"system_monitor_{now.strftime('%d-%m-%Y_%H-%M')}.txt")
+
+def setup_logging(log_file=None):
+    """
+    Sets up the logging configuration.
+    Records are written to the log file by a background writer thread, appending
+    to the given log file or a new one for the current time. Returns the log
+    file and the writer.
+    """
+    log_file = log_file or SegmentManifest(resource_path("Logs")).new_path(sample_file_path())
+    writer = AsyncLogWriter(log_file).start()
+    atexit.register(writer.stop)
+    # Replaces the default handler set up if anything was logged during recovery.
     logging.basicConfig(
-        filename=log_file, 
-        level=logging.INFO, 
-        format='%(asctime)s - %(levelname)s - %(message)s'
+        handlers=[writer.handler],
+        level=logging.INFO,
+        force=True
     )
+    return log_file, writer
 
 def log_system_startup():
     """
     Logs system startup information.
     """
     computer_name = socket.gethostname()
-    logging.info("Computer Name: %s", computer_name)
+    sample_log.info("Computer Name: %s", computer_name)
     print(f"Computer Name: {computer_name}")
     boot_time = datetime.fromtimestamp(psutil.boot_time()).strftime("%d-%m-%Y")
-    logging.info("System Startup: %s", boot_time)
+    sample_log.info("System Startup: %s", boot_time)
     print(f"System Startup: {boot_time}")
 
-def monitor_system_processes():
-    """
-    Monitors system processes for a specified duration.
-    """
-    last_logged_processes = {}
-    start_time = datetime.now()
-    while datetime.now() - start_time < timedelta(hours=1):
-        current_time = datetime.now().strftime("%d-%m-%Y_%H-%M")
-        logging.info("Process Check: %s", current_time)
-        for proc in psutil.process_iter(['pid', 'exe']):
-            try:
-                info = proc.info
-                process_key = f"{info['exe']}"
-                if process_key not in last_logged_processes or datetime.now() - last_logged_processes[process_key] > timedelta(minutes=10):
-                    logging.info("Process: %s", info['exe'])
-                    last_logged_processes[process_key] = datetime.now()
-            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-                pass
-        time.sleep(60)
-
-def monitor_system_file_operations():
-    """
-    Monitors system file operations for a specified duration.
-    """
-    last_logged_file_operations = {}
-    start_time = datetime.now()
-    while datetime.now() - start_time < timedelta(hours=1):
-        current_time = datetime.now().strftime("%d-%m-%Y_%H-%M")
-        logging.info("File Operation Check: %s", current_time)
-        for proc in psutil.process_iter(['pid', 'exe']):
-            try:
-                info = proc.info
-                if info['exe']:
-                    file_operation_key = f"{info['exe']}"
-                    if file_operation_key not in last_logged_file_operations or datetime.now() - last_logged_file_operations[file_operation_key] > timedelta(minutes=10):
-                        logging.info("File Operation: %s", info['exe'])
-                        last_logged_file_operations[file_operation_key] = datetime.now()
-            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-                pass
-        time.sleep(60)
+def log_processes(snapshot, last_logged_processes):
+    """
+    Logs the processes in a snapshot, skipping any logged in the last 10 minutes.
+    Processes that started and exited between two snapshots are logged as well.
+    """
+    current_time = datetime.fromtimestamp(snapshot.time).strftime("%d-%m-%Y_%H-%M")
+    sample_log.info("Process Check: %s", current_time)
+    short_lived = (info for info in snapshot.spawned if info['pid'] not in snapshot.handles)
+    for info in itertools.chain(snapshot.processes, short_lived):
+        if last_logged_processes.should_log(info['exe']):
+            sample_log.info("Process: %s", info['exe'])
 
-def main():
+def log_file_operations(snapshot, io_sampler):
     """
-    Main function to execute the system monitoring tasks.
+    Logs the processes with the most file I/O since the previous snapshot.
     """
-    current_date = datetime.now().strftime('%d-%m-%Y')
-    log_dir = os.path.join(resource_path("Logs"), current_date)
-    os.makedirs(log_dir, exist_ok=True)
-    txt_files = [f for f in os.listdir(log_dir) if f.endswith('.txt')]
-    print("Text files found:", txt_files)
-    if txt_files:
-        print("A txt file already exists in the path. Exiting the program.")
-        return 1  # Ensure consistent return
+    current_time = datetime.fromtimestamp(snapshot.time).strftime("%d-%m-%Y_%H-%M")
+    sample_log.info("File Operation Check: %s", current_time)
+    for usage in io_sampler.sample(snapshot):
+        # The usage itself goes along for SampleStoreHandler, which keeps the counters as numbers.
+        sample_log.info("File Operation: %s", format_io_usage(usage), extra={"io_usage": usage})
 
-    setup_logging()
-    log_system_startup()
+def build_sampler(interval=60, adaptive=None, backend="poll", dedup=None):
+    """
+    Returns a sampler with the process and file operation monitors registered,
+    sharing one process table scan per tick between both. The backend is
+    "poll", "netlink" or "auto" as accepted by create_process_table. A dedup
+    cache can be passed in to keep or restore which processes were logged.
+    """
+    sampler = ProcessSampler(
+        interval=interval, adaptive=adaptive,
+        table=create_process_table(['pid', 'exe'], backend)
+    )
+    last_logged_processes = dedup if dedup is not None else DedupCache(ttl=600)
+    sampler.register(functools.partial(log_processes, last_logged_processes=last_logged_processes))
+    sampler.register(functools.partial(log_file_operations, io_sampler=IOSampler()))
+    return sampler
 
-    process_thread = threading.Thread(target=monitor_system_processes)
-    file_operation_thread = threading.Thread(target=monitor_system_file_operations)
+def monitor_system(duration=3600, stop_event=None, store=None, log_file=None, checkpoint=None, writer=None):
+    """
+    Monitors system processes and file operations for a specified duration.
+    If a sample store is given, process spawns and exits are recorded in it as well.
+    If the log file of the segment is given, the sampler and dedup state are
+    checkpointed every 30 seconds, starting from the given checkpoint if any,
+    after syncing the writer of the log file.
+    """
+    dedup = DedupCache(ttl=600)
+    sampler = build_sampler(adaptive=AdaptiveInterval(floor=5, ceiling=60), dedup=dedup)
+    if store is not None:
+        sampler.register(store.record_snapshot)
+    if log_file is not None:
+        if checkpoint is not None:
+            restore_state(checkpoint, sampler.table, dedup)
+        manifest = SegmentManifest(resource_path("Logs"))
+        until = time.time() + duration
+        sampler.register(Checkpointer(
+            manifest.logs_dir, lambda: capture_state(manifest, log_file, until, sampler.table, dedup, store, writer=writer)
+        ))
+    sampler.run(duration, stop_event)
 
-    process_thread.start()
-    file_operation_thread.start()
+def main():
+    """
+    Main function to execute the system monitoring tasks.
+    A segment cut short by a crash or reboot is resumed for the rest of its hour.
+    """
+    manifest = SegmentManifest(resource_path("Logs"))
+    checkpoint = load_checkpoint(manifest.logs_dir)
+    resume, _ = recover(manifest, checkpoint)
+    if resume is None:
+        with manifest.edit():
+            log_file = manifest.new_path(sample_file_path())
+            manifest.add(log_file)
+    else:
+        log_file = resume
+    _, writer = setup_logging(log_file)
+    if resume is None:
+        log_system_startup()
+        duration = 3600
+    else:
+        duration = checkpoint["until"] - time.time()
 
-    process_thread.join()
-    file_operation_thread.join()
+    store = SampleStore(os.path.splitext(log_file)[0] + '.samples')
+    try:
+        monitor_system(duration, store=store, log_file=log_file, checkpoint=checkpoint, writer=writer)
+    finally:
+        store.close()
+        writer.stop()
+        with manifest.edit():
+            manifest.update(log_file, PENDING, end=time.time())
 
     return 0
 
@@ -1,10 +1,15 @@
 import os
 import time
-from datetime import datetime, timedelta
-import psutil
-import threading
+import atexit
+from datetime import datetime
+import functools
 import sys
 import logging
+from sampler import ProcessSampler, AdaptiveInterval
+from dedup import DedupCache
+from iostats import IOSampler
+from segments import SegmentManifest, PENDING
+from writer import AsyncLogWriter
 
 
 def resource_path(relative_path):
@@ -21,7 +26,8 @@ def resource_path(relative_path):
 def setup_logging():
     """
     This function sets up the logging configuration.
-    It creates a log directory with the current date and sets up a basic configuration for logging.
+    It creates a log directory with the current date and writes the log records
+    to a file there from a background writer thread, which it returns with the file.
     """
     current_date = datetime.now().strftime('%d-%m-%Y')
     log_dir = os.path.join(resource_path("Logs"), current_date)
@@ -29,10 +35,14 @@ def setup_logging():
     log_file = os.path.join(
         log_dir, f"system_monitor_{datetime.now().strftime('%d-%m-%Y_%H-%M')}.txt"
     )
+    writer = AsyncLogWriter(log_file).start()
+    atexit.register(writer.stop)
     logging.basicConfig(
-        filename=log_file, level=logging.INFO,
-        format='%(asctime)s - %(levelname)s - %(message)s'
+        handlers=[writer.handler],
+        level=logging.INFO,
+        force=True
     )
+    return log_file, writer
 
 
 def log_system_startup():
@@ -49,51 +59,42 @@ def log_system_startup():
     print(f"Workflow Run ID: {run_id}")
 
 
-def monitor_system_processes(duration):
+def log_processes(snapshot, last_logged_processes):
     """
-    This function monitors system processes.
+    This function logs the processes in a snapshot.
     It logs processes that have started or restarted within the last 10 minutes.
     """
-    last_logged_processes = {}
-    start_time = datetime.now()
-    while datetime.now() - start_time < timedelta(seconds=duration):
-        current_time = datetime.now().strftime("%d-%m-%Y_%H-%M")
-        logging.info(f"Process Check: {current_time}")
-        for proc in psutil.process_iter(['pid', 'name']):
-            try:
-                info = proc.info
-                process_key = f"{info['name']}"
-                if process_key not in last_logged_processes or \
-                   datetime.now() - last_logged_processes[process_key] > timedelta(minutes=10):
-                    logging.info(f"Process: {info['name']}")
-                    last_logged_processes[process_key] = datetime.now()
-            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-                pass
-        time.sleep(1)
-
-
-def monitor_system_file_operations(duration):
+    current_time = datetime.fromtimestamp(snapshot.time).strftime("%d-%m-%Y_%H-%M")
+    logging.info(f"Process Check: {current_time}")
+    for info in snapshot.processes:
+        if last_logged_processes.should_log(info['name']):
+            logging.info(f"Process: {info['name']}")
+
+
+def log_file_operations(snapshot, io_sampler):
+    """
+    This function logs file operations.
+    It logs the processes with the most file I/O since the previous snapshot.
+    """
+    current_time = datetime.fromtimestamp(snapshot.time).strftime("%d-%m-%Y_%H-%M")
+    logging.info(f"File Operation Check: {current_time}")
+    for usage in io_sampler.sample(snapshot):
+        logging.info(f"File Operation: {usage.exe} | read={usage.read_bytes} write={usage.write_bytes}")
+
+
+def monitor_system(duration):
     """
-    This function monitors system file operations.
-    It logs file operations that have occurred within the last 10 minutes.
+    This function monitors system processes and file operations.
+    Both monitors share a single process table scan, taken every 1 to 5 seconds
+    depending on process churn.
     """
-    last_logged_file_operations = {}
-    start_time = datetime.now()
-    while datetime.now() - start_time < timedelta(seconds=duration):
-        current_time = datetime.now().strftime("%d-%m-%Y_%H-%M")
-        logging.info(f"File Operation Check: {current_time}")
-        for proc in psutil.process_iter(['pid', 'name']):
-            try:
-                info = proc.info
-                if info['name']:
-                    file_operation_key = f"{info['name']}"
-                    if file_operation_key not in last_logged_file_operations or \
-                       datetime.now() - last_logged_file_operations[file_operation_key] > timedelta(minutes=10):
-                        logging.info(f"File Operation: {info['name']}")
-                        last_logged_file_operations[file_operation_key] = datetime.now()
-            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-                pass
-        time.sleep(1)
+    sampler = ProcessSampler(
+        attrs=['pid', 'name', 'exe'], interval=1,
+        adaptive=AdaptiveInterval(floor=1, ceiling=5, cpu_budget=0.05)
+    )
+    sampler.register(functools.partial(log_processes, last_logged_processes=DedupCache(ttl=600)))
+    sampler.register(functools.partial(log_file_operations, io_sampler=IOSampler()))
+    sampler.run(duration)
 
 
 def main():
@@ -103,30 +104,23 @@ def main():
     """
     duration = 10  # Set duration to 10 seconds
 
-    current_date = datetime.now().strftime('%d-%m-%Y')
-    log_dir = os.path.join(resource_path("Logs"), current_date)
-    os.makedirs(log_dir, exist_ok=True)
-    txt_files = [f for f in os.listdir(log_dir) if f.endswith('.txt')]
-    print("Text files found:", txt_files)
-    if txt_files:
-        print("A txt file already exists in the path. Exiting the program.")
-    else:
-        try:
-            setup_logging()
-            log_system_startup()
-
-            process_thread = threading.Thread(target=monitor_system_processes, args=(duration,))
-            file_operation_thread = threading.Thread(target=monitor_system_file_operations, args=(duration,))
-
-            process_thread.start()
-            file_operation_thread.start()
-
-            process_thread.join()
-            file_operation_thread.join()
-        except Exception as e:
-            logging.error(f"An error occurred: {str(e)}")
-            return 1
-        return 0
+    log_file, writer = setup_logging()
+    manifest = SegmentManifest(resource_path("Logs"))
+    with manifest.edit():
+        manifest.add(log_file)
+    try:
+        log_system_startup()
+
+        monitor_system(duration)
+    except Exception as e:
+        logging.error(f"An error occurred: {str(e)}")
+        return 1
+    finally:
+        # The segment is only handed over once all of its text is on disk.
+        writer.stop()
+        with manifest.edit():
+            manifest.update(log_file, PENDING, end=time.time())
+    return 0
 
 
 if __name__ == "__main__":
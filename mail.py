@@ -3,12 +3,16 @@ Module for sending emails with attachments and logging the process.
 """
 
 import smtplib  # Import the smtplib module for sending emails
-from email.mime.multipart import MIMEMultipart  # Import MIMEMultipart for creating email messages
 from email.mime.text import MIMEText  # Import MIMEText for creating text parts of email messages
-from email.mime.base import MIMEBase  # Import MIMEBase for creating base parts of email messages
-from email import encoders  # Import encoders for encoding email attachments
+from email.header import Header  # Import Header for encoding non-ASCII header values
+from email import policy  # Import policy for generating CRLF line endings
+from email import utils  # Import utils for message dates and ids
+import base64  # Import base64 for encoding attachments in chunks
+import gzip  # Import gzip for compressing attachments
+import zipfile  # Import zipfile for bundling attachments
+import mimetypes  # Import mimetypes for attachment content types
+import tempfile  # Import tempfile for spooling messages to disk
 import os  # Import the os module for file operations
-import glob  # Import the glob module for finding files
 import shutil  # Import the shutil module for file copying and moving
 import time  # Import the time module for time-related operations
 import sys  # Import the sys module for system-specific parameters and functions
@@ -16,6 +20,15 @@ import logging  # Import the logging module for logging events
 from datetime import datetime  # Import the datetime module for date and time operations
 import socket  # Add this import at the top for getting the hostname
 import json  # Import the json module for reading configuration files
+from segments import SegmentManifest, open_manifest, CONVERTED, MAILED  # Import the segment manifest
+from metrics import REGISTRY  # Import the metrics registry
+
+SMTP_SECONDS = REGISTRY.histogram(
+    "track_smtp_seconds", "Time taken to connect to the SMTP server or to send one email.", ("step",)
+)
+SMTP_ATTEMPTS = REGISTRY.counter(
+    "track_smtp_attempts_total", "Attempts to send an email, by outcome.", ("outcome",)
+)
 
 def resource_path(relative_path):
     """
@@ -52,85 +65,309 @@ def load_config(config_file):
         config = json.load(file)
     return config
 
-def send_email(body="Please find the attached report of last 1 hour."):
+def smtp_settings(config):
     """
-    This function sends an email with an attachment.
-    It sets up logging, constructs the email, attaches a PDF file, and sends the email.
+    This function returns the SMTP server settings from the configuration.
+    Login is skipped when smtp_login is false, e.g. for a local SMTP stand-in.
     """
-    setup_logging()  # Set up logging
-    logging.info("Starting email sending process")
+    return {
+        "host": config.get("smtp_host", "smtp.gmail.com"),
+        "port": int(config.get("smtp_port", 587)),
+        "starttls": config.get("smtp_starttls", True),
+        "login": config.get("smtp_login", True),
+        "timeout": config.get("smtp_timeout", 60),
+    }
 
-    # Load configuration
-    config = load_config(resource_path('config.json'))
-    
-    fromaddr = config.get("fromaddr")
-    toaddr = config.get("toaddr")
-    password = config.get("password")
-    
-    if not all([fromaddr, toaddr, password]):
-        logging.error("Email configuration is missing required fields.")
-        return 1
+def check_config(config):
+    """
+    This function returns True if the configuration has every field needed to send email.
+    """
+    required = [config.get("fromaddr"), config.get("toaddr")]
+    if smtp_settings(config)["login"]:
+        required.append(config.get("password"))
+    return all(required)
 
-    try:
-        hostname = socket.gethostname()  # Get the hostname of the PC
-        subject = f"{hostname} - Hourly Report"  # Set the subject
+def find_pending_reports(logs_dir=None):
+    """
+    This function returns every PDF report still waiting to be mailed, oldest
+    first, as listed in the segment manifest of the Logs directory.
+    """
+    logs_dir = logs_dir or resource_path("Logs")
+    return [path for path in open_manifest(logs_dir).files(CONVERTED, "pdf") if os.path.exists(path)]
 
-        msg = MIMEMultipart()  # Create a message
-        msg['From'] = fromaddr  # Set the sender
-        msg['To'] = toaddr  # Set the receiver
-        msg['Subject'] = subject  # Updated subject
+def mark_mailed(pdf_files, logs_dir=None):
+    """
+    This function records mailed reports in the segment manifest, with their archived location.
+    """
+    manifest = SegmentManifest(logs_dir or resource_path("Logs"))
+    with manifest.edit():
+        for pdf_file in pdf_files:
+            archived = os.path.join(os.path.dirname(pdf_file), "reports", "pdf", os.path.basename(pdf_file))
+            manifest.update(pdf_file, MAILED, pdf=archived, mailed=time.time())
 
-        msg.attach(MIMEText(body, 'plain'))  # Attach the body of the email
+# Attachments are base64-encoded 57 bytes per 76-character line, this many lines at a time.
+ENCODE_CHUNK_SIZE = 57 * 1024
+SEND_CHUNK_SIZE = 64 * 1024
+# Content types of compressed attachments, by the encoding mimetypes reports.
+COMPRESSED_TYPES = {"gzip": "application/gzip", "bzip2": "application/x-bzip2", "xz": "application/x-xz"}
 
-        # Search for PDF files in the Logs directory with the current date
-        current_date = datetime.now().strftime('%d-%m-%Y')
-        log_dir = resource_path(os.path.join("Logs", current_date))
-        pdf_files = glob.glob(os.path.join(log_dir, "*.pdf"))
-        
-        if len(pdf_files) != 1:
-            logging.error("There must be exactly one PDF file in the Logs directory.")
-            return 1
+def report_attachments(pdf_file, attach_logs=False):
+    """
+    This function returns the files to attach for a report: the PDF and, if
+    requested, the text log and binary sample files it was rendered from.
+    """
+    attachments = [pdf_file]
+    if attach_logs:
+        log_dir = os.path.dirname(pdf_file)
+        stem = os.path.splitext(os.path.basename(pdf_file))[0]
+        for path in (os.path.join(log_dir, "reports", "text", stem + ".txt"),
+                     os.path.join(log_dir, stem + ".samples"),
+                     os.path.join(log_dir, stem + ".strings"),
+                     os.path.join(log_dir, stem + ".io")):
+            if os.path.exists(path):
+                attachments.append(path)
+    return attachments
 
-        pdf_file = pdf_files[0]
-        filename = os.path.basename(pdf_file)
+def compress_attachments(paths, method, temp_dir):
+    """
+    This function compresses attachments into temp_dir, streaming from disk.
+    With "gzip" every file is compressed on its own, with "zip" all files go
+    into one archive. Without a method the files are attached as they are.
+    """
+    if not method:
+        return list(paths)
+    if method == "gzip":
+        compressed = []
+        for path in paths:
+            target = os.path.join(temp_dir, os.path.basename(path) + ".gz")
+            with open(path, "rb") as source, gzip.open(target, "wb") as destination:
+                shutil.copyfileobj(source, destination, ENCODE_CHUNK_SIZE)
+            compressed.append(target)
+        return compressed
+    if method == "zip":
+        stem = os.path.splitext(os.path.basename(paths[0]))[0]
+        target = os.path.join(temp_dir, stem + ".zip")
+        with zipfile.ZipFile(target, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            for path in paths:
+                archive.write(path, os.path.basename(path))
+        return [target]
+    raise ValueError(f"Unknown attachment compression: {method}")
 
+def write_message(spool, fromaddr, toaddr, subject, body, attachments):
+    """
+    This function writes a multipart email with the given attachments to a
+    binary spool file, ready to be sent as SMTP DATA. Attachments are read and
+    base64-encoded in chunks, so no full copy of them is held in memory.
+    """
+    boundary = utils.make_msgid().strip("<>").replace("@", "=_")
+    headers = [
+        f"From: {fromaddr}",
+        f"To: {toaddr}",
+        f"Subject: {subject if subject.isascii() else Header(subject, 'utf-8').encode()}",
+        f"Date: {utils.formatdate(localtime=True)}",
+        f"Message-ID: {utils.make_msgid()}",
+        "MIME-Version: 1.0",
+        f'Content-Type: multipart/mixed; boundary="{boundary}"',
+    ]
+    spool.write(("\r\n".join(headers) + "\r\n\r\n").encode("ascii"))
+
+    text = MIMEText(body, 'plain', 'utf-8').as_bytes(policy=policy.SMTP)
+    spool.write(f"--{boundary}\r\n".encode("ascii") + text + b"\r\n")
+
+    for path in attachments:
+        filename = os.path.basename(path)
         logging.info("Attaching file: %s", filename)  # Updated logging
-        with open(pdf_file, "rb") as attachment:
-            part = MIMEBase('application', 'octet-stream')
-            part.set_payload(attachment.read())
-
-        encoders.encode_base64(part)
-        part.add_header(
-            'Content-Disposition', 
-            f"attachment; filename={filename}"
-        )  # Updated formatting
-        msg.attach(part)
-
-        logging.info("Connecting to SMTP server")
-        with smtplib.SMTP('smtp.gmail.com', 587) as server:
+        content_type, encoding = mimetypes.guess_type(filename)
+        if encoding:
+            # A compressed attachment, e.g. report.pdf.gz, is sent as the archive it is.
+            content_type = COMPRESSED_TYPES.get(encoding, "application/octet-stream")
+        content_type = content_type or "application/octet-stream"
+        spool.write((
+            f"--{boundary}\r\n"
+            f'Content-Type: {content_type}; name="{filename}"\r\n'
+            "Content-Transfer-Encoding: base64\r\n"
+            f'Content-Disposition: attachment; filename="{filename}"\r\n\r\n'
+        ).encode("utf-8"))
+        with open(path, "rb") as attachment:
+            while True:
+                chunk = attachment.read(ENCODE_CHUNK_SIZE)
+                if not chunk:
+                    break
+                for offset in range(0, len(chunk), 57):
+                    spool.write(base64.b64encode(chunk[offset:offset + 57]) + b"\r\n")
+    spool.write(f"--{boundary}--\r\n".encode("ascii"))
+
+def send_spooled(server, fromaddr, toaddr, spool):
+    """
+    This function sends a spooled message over an open SMTP connection in
+    chunks, instead of building the whole message as one string.
+    Lines of the spooled message never start with a dot, so no dot-stuffing is needed.
+    """
+    server.ehlo_or_helo_if_needed()
+    code, response = server.mail(fromaddr)
+    if code != 250:
+        raise smtplib.SMTPSenderRefused(code, response, fromaddr)
+    code, response = server.rcpt(toaddr)
+    if code not in (250, 251):
+        raise smtplib.SMTPRecipientsRefused({toaddr: (code, response)})
+    code, response = server.docmd("DATA")
+    if code != 354:
+        raise smtplib.SMTPDataError(code, response)
+    spool.seek(0)
+    while True:
+        chunk = spool.read(SEND_CHUNK_SIZE)
+        if not chunk:
+            break
+        server.send(chunk)
+    server.send(b".\r\n")
+    code, response = server.getreply()
+    if code != 250:
+        raise smtplib.SMTPDataError(code, response)
+
+def connect(config):
+    """
+    This function opens an SMTP connection, upgrading it to TLS and logging in
+    as configured.
+    """
+    settings = smtp_settings(config)
+    logging.info("Connecting to SMTP server %s:%d", settings["host"], settings["port"])
+    server = smtplib.SMTP(settings["host"], settings["port"], timeout=settings["timeout"])
+    try:
+        if settings["starttls"]:
             server.starttls()
-            server.login(fromaddr, password)
+        if settings["login"]:
+            server.login(config.get("fromaddr"), config.get("password"))
+    except BaseException:
+        server.close()
+        raise
+    return server
+
+def archive_report(pdf_file):
+    """
+    This function moves a mailed PDF file to the Logs/<date>/reports/pdf folder.
+    """
+    reports_dir = os.path.join(os.path.dirname(pdf_file), "reports", "pdf")  # Updated path
+    os.makedirs(reports_dir, exist_ok=True)  # Create the directory if it doesn't exist
+
+    destination_file = os.path.join(reports_dir, os.path.basename(pdf_file))
+    shutil.move(pdf_file, destination_file)
+    logging.info("Moved PDF file to: %s", destination_file)  # Updated logging
+    return destination_file
+
+def deliver_reports(pdf_files, config, body="Activity Report", digest=False,
+                    digest_size=10, retries=3, backoff=2, title="Hourly Report"):
+    """
+    This function mails PDF reports over a single authenticated SMTP connection.
+    Each report is sent as its own email, or in digest mode up to digest_size
+    reports are packed into one email. A failed send is retried on a fresh
+    connection with exponential backoff. Sent reports are moved to reports/pdf.
+    Attachments are compressed as set by attachment_compression ("gzip" or "zip")
+    and the source logs are attached as well when attach_logs is set.
+    The subject is the hostname followed by the title.
+    Returns the list of reports that could not be sent.
+    """
+    fromaddr = config.get("fromaddr")
+    toaddr = config.get("toaddr")
+    compression = config.get("attachment_compression")
+    attach_logs = config.get("attach_logs", False)
+    hostname = socket.gethostname()  # Get the hostname of the PC
+
+    if digest:
+        batches = [pdf_files[i:i + digest_size] for i in range(0, len(pdf_files), digest_size)]
+    else:
+        batches = [[pdf_file] for pdf_file in pdf_files]
 
-            logging.info("Sending email")
-            text = msg.as_string()
-            server.sendmail(fromaddr, toaddr, text)
+    server = None
+    failed = []
+    try:
+        for batch in batches:
+            subject = f"{hostname} - {title}"  # Set the subject
+            if len(batch) > 1:
+                subject = f"{hostname} - {title}s ({len(batch)})"
+            with tempfile.TemporaryDirectory() as temp_dir, tempfile.TemporaryFile() as spool:
+                try:
+                    attachments = [path for pdf_file in batch
+                                   for path in report_attachments(pdf_file, attach_logs)]
+                    attachments = compress_attachments(attachments, compression, temp_dir)
+                    write_message(spool, fromaddr, toaddr, subject, body, attachments)
+                except (OSError, ValueError) as e:
+                    logging.error("Could not attach %s: %s", ", ".join(batch), str(e))
+                    failed.extend(batch)
+                    continue
 
-        # Move the PDF file to the Logs/reports/pdf folder
-        reports_dir = os.path.join(log_dir, "reports", "pdf")  # Updated path
-        os.makedirs(reports_dir, exist_ok=True)  # Create the directory if it doesn't exist
+                for attempt in range(retries + 1):
+                    try:
+                        if server is None:
+                            with SMTP_SECONDS.labels(step="connect").time():
+                                server = connect(config)
+                        logging.info("Sending email with %d report(s)", len(batch))
+                        with SMTP_SECONDS.labels(step="send").time():
+                            send_spooled(server, fromaddr, toaddr, spool)
+                        SMTP_ATTEMPTS.labels(outcome="sent").inc()
+                        break
+                    except (OSError, smtplib.SMTPException) as e:
+                        SMTP_ATTEMPTS.labels(outcome="failed").inc()
+                        logging.error("Sending failed (attempt %d of %d): %s", attempt + 1, retries + 1, str(e))
+                        if server is not None:
+                            server.close()
+                            server = None
+                        if attempt == retries:
+                            failed.extend(batch)
+                        else:
+                            time.sleep(backoff * 2 ** attempt)
+                else:
+                    continue  # Every attempt failed
 
-        destination_file = os.path.join(reports_dir, filename)
-        shutil.move(pdf_file, destination_file)
-        logging.info("Moved PDF file to: %s", destination_file)  # Updated logging
+            for pdf_file in batch:
+                try:
+                    archive_report(pdf_file)
+                except OSError as e:
+                    logging.error("Could not move %s: %s", pdf_file, str(e))
+    finally:
+        if server is not None:
+            try:
+                server.quit()
+            except (OSError, smtplib.SMTPException):
+                server.close()
+    return failed
 
-        time.sleep(10)
-        logging.info("Email sent successfully and PDF file moved to Logs/reports/pdf folder.")
+def send_email(body="Please find the attached report of last 1 hour.", pdf_file=None, config=None):
+    """
+    This function sends emails with report attachments.
+    It sets up logging, loads the configuration and mails the given PDF file, or
+    every pending PDF under Logs if none is given, over one SMTP connection.
+    If no configuration is given, it is loaded from config.json.
+    """
+    setup_logging()  # Set up logging
+    logging.info("Starting email sending process")
+
+    # Load configuration
+    if config is None:
+        config = load_config(resource_path('config.json'))
+
+    if not check_config(config):
+        logging.error("Email configuration is missing required fields.")
+        return 1
+
+    pdf_files = [pdf_file] if pdf_file else find_pending_reports()
+    if not pdf_files:
+        logging.warning("No PDF files found in the Logs directory.")
         return 0
 
-    except (FileNotFoundError, IOError, smtplib.SMTPException) as e:  # Narrowed exception handling
-        logging.error("An error occurred: %s", str(e))  # Updated logging
+    failed = deliver_reports(
+        pdf_files, config, body,
+        digest=config.get("digest", False),
+        digest_size=config.get("digest_size", 10),
+        retries=config.get("smtp_retries", 3)
+    )
+    mark_mailed([path for path in pdf_files if path not in failed])
+    if failed:
+        logging.error("%d report(s) could not be sent", len(failed))
         return 1
 
+    logging.info("Email sent successfully and PDF files moved to Logs/reports/pdf folder.")
+    return 0
+
 def main():
     """
     This function is the entry point of the script.
@@ -17,9 +17,8 @@ rem Execute Python scripts
 python "!BASE_PATH!req.py"
 if errorlevel 1 goto error 
 
-:loop
 rem Check if required files exist
-for %%F in (logger.py convert.py mail.py) do (
+for %%F in (daemon.py logger.py convert.py mail.py) do (
     if not exist "!BASE_PATH!%%F" (
         echo Error: %%F not found in !BASE_PATH!
         pause
@@ -27,20 +26,11 @@ for %%F in (logger.py convert.py mail.py) do (
     )
 )
 
-
-rem
-python "!BASE_PATH!logger.py"
-if errorlevel 1 goto error
-
-python "!BASE_PATH!convert.py"
-if errorlevel 1 goto error
-
-timeout /t 5 /nobreak
-
-python "!BASE_PATH!mail.py"
+rem The daemon collects, renders and mails hourly reports in one resident process
+python "!BASE_PATH!daemon.py"
 if errorlevel 1 goto error
 
-goto loop
+exit /b 0
 
 :error
 echo An error occurred while executing a Python script.
@@ -16,19 +16,13 @@ BASE_PATH="$(dirname "$0")"
 # Execute Python scripts
 python "${BASE_PATH}/req.py" || { echo "Error in req.py"; exit 1; }
 
-while true; do
-    # Check if required files exist
-    for file in logger.py convert.py mail.py; do
-        if [ ! -f "${BASE_PATH}/${file}" ]; then
-            echo "Error: ${file} not found in ${BASE_PATH}"
-            exit 1
-        fi
-    done
+# Check if required files exist
+for file in daemon.py logger.py convert.py mail.py; do
+    if [ ! -f "${BASE_PATH}/${file}" ]; then
+        echo "Error: ${file} not found in ${BASE_PATH}"
+        exit 1
+    fi
+done
 
-    python "${BASE_PATH}/logger.py" || { echo "Error in logger.py"; exit 1; }
-    python "${BASE_PATH}/convert.py" || { echo "Error in convert.py"; exit 1; }
-
-    sleep 5
-
-    python "${BASE_PATH}/mail.py" || { echo "Error in mail.py"; exit 1; }
-done
\ No newline at end of file
+# The daemon collects, renders and mails hourly reports in one resident process
+python "${BASE_PATH}/daemon.py" || { echo "Error in daemon.py"; exit 1; }
\ No newline at end of file
@@ -0,0 +1,420 @@
+"""
+Module for measuring the agent's own cost and exporting it in the Prometheus
+text format, either to a local file or on a localhost HTTP endpoint.
+
+Metrics are defined at module level next to the code they measure, in the
+shared REGISTRY, and are kept per process.
+"""
+
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import psutil
+
+# Upper bounds in seconds, from a fast process table scan to a slow SMTP send.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def format_value(value):
+    """
+    Returns a sample value as written in the text format.
+    """
+    if value == float('inf'):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def format_labels(names, values, extra=()):
+    """
+    Returns the label set of a sample, e.g. '{mode="summary"}', or '' without labels.
+    """
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Metric:
+    """
+    A named metric with optional labels. Each distinct set of label values is
+    a child metric, created on first use with ``labels()``; a metric without
+    labels is its own only child.
+    """
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+
+    def labels(self, **labels):
+        """
+        Returns the child metric for the given label values.
+        """
+        values = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            child = self._children.get(values)
+            if child is None:
+                child = self._children[values] = self._new_child()
+            return child
+
+    def _child(self):
+        if self.labelnames:
+            raise ValueError(f"{self.name} needs the labels {', '.join(self.labelnames)}")
+        return self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _function_samples(self, function):
+        try:
+            yield "", (), (), float(function())
+        except Exception:  # A failing probe must not break the export
+            logging.exception("Could not read metric %s", self.name)
+
+    def samples(self):
+        """
+        Yields (suffix, label values, extra labels, value) for every sample of the metric.
+        """
+        raise NotImplementedError
+
+    def render(self):
+        """
+        Returns the metric in the Prometheus text format.
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, values, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{format_labels(self.labelnames, values, extra)} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class _Value:
+    """
+    A number that can be changed from several threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        """
+        Adds to the value.
+        """
+        with self._lock:
+            self.value += amount
+
+    def set(self, value):
+        """
+        Replaces the value.
+        """
+        self.value = float(value)
+
+
+class Counter(Metric):
+    """
+    A total that only goes up, such as the number of skipped processes. A
+    counter without labels can instead read a total kept elsewhere, such as
+    the CPU time of the process, from a function when exported.
+    """
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        """
+        Adds to the counter of a metric without labels.
+        """
+        self._child().inc(amount)
+
+    def samples(self):
+        if self.function is not None:
+            yield from self._function_samples(self.function)
+            return
+        for values, child in list(self._children.items()):
+            yield "", values, (), child.value
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down, such as the writer queue depth. A gauge
+    without labels can instead read its value from a function when exported.
+    """
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value):
+        """
+        Sets the gauge of a metric without labels.
+        """
+        self._child().set(value)
+
+    def set_function(self, function):
+        """
+        Reads the gauge from a function whenever it is exported.
+        """
+        self.function = function
+
+    def samples(self):
+        if self.function is not None:
+            yield from self._function_samples(self.function)
+            return
+        for values, child in list(self._children.items()):
+            yield "", values, (), child.value
+
+
+class _Buckets:
+    """
+    Observation counts of a histogram, per upper bound.
+    """
+
+    def __init__(self, bounds):
+        self._lock = threading.Lock()
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """
+        Records one observation.
+        """
+        with self._lock:
+            for index, bound in enumerate(self.bounds):
+                if value <= bound:
+                    self.counts[index] += 1
+                    break
+            self.count += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        """
+        Observes the time spent in the with block, in seconds.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Histogram(Metric):
+    """
+    Counts observations, such as scan durations, into cumulative buckets.
+    """
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _Buckets(self.buckets)
+
+    def observe(self, value):
+        """
+        Records an observation of a metric without labels.
+        """
+        self._child().observe(value)
+
+    def time(self):
+        """
+        Observes the time spent in the with block for a metric without labels.
+        """
+        return self._child().time()
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            with child._lock:
+                counts, count, total = list(child.counts), child.count, child.sum
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield "_bucket", values, (("le", format_value(float(bound))),), cumulative
+            yield "_bucket", values, (("le", "+Inf"),), count
+            yield "_sum", values, (), total
+            yield "_count", values, (), count
+
+
+class MetricsRegistry:
+    """
+    The set of metrics exported together.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def register(self, metric):
+        """
+        Adds a metric, or returns the one already registered under its name.
+        """
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labelnames=(), function=None):
+        """
+        Returns a registered counter.
+        """
+        return self.register(Counter(name, documentation, labelnames, function))
+
+    def gauge(self, name, documentation, labelnames=(), function=None):
+        """
+        Returns a registered gauge.
+        """
+        return self.register(Gauge(name, documentation, labelnames, function))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        """
+        Returns a registered histogram.
+        """
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """
+        Returns every metric in the Prometheus text format.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "".join(metric.render() for metric in metrics)
+
+    def write_file(self, path):
+        """
+        Writes every metric to a file, replacing it atomically.
+        """
+        temp_path = path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            file.write(self.render())
+        os.replace(temp_path, path)
+
+
+REGISTRY = MetricsRegistry()
+
+# The agent's own resource use, read when the metrics are exported.
+_process = psutil.Process()
+REGISTRY.counter("process_cpu_seconds_total", "User and system CPU time of the agent in seconds.",
+               function=lambda: sum(_process.cpu_times()[:2]))
+REGISTRY.gauge("process_resident_memory_bytes", "Resident memory of the agent in bytes.",
+               function=lambda: _process.memory_info().rss)
+REGISTRY.gauge("process_start_time_seconds", "Start time of the agent since the epoch in seconds.",
+               function=_process.create_time)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """
+    Serves the registry on /metrics.
+    """
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug("Metrics request: " + format, *args)
+
+
+class MetricsServer(ThreadingHTTPServer):
+    """
+    Serves the metrics in the Prometheus text format on a local HTTP endpoint.
+    It only listens on localhost unless another host is given.
+    """
+    daemon_threads = True
+
+    def __init__(self, port=9464, host="127.0.0.1", registry=REGISTRY):
+        super().__init__((host, port), _MetricsHandler)
+        self.registry = registry
+        self._thread = None
+
+    def start(self):
+        """
+        Starts serving on a background thread.
+        """
+        self._thread = threading.Thread(target=self.serve_forever, name="track-metrics", daemon=True)
+        self._thread.start()
+        logging.info("Serving metrics on http://%s:%d/metrics", *self.server_address[:2])
+        return self
+
+    def stop(self):
+        """
+        Stops serving and closes the socket.
+        """
+        if self._thread is not None:
+            self.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.server_close()
+
+
+class MetricsFileWriter:
+    """
+    Writes the metrics to a local file every ``interval`` seconds, e.g. for the
+    node exporter's textfile collector.
+    """
+
+    def __init__(self, path, interval=15, registry=REGISTRY):
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Starts writing on a background thread.
+        """
+        self._thread = threading.Thread(target=self._run, name="track-metrics-file", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops the writer thread after writing the metrics one last time.
+        """
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+
+    def _write(self):
+        try:
+            self.registry.write_file(self.path)
+        except OSError as e:
+            logging.error("Could not write metrics to %s: %s", self.path, str(e))
+
+    def _run(self):
+        self._write()
+        while not self._stop_event.wait(self.interval):
+            self._write()
+        self._write()
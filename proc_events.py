@@ -0,0 +1,246 @@
+"""
+Module for event-driven process tracking on Linux through the netlink process
+connector, with the polling process table as fallback.
+"""
+
+import os
+import sys
+import errno
+import socket
+import struct
+import logging
+import threading
+from collections import deque
+import psutil
+from sampler import ProcessTable
+
+NETLINK_CONNECTOR = 11
+CN_IDX_PROC = 1
+CN_VAL_PROC = 1
+NLMSG_DONE = 3
+PROC_CN_MCAST_LISTEN = 1
+PROC_CN_MCAST_IGNORE = 2
+
+PROC_EVENT_FORK = 0x00000001
+PROC_EVENT_EXEC = 0x00000002
+PROC_EVENT_EXIT = 0x80000000
+
+NLMSG_HEADER = struct.Struct('=IHHII')
+CN_MSG_HEADER = struct.Struct('=IIIIHH')
+PROC_EVENT_HEADER = struct.Struct('=IIQ')
+FORK_EVENT = struct.Struct('=IIII')
+PID_TGID = struct.Struct('=II')
+
+RECEIVE_BUFFER_SIZE = 4 * 1024 * 1024
+
+
+def open_proc_connector():
+    """
+    Opens a netlink socket subscribed to process events.
+    Raises OSError if the platform or permissions do not allow it.
+    """
+    if not sys.platform.startswith('linux'):
+        raise OSError(errno.ENOSYS, "The process connector is only available on Linux")
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_CONNECTOR)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER_SIZE)
+        sock.bind((0, CN_IDX_PROC))
+        sock.settimeout(1.0)  # Lets the listener notice close()
+        payload = struct.pack('=I', PROC_CN_MCAST_LISTEN)
+        message = CN_MSG_HEADER.pack(CN_IDX_PROC, CN_VAL_PROC, 0, 0, len(payload), 0) + payload
+        sock.send(NLMSG_HEADER.pack(NLMSG_HEADER.size + len(message), NLMSG_DONE, 0, 0, 0) + message)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def parse_events(data):
+    """
+    Yields (event, pid) for the process fork, exec and exit events in a netlink
+    datagram. Events of threads other than the thread group leader are skipped.
+    """
+    offset = 0
+    while offset + NLMSG_HEADER.size <= len(data):
+        length = NLMSG_HEADER.unpack_from(data, offset)[0]
+        if length < NLMSG_HEADER.size:
+            return
+        event_offset = offset + NLMSG_HEADER.size + CN_MSG_HEADER.size
+        if event_offset + PROC_EVENT_HEADER.size <= offset + length:
+            what = PROC_EVENT_HEADER.unpack_from(data, event_offset)[0]
+            body = event_offset + PROC_EVENT_HEADER.size
+            if what == PROC_EVENT_FORK:
+                _, _, child_pid, child_tgid = FORK_EVENT.unpack_from(data, body)
+                if child_pid == child_tgid:
+                    yield PROC_EVENT_FORK, child_pid
+            elif what in (PROC_EVENT_EXEC, PROC_EVENT_EXIT):
+                pid, tgid = PID_TGID.unpack_from(data, body)
+                if pid == tgid:
+                    yield what, pid
+        offset += (length + 3) & ~3
+
+
+def read_exe(pid):
+    """
+    Returns the executable of a process from /proc, or None if it is gone or hidden.
+    """
+    try:
+        return os.readlink(f"/proc/{pid}/exe")
+    except OSError:
+        return None
+
+
+class EventProcessTable(ProcessTable):
+    """
+    Tracks the process table from fork, exec and exit events instead of
+    rescanning it every tick. A listener thread resolves each new process as
+    soon as its event arrives, so processes that live for less than one
+    sampling interval are still captured. The table is seeded, and resynced
+    after lost events, with a regular scan.
+    """
+
+    def __init__(self, attrs=('pid', 'exe')):
+        super().__init__(attrs)
+        self._socket = open_proc_connector()
+        self._events = deque()
+        self._pids = {}
+        self._resync = True
+        self._closed = False
+        self._listener = threading.Thread(target=self._listen, name="track-proc-events", daemon=True)
+        self._listener.start()
+
+    def _listen(self):
+        """
+        Receives process events and queues them, resolving new processes immediately.
+        """
+        while not self._closed:
+            try:
+                data = self._socket.recv(65536)
+            except (socket.timeout, TimeoutError):  # Distinct classes before Python 3.10
+                continue
+            except OSError as e:
+                if self._closed:
+                    return
+                # ENOBUFS means events were dropped; rescan on the next tick.
+                if e.errno != errno.ENOBUFS:
+                    logging.error("Process event socket failed: %s", str(e))
+                self._resync = True
+                continue
+            for what, pid in parse_events(data):
+                if what == PROC_EVENT_EXEC:
+                    self._events.append((what, pid, self._resolve_pid(pid)))
+                elif what == PROC_EVENT_FORK:
+                    # Most forks are followed by an exec, so only the cheap exe
+                    # lookup is done here; see update() for forks without one.
+                    self._events.append((what, pid, read_exe(pid)))
+                else:
+                    self._events.append((what, pid, None))
+
+    def _partial_info(self, pid, exe):
+        """
+        Returns the info dict of a process that exited before it could be resolved.
+        """
+        info = dict.fromkeys(self.attrs)
+        info['pid'] = pid
+        info['create_time'] = None
+        if 'exe' in info:
+            info['exe'] = exe
+        return info
+
+    def _resolve_pid(self, pid):
+        """
+        Returns (key, info, process) for a new process, or a partial info dict
+        with no key or handle if it exited before it could be resolved.
+        """
+        # Read the executable first: it is a single syscall, so it usually
+        # succeeds even for processes that exit right away.
+        exe = read_exe(pid) if 'exe' in self.attrs else None
+        try:
+            proc = psutil.Process(pid)
+            key = (pid, proc.create_time())
+            info = self._resolve(proc, key)
+        except (psutil.NoSuchProcess, psutil.ZombieProcess, psutil.AccessDenied):
+            return None, self._partial_info(pid, exe), None
+        if exe and 'exe' in info and not info['exe']:
+            info['exe'] = exe
+        return key, info, proc
+
+    def _add(self, pid, resolved, spawned, exited):
+        """
+        Adds a resolved new or exec'd process to the table and the spawned list.
+        """
+        key, info, proc = resolved
+        if key is not None:
+            old_key = self._pids.get(pid)
+            if old_key is not None and old_key != key:
+                exited.append(self._entries.pop(old_key)[0])  # Missed exit of a reused pid
+            self._entries[key] = (info, proc)
+            self._pids[pid] = key
+        # A fork followed by an exec reports the executed binary only.
+        spawned[pid] = info
+
+    def update(self):
+        """
+        Applies the events received since the previous tick and returns
+        (processes, spawned, exited, handles) like ProcessTable.update.
+        """
+        if self._resync:
+            self._resync = False
+            self._events.clear()
+            result = super().update()
+            self._pids = {key[0]: key for key in self._entries}
+            return result
+
+        spawned = {}
+        exited = []
+        forks = {}
+        while self._events:
+            what, pid, resolved = self._events.popleft()
+            if what == PROC_EVENT_FORK:
+                forks[pid] = resolved
+            elif what == PROC_EVENT_EXEC:
+                forks.pop(pid, None)
+                self._add(pid, resolved, spawned, exited)
+            elif pid in forks:
+                # Forked and exited without an exec in between.
+                info = self._partial_info(pid, forks.pop(pid))
+                spawned[pid] = info
+                exited.append(info)
+            else:
+                key = self._pids.pop(pid, None)
+                if key is not None:
+                    exited.append(self._entries.pop(key)[0])
+                elif pid in spawned:
+                    exited.append(spawned[pid])  # Lived for less than one tick
+        # Forks that are still running without an exec, e.g. worker processes.
+        for pid in forks:
+            self._add(pid, self._resolve_pid(pid), spawned, exited)
+
+        processes = [info for info, _ in self._entries.values()]
+        handles = {info['pid']: proc for info, proc in self._entries.values()}
+        return processes, list(spawned.values()), exited, handles
+
+    def close(self):
+        """
+        Stops listening for process events.
+        """
+        self._closed = True
+        self._socket.close()
+
+
+def create_process_table(attrs=('pid', 'exe'), backend="poll"):
+    """
+    Returns the process table for a backend: "poll" scans the process table
+    every tick, "netlink" follows process connector events, and "auto" uses
+    the process connector where it is permitted and falls back to polling.
+    """
+    if backend in ("auto", "netlink"):
+        try:
+            return EventProcessTable(attrs)
+        except OSError as e:
+            if backend == "netlink":
+                raise
+            logging.warning("Process events unavailable (%s), falling back to polling", str(e))
+    elif backend != "poll":
+        raise ValueError(f"Unknown process backend: {backend}")
+    return ProcessTable(attrs)
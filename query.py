@@ -0,0 +1,503 @@
+"""
+Module for querying the sample logs under Logs through a persistent index.
+
+The index is a SQLite database in Logs/index.sqlite holding, for every log
+file, hour and executable, how often the executable was logged in each
+section, when it was first and last seen and how much I/O it did. Only the
+lines added since the previous run are read when the index is updated, and
+queries run against the index instead of the logs:
+
+    python query.py top --since 7d -n 10
+    python query.py exe /usr/bin/python3 --since 2026-10-01
+    python query.py timeline python --bucket day --format csv --output python.csv
+"""
+
+import os
+import re
+import csv
+import sys
+import glob
+import json
+import sqlite3
+import logging
+import argparse
+import functools
+from datetime import datetime, timedelta
+
+import summary
+
+INDEX_NAME = "index.sqlite"
+# Bump when the schema or the parsing changes; the index is then rebuilt.
+INDEX_VERSION = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL,
+    path TEXT NOT NULL,
+    host TEXT,
+    size INTEGER NOT NULL,
+    offset INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS exes (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS buckets (
+    file_id INTEGER NOT NULL,
+    hour INTEGER NOT NULL,
+    exe_id INTEGER NOT NULL,
+    section TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    first REAL NOT NULL,
+    last REAL NOT NULL,
+    read_bytes INTEGER NOT NULL,
+    write_bytes INTEGER NOT NULL,
+    PRIMARY KEY (section, hour, exe_id, file_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS buckets_by_exe ON buckets (exe_id, hour);
+CREATE INDEX IF NOT EXISTS buckets_by_file ON buckets (file_id);
+"""
+
+UPSERT_BUCKET = """
+INSERT INTO buckets VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (section, hour, exe_id, file_id) DO UPDATE SET
+    count = count + excluded.count,
+    first = min(first, excluded.first),
+    last = max(last, excluded.last),
+    read_bytes = read_bytes + excluded.read_bytes,
+    write_bytes = write_bytes + excluded.write_bytes
+"""
+
+BUCKETS = ("hour", "day")
+# UTC offsets only change on whole quarter hours, so they are looked up once per quarter hour.
+OFFSET_STEP = 900
+RELATIVE_TIME = re.compile(r'^(\d+)([mhdw])$')
+TIME_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d', '%d-%m-%Y_%H-%M', '%d-%m-%Y')
+
+
+def resource_path(relative_path):
+    """
+    Returns the absolute path to a resource file.
+    """
+    try:
+        base_path = sys._MEIPASS
+    except AttributeError:
+        base_path = os.path.abspath(os.path.dirname(__file__))
+    return os.path.join(base_path, relative_path)
+
+
+def open_index(logs_dir=None):
+    """
+    Opens the index of a Logs directory, creating or rebuilding it as needed.
+    """
+    logs_dir = logs_dir or resource_path("Logs")
+    os.makedirs(logs_dir, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(logs_dir, INDEX_NAME))
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version != INDEX_VERSION:
+        with conn:
+            for table in ("buckets", "exes", "files"):
+                conn.execute(f"DROP TABLE IF EXISTS {table}")
+        conn.executescript(SCHEMA)
+        conn.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+    return conn
+
+
+def log_files(logs_dir):
+    """
+    Returns every text log under Logs: pending ones at the top of each date
+    directory and converted ones in its reports/text directory.
+    """
+    return glob.glob(os.path.join(logs_dir, "*", "*.txt")) + \
+        glob.glob(os.path.join(logs_dir, "*", "reports", "text", "*.txt"))
+
+
+def parse_timestamp(timestamp):
+    """
+    Returns the epoch time of a sample log timestamp such as "2026-10-18 03:06:33,197",
+    or None if it cannot be parsed.
+    """
+    try:
+        return datetime.fromisoformat(timestamp.replace(',', '.')).timestamp()
+    except ValueError:
+        return None
+
+
+@functools.lru_cache(maxsize=4096)
+def _utc_offset(step):
+    return datetime.fromtimestamp(step * OFFSET_STEP).astimezone().utcoffset().total_seconds()
+
+
+def utc_offset(epoch):
+    """
+    Returns the local UTC offset in seconds in effect at an epoch time.
+    """
+    return _utc_offset(int(epoch // OFFSET_STEP))
+
+
+def hour_start(epoch):
+    """
+    Returns the epoch time of the start of the local hour an epoch time falls
+    in, with the UTC offset in effect at that time, so hours line up with the
+    sample logs in half-hour time zones and across DST changes.
+    """
+    offset = utc_offset(epoch)
+    return int((epoch + offset) // 3600 * 3600 - offset)
+
+
+def day_start(epoch):
+    """
+    Returns the epoch time of the local midnight that starts the day of an epoch time.
+    """
+    return int(datetime.fromtimestamp(epoch).replace(hour=0, minute=0, second=0, microsecond=0).timestamp())
+
+
+def index_lines(lines, host=None):
+    """
+    Aggregates sample log lines into {(hour, exe, section): [count, first, last,
+    read, written]}. Returns (buckets, host), the host being taken from the
+    "Computer Name" line if there is one.
+    """
+    buckets = {}
+    for line in lines:
+        timestamp, message = summary.parse_line(line.rstrip('\r\n'))
+        if timestamp is None:
+            continue
+        if message.startswith("Computer Name: "):
+            host = message[len("Computer Name: "):]
+            continue
+        for prefix, section in summary.SECTIONS.items():
+            if message.startswith(prefix):
+                break
+        else:
+            continue
+        epoch = parse_timestamp(timestamp)
+        if epoch is None:
+            continue
+        exe, _, stats = message[len(prefix):].partition(summary.STATS_SEPARATOR)
+        read_bytes, write_bytes = summary.parse_io_stats(stats) if stats else (0, 0)
+        key = (hour_start(epoch), exe, section)
+        bucket = buckets.get(key)
+        if bucket is None:
+            buckets[key] = [1, epoch, epoch, read_bytes, write_bytes]
+        else:
+            bucket[0] += 1
+            bucket[1] = min(bucket[1], epoch)
+            bucket[2] = max(bucket[2], epoch)
+            bucket[3] += read_bytes
+            bucket[4] += write_bytes
+    return buckets, host
+
+
+def exe_id(conn, cache, path):
+    """
+    Returns the id of an executable path in the index, adding it if needed.
+    """
+    exe = cache.get(path)
+    if exe is None:
+        conn.execute("INSERT OR IGNORE INTO exes (path) VALUES (?)", (path,))
+        exe = cache[path] = conn.execute("SELECT id FROM exes WHERE path = ?", (path,)).fetchone()[0]
+    return exe
+
+
+def index_file(conn, path, cache):
+    """
+    Adds the lines of a log file written since it was last indexed. A file
+    that shrank is indexed again from the start. Files are matched by name,
+    so a log moved to its report directory is not indexed twice.
+    Returns the number of bytes read.
+    """
+    name = os.path.basename(path)
+    size = os.path.getsize(path)
+    row = conn.execute("SELECT id, host, size, offset FROM files WHERE name = ?", (name,)).fetchone()
+    if row is None:
+        file_id = conn.execute(
+            "INSERT INTO files (name, path, size, offset) VALUES (?, ?, 0, 0)", (name, path)
+        ).lastrowid
+        host, offset = None, 0
+    else:
+        file_id, host, _, offset = row
+        if size < offset:
+            conn.execute("DELETE FROM buckets WHERE file_id = ?", (file_id,))
+            offset = 0
+    if size == offset:
+        conn.execute("UPDATE files SET path = ? WHERE id = ?", (path, file_id))
+        return 0
+
+    with open(path, 'rb') as file:
+        file.seek(offset)
+        data = file.read(size - offset)
+    complete = data.rfind(b'\n') + 1  # Leave a partly written last line for the next run
+    lines = data[:complete].decode('utf-8', 'replace').splitlines()
+    buckets, host = index_lines(lines, host)
+    conn.executemany(UPSERT_BUCKET, (
+        (file_id, hour, exe_id(conn, cache, exe), section, *values)
+        for (hour, exe, section), values in buckets.items()
+    ))
+    conn.execute(
+        "UPDATE files SET path = ?, host = ?, size = ?, offset = ? WHERE id = ?",
+        (path, host, size, offset + complete, file_id)
+    )
+    return complete
+
+
+def update_index(conn, logs_dir=None):
+    """
+    Brings the index up to date with the text logs under Logs.
+    Returns the number of bytes read.
+    """
+    logs_dir = logs_dir or resource_path("Logs")
+    sizes = dict(conn.execute("SELECT name, size FROM files"))
+    cache = {}
+    total = 0
+    with conn:
+        for path in log_files(logs_dir):
+            try:
+                if sizes.get(os.path.basename(path)) == os.path.getsize(path):
+                    continue  # Unchanged since the last run
+                total += index_file(conn, path, cache)
+            except OSError as e:
+                logging.error("Could not index %s: %s", path, str(e))
+    return total
+
+
+def parse_time(value, now=None):
+    """
+    Parses a time argument: a date and optional time such as "2026-10-18 14:00"
+    or "18-10-2026", or a time relative to now such as "30m", "24h", "7d" or "2w".
+    Returns the epoch time.
+    """
+    now = now or datetime.now()
+    match = RELATIVE_TIME.match(value)
+    if match:
+        amount, unit = int(match.group(1)), match.group(2)
+        delta = {"m": timedelta(minutes=amount), "h": timedelta(hours=amount),
+                 "d": timedelta(days=amount), "w": timedelta(weeks=amount)}[unit]
+        return (now - delta).timestamp()
+    for time_format in TIME_FORMATS:
+        try:
+            return datetime.strptime(value, time_format).timestamp()
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(f"Unrecognized time: {value}")
+
+
+def range_filter(since=None, until=None, host=None):
+    """
+    Returns the SQL conditions and parameters restricting buckets to a time
+    range and host. Counts are kept per hour, so the range is widened to whole hours.
+    """
+    conditions, params = [], []
+    if since is not None:
+        conditions.append("b.hour >= ?")
+        params.append(hour_start(since))
+    if until is not None:
+        conditions.append("b.hour < ?")
+        params.append(until)
+    if host is not None:
+        conditions.append("f.host = ?")
+        params.append(host)
+    return conditions, params
+
+
+def files_join(host):
+    """
+    Returns the join needed to filter buckets by host, which is skipped when no host is given.
+    """
+    return "JOIN files f ON f.id = b.file_id" if host is not None else ""
+
+
+def format_time(epoch):
+    """
+    Formats an epoch time like the sample log timestamps, to the second.
+    """
+    return datetime.fromtimestamp(epoch).strftime('%Y-%m-%d %H:%M:%S') if epoch is not None else None
+
+
+def query_top(conn, section="processes", order="count", limit=20, since=None, until=None, host=None):
+    """
+    Returns the top executables of a section in a time range, as dicts with
+    the count, first and last sighting and bytes read and written, ordered by
+    count or by total I/O.
+    """
+    conditions, params = range_filter(since, until, host)
+    conditions.insert(0, "b.section = ?")
+    params.insert(0, section)
+    order_by = "read_bytes + write_bytes" if order == "io" else "count"
+    rows = conn.execute(f"""
+        SELECT e.path, sum(b.count) AS count, min(b.first), max(b.last),
+               sum(b.read_bytes) AS read_bytes, sum(b.write_bytes) AS write_bytes
+        FROM buckets b JOIN exes e ON e.id = b.exe_id {files_join(host)}
+        WHERE {' AND '.join(conditions)}
+        GROUP BY b.exe_id ORDER BY {order_by} DESC, e.path LIMIT ?
+    """, params + [limit])
+    return [
+        {"exe": exe, "count": count, "first": format_time(first), "last": format_time(last),
+         "read_bytes": read_bytes, "write_bytes": write_bytes}
+        for exe, count, first, last, read_bytes, write_bytes in rows
+    ]
+
+
+def matching_exes(conn, pattern):
+    """
+    Returns the ids of the executables equal to the pattern or, if there are
+    none, containing it.
+    """
+    ids = [row[0] for row in conn.execute("SELECT id FROM exes WHERE path = ?", (pattern,))]
+    if not ids:
+        escaped = pattern.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        ids = [row[0] for row in conn.execute(
+            "SELECT id FROM exes WHERE path LIKE ? ESCAPE '\\'", (f"%{escaped}%",)
+        )]
+    return ids
+
+
+def query_exe(conn, pattern, since=None, until=None, host=None):
+    """
+    Returns, for every executable matching the pattern, when it was first and
+    last seen in a time range, on how many hosts and how often in each section.
+    """
+    ids = matching_exes(conn, pattern)
+    if not ids:
+        return []
+    conditions, params = range_filter(since, until, host)
+    conditions.insert(0, f"b.exe_id IN ({','.join('?' * len(ids))})")
+    rows = conn.execute(f"""
+        SELECT e.path, min(b.first), max(b.last), count(DISTINCT f.host),
+               sum(CASE WHEN b.section = 'processes' THEN b.count ELSE 0 END),
+               sum(CASE WHEN b.section = 'file_operations' THEN b.count ELSE 0 END),
+               sum(CASE WHEN b.section = 'exits' THEN b.count ELSE 0 END),
+               sum(b.read_bytes), sum(b.write_bytes)
+        FROM buckets b JOIN exes e ON e.id = b.exe_id JOIN files f ON f.id = b.file_id
+        WHERE {' AND '.join(conditions)}
+        GROUP BY b.exe_id ORDER BY min(b.first)
+    """, ids + params)
+    return [
+        {"exe": exe, "first": format_time(first), "last": format_time(last), "hosts": hosts,
+         "processes": processes, "file_operations": file_operations, "exits": exits,
+         "read_bytes": read_bytes, "write_bytes": write_bytes}
+        for exe, first, last, hosts, processes, file_operations, exits, read_bytes, write_bytes in rows
+    ]
+
+
+def query_timeline(conn, pattern, bucket="hour", section="processes", since=None, until=None, host=None):
+    """
+    Returns how often executables matching the pattern were logged in a
+    section per hour or day of a time range.
+    """
+    ids = matching_exes(conn, pattern)
+    if not ids:
+        return []
+    conditions, params = range_filter(since, until, host)
+    conditions[:0] = [f"b.exe_id IN ({','.join('?' * len(ids))})", "b.section = ?"]
+    rows = conn.execute(f"""
+        SELECT b.hour, sum(b.count), sum(b.read_bytes), sum(b.write_bytes)
+        FROM buckets b {files_join(host)}
+        WHERE {' AND '.join(conditions)}
+        GROUP BY b.hour ORDER BY b.hour
+    """, ids + [section] + params)
+    # Days follow the local calendar, like the Logs date directories, and
+    # are summed here since their length changes with DST.
+    periods = {}
+    for hour, count, read_bytes, write_bytes in rows:
+        period = day_start(hour) if bucket == "day" else hour
+        totals = periods.setdefault(period, [0, 0, 0])
+        totals[0] += count
+        totals[1] += read_bytes
+        totals[2] += write_bytes
+    return [
+        {"period": format_time(period), "count": count, "read_bytes": read_bytes, "write_bytes": write_bytes}
+        for period, (count, read_bytes, write_bytes) in periods.items()
+    ]
+
+
+def write_results(rows, output_format="table", output=None):
+    """
+    Writes query results as an aligned table, CSV or JSON, to a file or stdout.
+    """
+    file = open(output, 'w', encoding='utf-8', newline='') if output else sys.stdout
+    try:
+        if output_format == "json":
+            json.dump(rows, file, indent=2)
+            file.write("\n")
+        elif not rows:
+            if output_format == "table":
+                file.write("No results\n")
+        elif output_format == "csv":
+            writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            columns = list(rows[0])
+            cells = [[str(row[column]) for column in columns] for row in rows]
+            widths = [max(len(column), *(len(line[index]) for line in cells)) for index, column in enumerate(columns)]
+            # The executable path goes last so long paths do not push the other columns apart.
+            order = sorted(range(len(columns)), key=lambda index: columns[index] == "exe")
+            for line in [columns] + cells:
+                file.write("  ".join(line[index].ljust(widths[index]) for index in order).rstrip() + "\n")
+    finally:
+        if output:
+            file.close()
+
+
+def parse_args(argv=None):
+    """
+    Parses the command line options.
+    """
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--since", type=parse_time, help="start of the range, e.g. 2026-10-01 or 7d")
+    common.add_argument("--until", type=parse_time, help="end of the range, e.g. 2026-10-08 14:00 or 1h")
+    common.add_argument("--host", help="only logs of this computer name")
+    common.add_argument("--format", choices=("table", "csv", "json"), default="table")
+    common.add_argument("--output", help="write the results to this file instead of stdout")
+    common.add_argument("--no-update", action="store_true", help="query the index without updating it first")
+    common.add_argument("--logs", help="Logs directory (default: Logs next to this script)")
+
+    parser = argparse.ArgumentParser(description="Query the sample logs under Logs.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("update", parents=[common], help="update the index only")
+    top = commands.add_parser("top", parents=[common], help="top executables in a time range")
+    top.add_argument("--section", choices=tuple(summary.SECTIONS.values()), default="processes")
+    top.add_argument("--by", choices=("count", "io"), default="count", help="order by count or total I/O")
+    top.add_argument("-n", "--limit", type=int, default=20)
+    exe = commands.add_parser("exe", parents=[common], help="first and last sightings of an executable")
+    exe.add_argument("pattern", help="executable path, or part of one")
+    timeline = commands.add_parser("timeline", parents=[common], help="sightings of an executable over time")
+    timeline.add_argument("pattern", help="executable path, or part of one")
+    timeline.add_argument("--bucket", choices=BUCKETS, default="hour")
+    timeline.add_argument("--section", choices=tuple(summary.SECTIONS.values()), default="processes")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    This is the main function of the script.
+    It updates the index and runs the requested query.
+    """
+    args = parse_args(argv)
+    logs_dir = args.logs or resource_path("Logs")
+    conn = open_index(logs_dir)
+    try:
+        if not args.no_update or args.command == "update":
+            read = update_index(conn, logs_dir)
+            if args.command == "update":
+                print(f"Indexed {read} new byte(s)")
+                return 0
+        span = {"since": args.since, "until": args.until, "host": args.host}
+        if args.command == "top":
+            rows = query_top(conn, args.section, args.by, args.limit, **span)
+        elif args.command == "exe":
+            rows = query_exe(conn, args.pattern, **span)
+        else:
+            rows = query_timeline(conn, args.pattern, args.bucket, args.section, **span)
+        write_results(rows, args.format, args.output)
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,19 @@
+import os  # Import the os module for locating config.json
+import json  # Import the json module for reading config.json
 import subprocess  # Import the subprocess module for running system commands
-import time  # Import the time module for time-related operations
-import os  # Import the os module for operating system-specific functionalities
 import sys  # Import the sys module for system-specific parameters and functions
+from importlib import metadata  # Import metadata for checking installed packages without pip
+
+REQUIRED_PACKAGES = [
+    "psutil",  # Package for system and process utilities
+    "reportlab",  # Package for generating PDF documents
+    # Add the names of the packages you want to install here
+]
+
+# Packages only installed when the config.json setting that needs them is enabled
+OPTIONAL_PACKAGES = {
+    "resource_sampling": ["numpy"],  # Package for the per-process CPU and memory time series
+}
 
 def run_command(command):
     """
@@ -9,42 +21,58 @@ def run_command(command):
     It uses subprocess.check_call to execute the command and catches CalledProcessError to handle errors.
     """
     try:
-        subprocess.check_call(command, shell=True)  # Execute the command and check for errors
+        subprocess.check_call(command)  # Execute the command and check for errors
     except subprocess.CalledProcessError as e:
         print(f"Command failed with error code {e.returncode}")  # Print the error message with the error code
         sys.exit(e.returncode)  # Exit the program with the error code
 
-def upgrade_pip():
+def missing_packages(packages):
     """
-    This function upgrades pip to the latest version.
-    It prints a message indicating the upgrade process and calls run_command to execute the upgrade.
+    This function returns the packages that are not installed.
+    It reads the installed package metadata, so no pip process is started.
     """
-    print("Upgrading pip...")  # Print a message indicating the upgrade process
-    run_command("python -m pip install --upgrade pip")  # Call run_command to execute the upgrade
+    missing = []
+    for package in packages:
+        try:
+            metadata.version(package)  # Raises if the package is not installed
+        except metadata.PackageNotFoundError:
+            missing.append(package)
+    return missing
 
-def install_requirements():
+def enabled_packages(config_file=None):
     """
-    This function installs required packages.
-    It defines a list of required packages, prints a message indicating the installation process,
-    and calls run_command to install each package.
+    This function returns the optional packages needed by the settings enabled in config.json.
+    A missing or unreadable config.json enables none of them.
     """
-    required_packages = [
-        "psutil",  # Package for system and process utilities
-        "reportlab",  # Package for generating PDF documents
-        # Add the names of the packages you want to install here
+    config_file = config_file or os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
+    try:
+        with open(config_file, 'r', encoding='utf-8') as file:
+            config = json.load(file)
+    except (OSError, ValueError):
+        return []
+    return [
+        package for setting, packages in OPTIONAL_PACKAGES.items() if config.get(setting) for package in packages
     ]
 
-    print("Installing required packages...")  # Print a message indicating the installation process
-    for package in required_packages:
-        run_command(f"python -m pip install --upgrade {package}")  # Call run_command to install each package
+def install_requirements(packages=REQUIRED_PACKAGES):
+    """
+    This function installs the required packages that are missing.
+    All missing packages are installed with a single pip call, and pip is not
+    run at all when everything is already installed.
+    """
+    missing = missing_packages(packages)
+    if not missing:
+        print("Required packages are already installed.")  # Nothing to do, so skip pip entirely
+        return
+    print(f"Installing missing packages: {', '.join(missing)}")  # Print a message indicating the installation process
+    run_command([sys.executable, "-m", "pip", "install", "--disable-pip-version-check", *missing])
 
 def main():
     """
     This is the main function of the script.
-    It calls the functions to upgrade pip and install required packages.
+    It calls the function to install missing packages.
     """
-    upgrade_pip()  # Call the function to upgrade pip
-    install_requirements()  # Call the function to install required packages
+    install_requirements(REQUIRED_PACKAGES + enabled_packages())  # Call the function to install missing packages
     print("Done!")  # Print a message indicating the completion of the process
 
 if __name__ == "__main__":
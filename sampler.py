@@ -0,0 +1,233 @@
+"""
+Module for sampling the system process table once per tick and sharing the
+snapshot with every registered consumer.
+"""
+
+import time
+import logging
+from collections import namedtuple
+import psutil
+from metrics import REGISTRY
+
+# One tick of the process table. ``processes`` holds an info dict for every
+# live process, ``spawned`` and ``exited`` only those that appeared or went
+# away since the previous tick, and ``handles`` maps each live pid to its
+# ``psutil.Process`` for consumers that need more than the cached attributes.
+Snapshot = namedtuple('Snapshot', ['time', 'processes', 'spawned', 'exited', 'handles'])
+
+SCAN_SECONDS = REGISTRY.histogram("track_scan_seconds", "Wall time of one process table scan.")
+TICK_CPU_SECONDS = REGISTRY.histogram(
+    "track_tick_cpu_seconds", "CPU time of one sampler tick, consumers included."
+)
+PROCESSES = REGISTRY.gauge("track_processes", "Processes in the latest snapshot.")
+PROCESS_EVENTS = REGISTRY.counter(
+    "track_process_events_total", "Processes seen spawning or exiting.", ("event",)
+)
+SAMPLE_INTERVAL = REGISTRY.gauge("track_sample_interval_seconds", "Current sampling interval.")
+SCAN_SKIPS = REGISTRY.counter(
+    "track_scan_skips_total",
+    "Processes skipped because they exited mid-scan, or resolved without their create time or some attributes "
+    "because access was denied.",
+    ("reason",)
+)
+
+
+class ProcessTable:
+    """
+    Incrementally tracks the process table, keyed on (pid, create_time).
+    The requested attributes are resolved once, when a process is first seen,
+    and cached for the life of that pid, so the expensive lookups (exe
+    readlink, OpenProcess) scale with process churn rather than process count.
+    """
+
+    def __init__(self, attrs=('pid', 'exe')):
+        self.attrs = list(attrs)
+        self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _resolve(self, proc, key):
+        """
+        Resolves the requested attributes of a newly seen process. Attributes
+        that access is denied to are None, and the process is counted as
+        skipped for that reason.
+        """
+        info = {'pid': key[0], 'create_time': key[1]}
+        denied = False
+        with proc.oneshot():
+            for name in self.attrs:
+                if name in info:
+                    continue
+                try:
+                    info[name] = getattr(proc, name)()
+                except (psutil.ZombieProcess, NotImplementedError):
+                    info[name] = None  # As psutil's as_dict() reports them
+                except psutil.AccessDenied:
+                    info[name] = None
+                    denied = True
+        # A process whose create time was denied is already counted by update().
+        if denied and key[1] is not None:
+            SCAN_SKIPS.labels(reason="access_denied").inc()
+        return info
+
+    def update(self):
+        """
+        Rescans the process table and returns (processes, spawned, exited, handles).
+        """
+        entries = {}
+        spawned = []
+        gone = denied = 0
+        for proc in psutil.process_iter():
+            try:
+                key = (proc.pid, proc.create_time())
+            except (psutil.NoSuchProcess, psutil.ZombieProcess):
+                gone += 1
+                continue
+            except psutil.AccessDenied:
+                denied += 1
+                key = (proc.pid, None)
+            entry = self._entries.get(key)
+            if entry is None:
+                try:
+                    entry = (self._resolve(proc, key), proc)
+                except (psutil.NoSuchProcess, psutil.ZombieProcess):
+                    gone += 1
+                    continue
+                spawned.append(entry[0])
+            elif entry[1] is None:
+                entry = (entry[0], proc)  # Restored from a checkpoint
+            entries[key] = entry
+        exited = [info for key, (info, _) in self._entries.items() if key not in entries]
+        self._entries = entries
+        if gone:
+            SCAN_SKIPS.labels(reason="no_such_process").inc(gone)
+        if denied:
+            SCAN_SKIPS.labels(reason="access_denied").inc(denied)
+        processes = [info for info, _ in entries.values()]
+        handles = {info['pid']: proc for info, proc in entries.values()}
+        return processes, spawned, exited, handles
+
+    def state(self):
+        """
+        Returns the info dicts of the tracked processes, e.g. for a checkpoint.
+        """
+        return [info for info, _ in self._entries.values()]
+
+    def restore(self, infos):
+        """
+        Tracks processes returned by state() again. Their handles are picked up
+        by the next update, which reports the ones that exited meanwhile.
+        """
+        self._entries = {(info['pid'], info['create_time']): (info, None) for info in infos}
+
+
+class AdaptiveInterval:
+    """
+    Chooses the sampling interval from the process churn between snapshots.
+    The interval shrinks towards ``floor`` when processes spawn and exit quickly,
+    so short-lived processes are still seen, and grows towards ``ceiling`` on
+    quiet machines. It never drops below what keeps the agent's own CPU use per
+    tick within ``cpu_budget`` (a fraction of one CPU).
+    """
+
+    def __init__(self, floor=5, ceiling=60, cpu_budget=0.01, target_churn=10, smoothing=0.5):
+        self.floor = floor
+        self.ceiling = ceiling
+        self.cpu_budget = cpu_budget
+        self.target_churn = target_churn
+        self.smoothing = smoothing
+        self.interval = ceiling
+
+    def update(self, churn, elapsed, tick_cpu):
+        """
+        Returns the next interval, given the number of spawned and exited processes
+        seen over the last ``elapsed`` seconds and the CPU seconds the tick took.
+        """
+        if elapsed > 0 and churn:
+            # Aim for about target_churn spawns and exits per tick.
+            wanted = self.target_churn * elapsed / churn
+        else:
+            wanted = self.ceiling
+        wanted = min(max(wanted, self.floor), self.ceiling)
+        interval = self.smoothing * min(self.interval, self.ceiling) + (1 - self.smoothing) * wanted
+        if self.cpu_budget:
+            # The CPU budget takes precedence over the ceiling.
+            interval = max(interval, tick_cpu / self.cpu_budget)
+        self.interval = interval
+        return interval
+
+
+class ProcessSampler:
+    """
+    Walks the process table once per tick and passes the resulting snapshot to
+    each registered consumer, so the psutil cost does not grow with the number
+    of consumers. With an AdaptiveInterval the interval follows process churn.
+    """
+
+    def __init__(self, attrs=('pid', 'exe'), interval=60, adaptive=None, table=None):
+        self.interval = interval
+        self.adaptive = adaptive
+        self.table = table if table is not None else ProcessTable(attrs)
+        self._consumers = []
+        self._last_time = None
+
+    def register(self, consumer):
+        """
+        Registers a callable that receives every snapshot.
+        """
+        self._consumers.append(consumer)
+        return consumer
+
+    def snapshot(self):
+        """
+        Takes a single snapshot of the process table.
+        """
+        return Snapshot(time.time(), *self.table.update())
+
+    def tick(self):
+        """
+        Takes one snapshot and hands it to every consumer.
+        """
+        # Only this thread's CPU counts, not the publisher or writer threads
+        # working at the same time.
+        cpu_start = time.thread_time()
+        with SCAN_SECONDS.time():
+            snapshot = self.snapshot()
+        PROCESSES.set(len(snapshot.processes))
+        PROCESS_EVENTS.labels(event="spawned").inc(len(snapshot.spawned))
+        PROCESS_EVENTS.labels(event="exited").inc(len(snapshot.exited))
+        for consumer in self._consumers:
+            try:
+                consumer(snapshot)
+            except Exception:  # A failing consumer must not starve the others
+                logging.exception("Snapshot consumer %r failed", consumer)
+        if self.adaptive is not None:
+            if self._last_time is None:
+                # Churn needs two snapshots; take the second one soon.
+                self.interval = self.adaptive.floor
+            else:
+                self.interval = self.adaptive.update(
+                    len(snapshot.spawned) + len(snapshot.exited),
+                    snapshot.time - self._last_time,
+                    time.thread_time() - cpu_start
+                )
+        self._last_time = snapshot.time
+        TICK_CPU_SECONDS.observe(time.thread_time() - cpu_start)
+        SAMPLE_INTERVAL.set(self.interval)
+        return snapshot
+
+    def run(self, duration, stop_event=None):
+        """
+        Samples every ``interval`` seconds until ``duration`` seconds have
+        passed or ``stop_event`` is set. The last wait is cut short so the run
+        ends on time rather than up to one interval late.
+        """
+        start_time = time.monotonic()
+        while time.monotonic() - start_time < duration:
+            self.tick()
+            wait = max(min(self.interval, duration - (time.monotonic() - start_time)), 0)
+            if stop_event is None:
+                time.sleep(wait)
+            elif stop_event.wait(wait):
+                break
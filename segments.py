@@ -0,0 +1,208 @@
+"""
+Module for keeping an index of sample log segments and their pipeline status.
+
+Every segment is listed in Logs/manifest.json with its time range, size and
+status, so the render and deliver stages can look up their work instead of
+rescanning the Logs directories:
+
+    active -> pending -> converted -> mailed
+"""
+
+import os
+import glob
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+ACTIVE = "active"
+PENDING = "pending"
+CONVERTED = "converted"
+MAILED = "mailed"
+STATUSES = (ACTIVE, PENDING, CONVERTED, MAILED)
+
+# Serializes edits between the collecting and publishing threads.
+_lock = threading.RLock()
+
+
+def next_boundary(now=None, minutes=60):
+    """
+    Returns the start of the period of the given length, counted from midnight,
+    that follows the given time. By default this is the start of the next hour.
+    """
+    now = now or datetime.now()
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    periods = int((now - midnight).total_seconds() // (minutes * 60)) + 1
+    return min(midnight + timedelta(minutes=periods * minutes), midnight + timedelta(days=1))
+
+
+def segment_name(path):
+    """
+    Returns the manifest key of a segment: its file name without extension.
+    """
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+class SegmentManifest:
+    """
+    Index of sample log segments, kept in a JSON file and grouped by status in
+    memory so each status can be listed without scanning the others.
+    Paths are stored relative to the Logs directory.
+
+    Changes are only written inside ``edit()``, which reloads the file first so
+    edits made through other instances are not lost.
+    """
+
+    def __init__(self, logs_dir, keep_mailed=1000):
+        self.logs_dir = logs_dir
+        self.path = os.path.join(logs_dir, "manifest.json")
+        self.keep_mailed = keep_mailed
+        self._by_status = {status: {} for status in STATUSES}
+        self.exists = os.path.exists(self.path)
+        self.load()
+
+    def load(self):
+        """
+        Loads the manifest file, if there is one.
+        """
+        self._by_status = {status: {} for status in STATUSES}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                segments = json.load(file).get("segments", [])
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logging.error("Could not read segment manifest %s: %s", self.path, str(e))
+            return
+        for entry in segments:
+            self._by_status.setdefault(entry.get("status", PENDING), {})[entry["name"]] = entry
+
+    @contextmanager
+    def edit(self):
+        """
+        Reloads the manifest, lets the caller change it and writes it back.
+        """
+        with _lock:
+            self.load()
+            yield self
+            self.save()
+
+    def save(self):
+        """
+        Writes the manifest atomically, dropping the oldest mailed segments beyond keep_mailed.
+        """
+        mailed = self._by_status[MAILED]
+        while len(mailed) > self.keep_mailed:
+            mailed.pop(next(iter(mailed)))
+        segments = [entry for entries in self._by_status.values() for entry in entries.values()]
+        segments.sort(key=lambda entry: entry.get("start") or 0)
+        os.makedirs(self.logs_dir, exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump({"segments": segments}, file, indent=1)
+        os.replace(temp_path, self.path)
+        self.exists = True
+
+    def relative(self, path):
+        """
+        Returns a path relative to the Logs directory.
+        """
+        return os.path.relpath(path, self.logs_dir)
+
+    def absolute(self, relative_path):
+        """
+        Returns the absolute path of a path stored in the manifest.
+        """
+        return os.path.join(self.logs_dir, relative_path) if relative_path else None
+
+    def get(self, path):
+        """
+        Returns the entry of a segment, given any of its file paths or its name.
+        """
+        name = segment_name(path)
+        for entries in self._by_status.values():
+            if name in entries:
+                return entries[name]
+        return None
+
+    def new_path(self, text_path):
+        """
+        Returns the given text path of a new segment, or a numbered variant of
+        it if a file or an entry of the manifest already uses its name.
+        Segments started within the same minute share the same base path.
+        """
+        base, ext = os.path.splitext(text_path)
+        path = text_path
+        count = 1
+        while os.path.exists(path) or os.path.exists(os.path.splitext(path)[0] + '.samples') \
+                or self.get(path) is not None:
+            path = f"{base}_{count}{ext}"
+            count += 1
+        return path
+
+    def add(self, text_path, start=None, status=ACTIVE):
+        """
+        Adds a segment, by default as the one currently being written.
+        """
+        entry = {
+            "name": segment_name(text_path),
+            "text": self.relative(text_path),
+            "pdf": None,
+            "start": start if start is not None else time.time(),
+            "end": None,
+            "size": None,
+            "status": status,
+        }
+        self._by_status[status][entry["name"]] = entry
+        return entry
+
+    def update(self, path, status=None, **fields):
+        """
+        Updates the fields of a segment and optionally moves it to a new status.
+        Paths in the fields are stored relative to the Logs directory.
+        Returns the entry, or None if the segment is not in the manifest.
+        """
+        entry = self.get(path)
+        if entry is None:
+            return None
+        for key, value in fields.items():
+            entry[key] = self.relative(value) if key in ("text", "pdf") and value else value
+        if status and status != entry["status"]:
+            del self._by_status[entry["status"]][entry["name"]]
+            entry["status"] = status
+            self._by_status[status][entry["name"]] = entry
+        return entry
+
+    def with_status(self, *statuses):
+        """
+        Returns the segments with any of the given statuses, oldest first.
+        """
+        entries = [entry for status in statuses for entry in self._by_status[status].values()]
+        return sorted(entries, key=lambda entry: entry.get("start") or 0)
+
+    def files(self, status, field="text"):
+        """
+        Returns the absolute paths kept in a field of the segments with a status, oldest first.
+        """
+        return [self.absolute(entry[field]) for entry in self.with_status(status) if entry.get(field)]
+
+
+def open_manifest(logs_dir):
+    """
+    Returns the manifest of a Logs directory. When there is none yet, it is
+    built once from the text logs and PDF reports waiting in the date directories.
+    """
+    manifest = SegmentManifest(logs_dir)
+    if manifest.exists:
+        return manifest
+    with manifest.edit():
+        for path in glob.glob(os.path.join(logs_dir, "*", "*.txt")):
+            manifest.add(path, os.path.getmtime(path), PENDING)
+        for path in glob.glob(os.path.join(logs_dir, "*", "*.pdf")):
+            if manifest.get(path) is None:
+                manifest.add(path, os.path.getmtime(path), CONVERTED)["text"] = None
+            manifest.update(path, CONVERTED, pdf=path)
+    logging.info("Indexed %d waiting segment(s) in %s", len(manifest.with_status(PENDING, CONVERTED)), manifest.path)
+    return manifest
@@ -0,0 +1,354 @@
+"""
+Module for storing samples in a compact, append-only binary format.
+
+Each sample file holds fixed-size records of (timestamp, pid, exe id, kind).
+Executable paths are interned into a companion ``.strings`` file, so every
+path is written once per sample file no matter how often it is seen.
+
+Besides process spawns and exits, a store can hold every line of the sample
+log through SampleStoreHandler, with the text after the label in place of
+the executable, so the text log can be rebuilt from it without loss. The I/O
+counters of file operation lines change with every sample, so they are kept
+as numbers in a companion ``.io`` file instead, and only the executable and
+open files are interned.
+"""
+
+import os
+import mmap
+import struct
+import logging
+from datetime import datetime
+from iostats import IOUsage, format_io_usage
+
+PROCESS = 1
+FILE_OPERATION = 2
+SPAWN = 3
+EXIT = 4
+COMPUTER_NAME = 5
+SYSTEM_STARTUP = 6
+PROCESS_CHECK = 7
+FILE_OPERATION_CHECK = 8
+# A file operation with its counters in the .io file; the pid field of its
+# record holds the index of the counters there.
+IO_USAGE = 9
+
+# Labels used when rendering samples as text, matching the text log lines.
+KIND_LABELS = {
+    PROCESS: "Process",
+    FILE_OPERATION: "File Operation",
+    SPAWN: "Process",
+    EXIT: "Process Exit",
+    COMPUTER_NAME: "Computer Name",
+    SYSTEM_STARTUP: "System Startup",
+    PROCESS_CHECK: "Process Check",
+    FILE_OPERATION_CHECK: "File Operation Check",
+    IO_USAGE: "File Operation",
+}
+# Kinds of the sample log lines, by label; SPAWN and EXIT are never logged as text.
+LOG_KINDS = {KIND_LABELS[kind]: kind for kind in (
+    PROCESS, FILE_OPERATION, COMPUTER_NAME, SYSTEM_STARTUP, PROCESS_CHECK, FILE_OPERATION_CHECK
+)}
+
+RECORD = struct.Struct('<dIIB')
+STRING_LENGTH = struct.Struct('<H')
+# pid, bytes read, bytes written, reads, writes, descriptors (-1 if unknown), open files id.
+IO_RECORD = struct.Struct('<IQQQQiI')
+
+# Records decoded per slice of the memory-mapped file when reading.
+READ_CHUNK = 4096
+
+
+def strings_path(path):
+    """
+    Returns the path of the string table belonging to a sample file.
+    """
+    return os.path.splitext(path)[0] + '.strings'
+
+
+def io_path(path):
+    """
+    Returns the path of the I/O counters belonging to a sample file.
+    """
+    return os.path.splitext(path)[0] + '.io'
+
+
+def load_strings(path):
+    """
+    Loads the string table of a sample file. Id 0 is reserved for an unknown executable.
+    """
+    try:
+        with open(strings_path(path), 'rb') as file:
+            data = file.read()
+    except FileNotFoundError:
+        return [None]
+    return _parse_strings(data)[0]
+
+
+def _parse_strings(data):
+    """
+    Returns (strings, bytes used) for the data of a string table.
+    """
+    strings = [None]
+    offset = 0
+    while offset + STRING_LENGTH.size <= len(data):
+        (length,) = STRING_LENGTH.unpack_from(data, offset)
+        start = offset + STRING_LENGTH.size
+        if start + length > len(data):
+            break  # Partially written entry from an interrupted flush
+        strings.append(data[start:start + length].decode('utf-8', 'surrogateescape'))
+        offset = start + length
+    return strings, offset
+
+
+def truncate_partial(path):
+    """
+    Cuts a partial record or string left by an interrupted write off the end
+    of a sample file and its string table, so appending to it can resume.
+    Only the file sizes and the string table are read.
+    """
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        return
+    if size % RECORD.size:
+        os.truncate(path, size - size % RECORD.size)
+    try:
+        size = os.path.getsize(io_path(path))
+        if size % IO_RECORD.size:
+            os.truncate(io_path(path), size - size % IO_RECORD.size)
+    except FileNotFoundError:
+        pass
+    try:
+        with open(strings_path(path), 'rb') as file:
+            data = file.read()
+    except FileNotFoundError:
+        return
+    used = _parse_strings(data)[1]
+    if used < len(data):
+        os.truncate(strings_path(path), used)
+
+
+class SampleStore:
+    """
+    Appends samples to a binary sample file, buffering writes in memory until
+    ``buffer_size`` bytes are pending.
+    """
+
+    def __init__(self, path, buffer_size=64 * 1024):
+        self.path = path
+        self.buffer_size = buffer_size
+        self._strings = load_strings(path)
+        self._ids = {value: index for index, value in enumerate(self._strings) if index}
+        self._pending_strings = bytearray()
+        self._buffer = bytearray()
+        self._io_buffer = bytearray()
+        self._data_file = open(path, 'ab')
+        self._strings_file = open(strings_path(path), 'ab')
+        # Opened on the first file operation, since most stores have none.
+        self._io_file = None
+        self._io_count = None
+
+    def intern(self, value):
+        """
+        Returns the id of a string, adding it to the string table if needed.
+        Only None maps to id 0, so an empty string is rendered back as empty.
+        """
+        if value is None:
+            return 0
+        string_id = self._ids.get(value)
+        if string_id is None:
+            encoded = value.encode('utf-8', 'surrogateescape')[:0xFFFF]
+            self._pending_strings += STRING_LENGTH.pack(len(encoded)) + encoded
+            string_id = len(self._strings)
+            self._strings.append(value)
+            self._ids[value] = string_id
+        return string_id
+
+    def append(self, timestamp, pid, exe, kind):
+        """
+        Appends a single sample.
+        """
+        self._buffer += RECORD.pack(timestamp, pid, self.intern(exe), kind)
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def append_io(self, timestamp, usage):
+        """
+        Appends the I/O of a process over one interval, an iostats.IOUsage.
+        """
+        if self._io_file is None:
+            self._io_file = open(io_path(self.path), 'ab')
+            self._io_count = self._io_file.tell() // IO_RECORD.size
+        files = ';'.join(usage.open_files[:5]) if usage.open_files else None
+        self._io_buffer += IO_RECORD.pack(
+            usage.pid, usage.read_bytes, usage.write_bytes, usage.read_count, usage.write_count,
+            -1 if usage.fds is None else usage.fds, self.intern(files)
+        )
+        self.append(timestamp, self._io_count, usage.exe, IO_USAGE)
+        self._io_count += 1
+
+    @property
+    def size(self):
+        """
+        Returns the size of the sample file in bytes, including pending samples.
+        """
+        return self._data_file.tell() + len(self._buffer)
+
+    def record_snapshot(self, snapshot):
+        """
+        Records the processes spawned and exited since the previous snapshot.
+        It can be registered directly as a sampler consumer.
+        """
+        for info in snapshot.spawned:
+            self.append(snapshot.time, info['pid'], info.get('exe'), SPAWN)
+        for info in snapshot.exited:
+            self.append(snapshot.time, info['pid'], info.get('exe'), EXIT)
+
+    def flush(self):
+        """
+        Writes pending samples to disk. Strings and I/O counters are written
+        first, so a sample never refers to anything that is missing.
+        """
+        if self._pending_strings:
+            self._strings_file.write(self._pending_strings)
+            self._strings_file.flush()
+            self._pending_strings.clear()
+        if self._io_buffer:
+            self._io_file.write(self._io_buffer)
+            self._io_file.flush()
+            self._io_buffer.clear()
+        if self._buffer:
+            self._data_file.write(self._buffer)
+            self._data_file.flush()
+            self._buffer.clear()
+
+    def sync(self):
+        """
+        Flushes pending samples and makes sure they reach the disk.
+        """
+        self.flush()
+        os.fsync(self._strings_file.fileno())
+        if self._io_file is not None:
+            os.fsync(self._io_file.fileno())
+        os.fsync(self._data_file.fileno())
+
+    def close(self):
+        """
+        Flushes pending samples and closes the sample file.
+        """
+        self.flush()
+        self._data_file.close()
+        self._strings_file.close()
+        if self._io_file is not None:
+            self._io_file.close()
+
+
+class SampleStoreHandler(logging.Handler):
+    """
+    Records sample log records ("<label>: <text>") in a sample store, so the
+    store holds everything the text log would. Records logged with an
+    ``io_usage`` attribute are stored with their counters as numbers. It must
+    be used from the thread that writes the store's other samples.
+    """
+
+    def __init__(self, store):
+        super().__init__()
+        self.store = store
+
+    def emit(self, record):
+        try:
+            usage = getattr(record, "io_usage", None)
+            if usage is not None:
+                self.store.append_io(record.created, usage)
+                return
+            label, sep, text = record.getMessage().partition(": ")
+            kind = LOG_KINDS.get(label) if sep else None
+            if kind is not None:
+                self.store.append(record.created, 0, text, kind)
+        except Exception:  # Like any handler, never raise into the caller
+            self.handleError(record)
+
+
+def _first_record_at(view, count, start):
+    """
+    Returns the index of the first record with a timestamp at or after ``start``.
+    Samples are appended in time order, so this is a binary search.
+    """
+    low, high = 0, count
+    while low < high:
+        middle = (low + high) // 2
+        if RECORD.unpack_from(view, middle * RECORD.size)[0] < start:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def _io_text(io_data, index, exe, strings):
+    """
+    Returns the pid and the sample log text of the I/O counters at an index of an .io file.
+    """
+    if (index + 1) * IO_RECORD.size > len(io_data):
+        return 0, exe
+    pid, read_bytes, write_bytes, reads, writes, fds, files_id = IO_RECORD.unpack_from(io_data, index * IO_RECORD.size)
+    files = strings[files_id] if files_id < len(strings) else None
+    usage = IOUsage(pid, exe, read_bytes, write_bytes, reads, writes,
+                    None if fds < 0 else fds, files.split(';') if files else None)
+    return pid, format_io_usage(usage)
+
+
+def read_samples(path, start=None, end=None, kinds=None):
+    """
+    Yields (timestamp, pid, exe, kind) for the samples in a sample file,
+    optionally limited to a time range and a set of kinds. File operations
+    with their counters in the .io file have the formatted counters after
+    the executable, as in the sample log.
+    """
+    strings = load_strings(path)
+    io_data = None
+    with open(path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        count = size // RECORD.size  # Ignore a trailing partial record
+        if not count:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            first = _first_record_at(view, count, start) if start is not None else 0
+            for chunk_start in range(first, count, READ_CHUNK):
+                chunk = view[chunk_start * RECORD.size:min(chunk_start + READ_CHUNK, count) * RECORD.size]
+                for timestamp, pid, exe_id, kind in RECORD.iter_unpack(chunk):
+                    if end is not None and timestamp >= end:
+                        return
+                    if kinds is None or kind in kinds:
+                        exe = strings[exe_id] if exe_id < len(strings) else None
+                        if kind == IO_USAGE:
+                            if io_data is None:
+                                io_data = _read_file(io_path(path))
+                            pid, exe = _io_text(io_data, pid, exe, strings)
+                        yield timestamp, pid, exe, kind
+
+
+def _read_file(path):
+    try:
+        with open(path, 'rb') as file:
+            return file.read()
+    except FileNotFoundError:
+        return b''
+
+
+def write_text_view(path, txt_path):
+    """
+    Renders a sample file as a text log in the same format as the sample log,
+    so it can be converted and mailed like one. A store that recorded the
+    sample log yields the same lines as the text log; one that only holds
+    spawns and exits is rendered from those.
+    """
+    written = 0
+    with open(txt_path, 'w', encoding='utf-8', errors='replace') as file:
+        for kinds in (set(LOG_KINDS.values()) | {IO_USAGE}, None):
+            for timestamp, _, exe, kind in read_samples(path, kinds=kinds):
+                asctime = datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S,%f')[:-3]
+                file.write(f"{asctime} - INFO - {KIND_LABELS.get(kind, 'Sample')}: {exe}\n")
+                written += 1
+            if written:
+                break
+    return txt_path
@@ -0,0 +1,190 @@
+"""
+Module for summarizing a sample log into per-executable statistics.
+"""
+
+from datetime import datetime
+from store import KIND_LABELS, COMPUTER_NAME, SYSTEM_STARTUP, PROCESS_CHECK, FILE_OPERATION_CHECK
+
+# Message prefixes of the sample log lines, mapped to the summary section they count towards.
+SECTIONS = {
+    "Process: ": "processes",
+    "File Operation: ": "file_operations",
+    "Process Exit: ": "exits",
+}
+CHECK_PREFIXES = ("Process Check: ", "File Operation Check: ")
+SEPARATOR = " - "
+# Separates the executable from its I/O statistics in "File Operation" lines.
+STATS_SEPARATOR = " | "
+# Stands in for the executable of a sample recorded without one.
+UNKNOWN_EXE = "<unknown>"
+
+
+def parse_line(line):
+    """
+    Splits a sample log line into (timestamp, message).
+    Returns (None, line) for lines not in the sample log format.
+    """
+    timestamp, sep, rest = line.partition(SEPARATOR)
+    if not sep:
+        return None, line
+    _, sep, message = rest.partition(SEPARATOR)
+    if not sep:
+        return None, line
+    return timestamp, message
+
+
+def parse_io_stats(text):
+    """
+    Parses the "key=value" I/O statistics of a "File Operation" line into
+    (bytes read, bytes written).
+    """
+    read_bytes = write_bytes = 0
+    for field in text.split():
+        key, _, value = field.partition("=")
+        if key == "read" and value.isdigit():
+            read_bytes = int(value)
+        elif key == "write" and value.isdigit():
+            write_bytes = int(value)
+    return read_bytes, write_bytes
+
+
+def summarize_log(input_file):
+    """
+    Reads a sample log once and returns a summary dict with the host details,
+    the covered time range, the number of checks and, for each section, a
+    mapping of executable to [count, first seen, last seen]. The "io" entry maps
+    each executable to the [bytes read, bytes written] logged for it.
+    Timestamps are kept as the strings in the log, which sort chronologically.
+    """
+    summary = {
+        "computer_name": None,
+        "system_startup": None,
+        "start": None,
+        "end": None,
+        "checks": 0,
+        "lines": 0,
+        "io": {},
+    }
+    for section in SECTIONS.values():
+        summary[section] = {}
+
+    with open(input_file, 'r', encoding='utf-8', errors='replace') as file:
+        for line in file:
+            summary["lines"] += 1
+            timestamp, message = parse_line(line.rstrip('\n'))
+            if timestamp is None:
+                continue
+            if summary["start"] is None:
+                summary["start"] = timestamp
+            summary["end"] = timestamp
+
+            if message.startswith(CHECK_PREFIXES):
+                summary["checks"] += 1
+                continue
+            for prefix, section in SECTIONS.items():
+                if message.startswith(prefix):
+                    exe, _, stats = message[len(prefix):].partition(STATS_SEPARATOR)
+                    add_sample(summary[section], exe, timestamp)
+                    if stats:
+                        add_io(summary["io"], exe, *parse_io_stats(stats))
+                    break
+            else:
+                if message.startswith("Computer Name: "):
+                    summary["computer_name"] = message[len("Computer Name: "):]
+                elif message.startswith("System Startup: "):
+                    summary["system_startup"] = message[len("System Startup: "):]
+    return summary
+
+
+def summarize_samples(samples, computer_name=None):
+    """
+    Returns a summary dict like summarize_log for (timestamp, pid, exe, kind)
+    samples, such as those read from a binary sample file. Samples recorded
+    from the sample log also give the host details, checks and I/O. Samples
+    without an executable are counted under UNKNOWN_EXE.
+    """
+    summary = {
+        "computer_name": computer_name,
+        "system_startup": None,
+        "start": None,
+        "end": None,
+        "checks": 0,
+        "lines": 0,
+        "io": {},
+    }
+    for section in SECTIONS.values():
+        summary[section] = {}
+
+    for epoch, _, exe, kind in samples:
+        summary["lines"] += 1
+        timestamp = datetime.fromtimestamp(epoch).strftime('%Y-%m-%d %H:%M:%S,%f')[:-3]
+        if summary["start"] is None or timestamp < summary["start"]:
+            summary["start"] = timestamp
+        if summary["end"] is None or timestamp > summary["end"]:
+            summary["end"] = timestamp
+        if kind == COMPUTER_NAME:
+            summary["computer_name"] = summary["computer_name"] or exe
+            continue
+        if kind == SYSTEM_STARTUP:
+            summary["system_startup"] = exe
+            continue
+        if kind in (PROCESS_CHECK, FILE_OPERATION_CHECK):
+            summary["checks"] += 1
+            continue
+        section = SECTIONS.get(KIND_LABELS.get(kind, "") + ": ")
+        if section is None:
+            continue
+        exe, _, stats = exe.partition(STATS_SEPARATOR) if exe else (UNKNOWN_EXE, "", "")
+        add_sample(summary[section], exe, timestamp)
+        if stats:
+            add_io(summary["io"], exe, *parse_io_stats(stats))
+    return summary
+
+
+def add_sample(stats, exe, timestamp, count=1):
+    """
+    Counts a sighting of an executable in a section of the summary.
+    """
+    entry = stats.get(exe)
+    if entry is None:
+        stats[exe] = [count, timestamp, timestamp]
+    else:
+        entry[0] += count
+        if timestamp < entry[1]:
+            entry[1] = timestamp
+        if timestamp > entry[2]:
+            entry[2] = timestamp
+
+
+def add_io(io, exe, read_bytes, write_bytes):
+    """
+    Adds the bytes read and written by an executable to the I/O totals of the summary.
+    """
+    entry = io.get(exe)
+    if entry is None:
+        io[exe] = [read_bytes, write_bytes]
+    else:
+        entry[0] += read_bytes
+        entry[1] += write_bytes
+
+
+def top_io(io, limit=None):
+    """
+    Returns (exe, bytes read, bytes written) rows ordered by descending total I/O.
+    """
+    rows = sorted(
+        ((exe, read_bytes, write_bytes) for exe, (read_bytes, write_bytes) in io.items()),
+        key=lambda row: (-(row[1] + row[2]), row[0])
+    )
+    return rows[:limit] if limit else rows
+
+
+def top_executables(stats, limit=None):
+    """
+    Returns (exe, count, first seen, last seen) rows ordered by descending count.
+    """
+    rows = sorted(
+        ((exe, count, first, last) for exe, (count, first, last) in stats.items()),
+        key=lambda row: (-row[1], row[0])
+    )
+    return rows[:limit] if limit else rows
@@ -0,0 +1,136 @@
+import os
+import logging
+import threading
+
+import checkpoint
+from checkpoint import capture_state, load_checkpoint, recover, restore_state, write_checkpoint
+from dedup import DedupCache
+from sampler import ProcessTable
+from segments import SegmentManifest, ACTIVE, PENDING
+from store import RECORD, SampleStore, read_samples, SPAWN
+from writer import AsyncLogWriter
+
+
+def make_logger(name, writer):
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.handlers = [writer.handler]
+    return logger
+
+
+def start_segment(manifest, name):
+    path = os.path.join(manifest.logs_dir, "01-01-2026", f"{name}.txt")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with manifest.edit():
+        manifest.add(path, start=1)
+    return path
+
+
+def test_checkpoint_waits_for_the_text_log(tmp_path):
+    manifest = SegmentManifest(str(tmp_path))
+    path = start_segment(manifest, "segment")
+    writer = AsyncLogWriter(path, flush_interval=60).start()
+    dedup = DedupCache()
+    try:
+        logger = make_logger("test-checkpoint-sync", writer)
+        for index in range(200):
+            if dedup.should_log(f"/bin/{index}"):
+                logger.info("Process: /bin/%d", index)
+        state = capture_state(manifest, path, 2e9, ProcessTable(), dedup, writer=writer)
+
+        with open(path, encoding='utf-8') as file:
+            assert len(file.readlines()) == 200
+        assert len(state["dedup"]) == 200
+    finally:
+        writer.stop()
+
+
+def test_checkpoint_leaves_out_dedup_if_the_text_log_lags(tmp_path, monkeypatch):
+    monkeypatch.setattr(checkpoint, "SYNC_TIMEOUT", 0.2)
+    manifest = SegmentManifest(str(tmp_path))
+    path = start_segment(manifest, "segment")
+    writer = AsyncLogWriter(path).start()
+    release = threading.Event()
+    format_record = writer._format
+
+    def stuck_format(record):
+        release.wait()
+        return format_record(record)
+
+    writer._format = stuck_format
+    dedup = DedupCache()
+    dedup.should_log("/bin/a")
+    make_logger("test-checkpoint-lag", writer).info("Process: /bin/a")
+    try:
+        state = capture_state(manifest, path, 2e9, ProcessTable(), dedup, writer=writer)
+    finally:
+        release.set()
+        writer.stop()
+
+    assert state["dedup"] == []
+    assert state["segment"] == manifest.relative(path)
+
+
+def test_resume_after_a_crash(tmp_path):
+    logs_dir = str(tmp_path)
+    manifest = SegmentManifest(logs_dir)
+    # An older segment cut short with only its sample store, and the current one.
+    stale = start_segment(manifest, "stale")
+    old_store = SampleStore(os.path.splitext(stale)[0] + '.samples')
+    old_store.append(5.0, 7, "/bin/old", SPAWN)
+    old_store.close()
+    current = start_segment(manifest, "current")
+    samples = os.path.splitext(current)[0] + '.samples'
+
+    store = SampleStore(samples)
+    writer = AsyncLogWriter(current).start()
+    dedup = DedupCache()
+    dedup.should_log("/bin/a")
+    make_logger("test-checkpoint-crash", writer).info("Process: /bin/a")
+    store.append(10.0, 1, "/bin/a", SPAWN)
+    write_checkpoint(logs_dir, capture_state(manifest, current, 2e9, ProcessTable(), dedup, store, writer=writer))
+    writer.stop()
+    # The crash: half a line and half a record written after the checkpoint.
+    with open(current, 'a', encoding='utf-8') as file:
+        file.write("2026-01-01 10:00:00,000 - INFO - Proc")
+    with open(samples, 'ab') as file:
+        file.write(b"\1\2\3")
+    store._data_file.close()
+    store._strings_file.close()
+
+    saved = load_checkpoint(logs_dir)
+    restored = DedupCache()
+    restore_state(saved, ProcessTable(), restored)
+    resume, marked = recover(SegmentManifest(logs_dir), saved, now=1e9)
+
+    assert resume == current
+    assert marked == [stale]
+    manifest.load()
+    assert manifest.get(stale)["status"] == PENDING
+    assert manifest.get(current)["status"] == ACTIVE
+    with open(stale, encoding='utf-8') as file:
+        assert "/bin/old" in file.read()
+    with open(current, encoding='utf-8') as file:
+        lines = file.read().split("\n")
+    assert lines[0].endswith("Process: /bin/a")
+    assert lines[-1] == ""
+    assert os.path.getsize(samples) % RECORD.size == 0
+    assert not restored.should_log("/bin/a")
+
+    resumed = SampleStore(samples)
+    resumed.append(20.0, 2, "/bin/b", SPAWN)
+    resumed.close()
+    assert [sample[2] for sample in read_samples(samples)] == ["/bin/a", "/bin/b"]
+
+
+def test_expired_segment_is_not_resumed(tmp_path):
+    manifest = SegmentManifest(str(tmp_path))
+    path = start_segment(manifest, "segment")
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write("line\n")
+
+    resume, marked = recover(manifest, {"segment": manifest.relative(path), "until": 100.0}, now=200.0)
+
+    assert resume is None
+    assert marked == [path]
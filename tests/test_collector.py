@@ -0,0 +1,136 @@
+import os
+import gzip
+import json
+import time
+import zlib
+import threading
+import urllib.error
+import urllib.request
+from datetime import datetime
+
+import pytest
+
+import collector
+from collector import (
+    BatchTooLarge, CollectorServer, FleetCollector, MAX_PID, SAMPLES_PATH, decode_batch, encode_batch,
+)
+from store import PROCESS, EXIT
+
+
+def raw_batch(payload):
+    return gzip.compress(json.dumps(payload).encode('utf-8'))
+
+
+def test_round_trip():
+    samples = [(1.5, 10, "/usr/bin/a", PROCESS), (2.0, 11, None, EXIT), (2.5, 12, "/usr/bin/a", PROCESS)]
+    host, decoded = decode_batch(encode_batch("host-1", samples))
+    assert host == "host-1"
+    assert decoded == samples
+
+
+@pytest.mark.parametrize("record", [
+    [1.0, -1, 0, PROCESS],
+    [1.0, MAX_PID + 1, 0, PROCESS],
+    [1.0, 1, 0, 256],
+    [1.0, 1, 5, PROCESS],
+    [-1.0, 1, 0, PROCESS],
+])
+def test_out_of_range_records_are_rejected(record):
+    data = raw_batch({"host": "h", "strings": ["/usr/bin/a"], "records": [[1.0, 1, 0, PROCESS], record]})
+    with pytest.raises(ValueError):
+        decode_batch(data)
+
+
+@pytest.mark.parametrize("data", [
+    b"not gzip",
+    gzip.compress(b"not json"),
+    raw_batch({"strings": [], "records": []}),
+    raw_batch({"host": "", "strings": [], "records": []}),
+    raw_batch({"host": "h", "strings": [1], "records": [[1.0, 1, 0, PROCESS]]}),
+])
+def test_malformed_batches_are_rejected(data):
+    with pytest.raises(ValueError):
+        decode_batch(data)
+
+
+def test_corrupt_deflate_data_is_rejected():
+    data = bytearray(encode_batch("h", [(1.0, 1, "/usr/bin/a", PROCESS)]))
+    data[12:20] = b"\xff" * 8
+    with pytest.raises(ValueError):
+        decode_batch(bytes(data))
+
+
+def test_truncated_batch_is_rejected():
+    data = encode_batch("h", [(1.0, 1, "/usr/bin/a", PROCESS)])
+    with pytest.raises(ValueError):
+        decode_batch(data[:-10])
+
+
+def test_batch_past_the_decompressed_limit_is_too_large():
+    data = gzip.compress(b" " * (1024 * 1024))
+    with pytest.raises(BatchTooLarge):
+        decode_batch(data, max_size=64 * 1024)
+
+
+def post(server, data):
+    request = urllib.request.Request(
+        "http://127.0.0.1:%d%s" % (server.server_address[1], SAMPLES_PATH), data=data, method="POST"
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def gzip_bomb(size):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    chunk = b" " * (1024 * 1024)
+    data = b"".join(compressor.compress(chunk) for _ in range(size // len(chunk)))
+    return data + compressor.flush()
+
+
+def test_server_status_codes(tmp_path):
+    fleet = FleetCollector(str(tmp_path))
+    server = CollectorServer(fleet, port=0).start()
+    try:
+        assert post(server, encode_batch("h", [(1.0, 1, "/usr/bin/a", PROCESS)])) == 204
+        assert post(server, b"not gzip") == 400
+        assert post(server, gzip_bomb(collector.MAX_DECOMPRESSED_BYTES + 1024 * 1024)) == 413
+    finally:
+        server.stop()
+        fleet.roll()
+
+
+def test_fleet_report_of_samples_without_executable(tmp_path):
+    fleet = FleetCollector(str(tmp_path))
+    fleet.receive("host-1", [(1.0, 1, None, PROCESS), (2.0, 2, "/usr/bin/a", PROCESS), (3.0, 3, None, EXIT)])
+    fleet.receive("host-2", [(1.0, 1, "/usr/bin/a", PROCESS)])
+
+    pdf_file = fleet.render(fleet.roll())
+
+    assert os.path.getsize(pdf_file) > 0
+
+
+def test_collector_keeps_running_when_a_report_fails(tmp_path, monkeypatch):
+    fleet = FleetCollector(str(tmp_path))
+    calls = []
+
+    def failing_publish(collector_, config):
+        calls.append(collector_)
+        raise TypeError("render failed")
+
+    monkeypatch.setattr(collector, "publish_fleet_report", failing_publish)
+    monkeypatch.setattr(collector, "next_boundary", lambda minutes: datetime.now())
+    stop_event = threading.Event()
+    thread = threading.Thread(
+        target=collector.run_collector, args=({"collector_port": 0}, stop_event, fleet), daemon=True
+    )
+    thread.start()
+    while len(calls) < 3 and thread.is_alive():
+        time.sleep(0.01)
+    stop_event.set()
+    thread.join(5)
+
+    assert len(calls) >= 3
+    assert not thread.is_alive()
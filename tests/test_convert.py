@@ -0,0 +1,78 @@
+import re
+import tracemalloc
+
+from convert import wrap_line, char_width, render_text_pdf, FONT_NAME, FONT_SIZE
+
+
+def width(text):
+    return sum(char_width(char, FONT_NAME) for char in text) * FONT_SIZE
+
+
+def test_short_line_is_not_wrapped():
+    assert wrap_line("Process: /usr/bin/a", 500) == ["Process: /usr/bin/a"]
+
+
+def test_long_line_is_split_into_fitting_pieces():
+    line = "Process: " + "/usr/lib/some-long-directory-name" * 10
+    pieces = wrap_line(line, 200)
+    assert "".join(pieces) == line
+    assert len(pieces) > 1
+    assert all(width(piece) <= 200 for piece in pieces)
+
+
+def test_breaks_after_path_separators():
+    line = "/usr/lib/some-long-directory-name" * 10
+    pieces = wrap_line(line, 200)
+    assert all(piece.endswith("/") for piece in pieces[:-1])
+
+
+def test_line_without_break_characters_is_cut():
+    line = "x" * 500
+    pieces = wrap_line(line, 100)
+    assert "".join(pieces) == line
+    assert all(width(piece) <= 100 for piece in pieces)
+
+
+def write_log(path, lines):
+    with open(path, 'w', encoding='utf-8') as file:
+        for index in range(lines):
+            file.write(f"2026-01-01 00:00:00,000 - INFO - Process: /usr/lib/bench/{index % 500:05d}/worker\n")
+
+
+def count_pages(path):
+    with open(path, 'rb') as file:
+        return len(re.findall(rb'/Type /Page\b', file.read()))
+
+
+def peak_bytes(function, *args):
+    tracemalloc.start()
+    try:
+        function(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def test_long_log_is_truncated_with_a_notice(tmp_path):
+    input_file = str(tmp_path / "log.txt")
+    write_log(input_file, 5000)
+    output_file = str(tmp_path / "log.pdf")
+    render_text_pdf(input_file, output_file, max_pages=10)
+    assert count_pages(output_file) == 10
+
+
+def test_short_log_is_not_truncated(tmp_path):
+    input_file = str(tmp_path / "log.txt")
+    write_log(input_file, 100)
+    output_file = str(tmp_path / "log.pdf")
+    render_text_pdf(input_file, output_file, max_pages=10)
+    assert count_pages(output_file) == 2
+
+
+def test_memory_does_not_grow_with_the_log_beyond_the_page_cap(tmp_path):
+    small, large = str(tmp_path / "small.txt"), str(tmp_path / "large.txt")
+    write_log(small, 2000)
+    write_log(large, 40000)
+    small_peak = peak_bytes(render_text_pdf, small, str(tmp_path / "small.pdf"), 30)
+    large_peak = peak_bytes(render_text_pdf, large, str(tmp_path / "large.pdf"), 30)
+    assert large_peak < small_peak * 1.5
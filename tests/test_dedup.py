@@ -0,0 +1,51 @@
+from dedup import DedupCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_key_is_logged_again_after_ttl():
+    clock = FakeClock()
+    cache = DedupCache(ttl=10, clock=clock)
+    assert cache.should_log("a")
+    clock.now = 10
+    assert not cache.should_log("a")
+    clock.now = 10.5
+    assert cache.should_log("a")
+
+
+def test_expired_entries_are_dropped():
+    clock = FakeClock()
+    cache = DedupCache(ttl=10, clock=clock)
+    cache.should_log("a")
+    clock.now = 5
+    cache.should_log("b")
+    clock.now = 12
+    assert cache.expire() == 1
+    assert "a" not in cache and "b" in cache
+
+
+def test_oldest_entry_is_evicted_at_max_size():
+    cache = DedupCache(ttl=10, max_size=2, clock=FakeClock())
+    for key in ("a", "b", "c"):
+        cache.should_log(key)
+    assert len(cache) == 2
+    assert "a" not in cache
+
+
+def test_state_round_trip():
+    clock = FakeClock()
+    cache = DedupCache(ttl=10, clock=clock)
+    cache.should_log("a")
+    clock.now = 4
+    cache.should_log("b")
+    restored = DedupCache(ttl=10, clock=FakeClock())
+    # Restored 7 seconds later, "a" is 11 seconds old and "b" 7.
+    restored.restore(cache.state(), elapsed=7)
+    assert "a" not in restored
+    assert not restored.should_log("b")
@@ -0,0 +1,94 @@
+from collections import namedtuple
+
+import psutil
+
+from iostats import IOSampler, IOUsage, format_io_usage
+from sampler import Snapshot
+
+Counters = namedtuple('Counters', ['read_bytes', 'write_bytes', 'read_count', 'write_count'])
+OpenFile = namedtuple('OpenFile', ['path'])
+
+
+class FakeProcess:
+    def __init__(self, pid):
+        self.pid = pid
+        self.counters = Counters(0, 0, 0, 0)
+        self.open_files_calls = 0
+
+    def io_counters(self):
+        if self.counters is None:
+            raise psutil.AccessDenied(self.pid)
+        return self.counters
+
+    def num_fds(self):
+        return 4
+
+    num_handles = num_fds
+
+    def open_files(self):
+        self.open_files_calls += 1
+        return [OpenFile(f"/tmp/{self.pid}.log")]
+
+
+def snapshot(processes, exited=()):
+    infos = [{'pid': proc.pid, 'exe': f"/usr/bin/p{proc.pid}", 'create_time': 1.0} for proc in processes]
+    return Snapshot(0.0, infos, [], list(exited), {proc.pid: proc for proc in processes})
+
+
+def make_sampler(**options):
+    clock = [0.0]
+    sampler = IOSampler(clock=lambda: clock[0], **options)
+    sampler.supported = True
+    return sampler, clock
+
+
+def test_first_sighting_only_sets_the_baseline():
+    sampler, _ = make_sampler()
+    proc = FakeProcess(1)
+    proc.counters = Counters(100, 100, 1, 1)
+    assert sampler.sample(snapshot([proc])) == []
+
+
+def test_reports_deltas_of_the_top_consumers_in_order():
+    sampler, _ = make_sampler(top=2, open_files_top=1)
+    procs = [FakeProcess(pid) for pid in (1, 2, 3, 4)]
+    sampler.sample(snapshot(procs))
+    procs[0].counters = Counters(10, 0, 1, 0)
+    procs[1].counters = Counters(0, 500, 0, 5)
+    procs[2].counters = Counters(100, 100, 2, 2)
+    usage = sampler.sample(snapshot(procs))
+    assert usage == [
+        IOUsage(2, "/usr/bin/p2", 0, 500, 0, 5, 4, ["/tmp/2.log"]),
+        IOUsage(3, "/usr/bin/p3", 100, 100, 2, 2, 4, None),
+    ]
+
+
+def test_open_files_are_looked_up_at_most_once_per_interval():
+    sampler, clock = make_sampler(open_files_top=1, open_files_interval=300)
+    proc = FakeProcess(1)
+    sampler.sample(snapshot([proc]))
+    for step in range(1, 4):
+        proc.counters = Counters(step * 100, 0, step, 0)
+        clock[0] = step * 100
+        sampler.sample(snapshot([proc]))
+    assert proc.open_files_calls == 1
+    proc.counters = Counters(1000, 0, 10, 0)
+    clock[0] = 400
+    assert sampler.sample(snapshot([proc]))[0].open_files == ["/tmp/1.log"]
+
+
+def test_unreadable_and_exited_processes_are_skipped():
+    sampler, _ = make_sampler()
+    proc = FakeProcess(1)
+    sampler.sample(snapshot([proc]))
+    proc.counters = None
+    assert sampler.sample(snapshot([proc])) == []
+    info = {'pid': 1, 'exe': "/usr/bin/p1", 'create_time': 1.0}
+    sampler.sample(Snapshot(0.0, [], [], [info], {}))
+    assert sampler._counters == {}
+
+
+def test_format_io_usage():
+    usage = IOUsage(1, "/usr/bin/a", 10, 20, 1, 2, 3, ["/a", "/b"])
+    assert format_io_usage(usage) == "/usr/bin/a | read=10 write=20 reads=1 writes=2 fds=3 files=/a;/b"
+    assert format_io_usage(usage._replace(fds=None, open_files=None)) == "/usr/bin/a | read=10 write=20 reads=1 writes=2"
@@ -0,0 +1,246 @@
+import io
+import os
+import gzip
+import email
+import zipfile
+import threading
+import socketserver
+
+import pytest
+
+import mail
+
+
+class SinkHandler(socketserver.StreamRequestHandler):
+    """
+    Speaks just enough SMTP to accept messages. The first ``fail`` DATA
+    commands are answered with a temporary error.
+    """
+
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b"\r\n")
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply("220 test SMTP sink")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command in (b"EHLO", b"HELO"):
+                self.reply("250 test")
+            elif command == b"DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = b""
+                for chunk in self.rfile:
+                    if chunk == b".\r\n":
+                        break
+                    data += chunk
+                if self.server.fail > 0:
+                    self.server.fail -= 1
+                    self.reply("451 Try again later")
+                else:
+                    self.server.messages.append(email.message_from_bytes(data))
+                    self.reply("250 Accepted")
+            elif command == b"QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("250 OK")
+
+
+class SinkServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+
+    def __init__(self, fail=0):
+        super().__init__(("127.0.0.1", 0), SinkHandler)
+        self.fail = fail
+        self.connections = 0
+        self.messages = []
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+
+@pytest.fixture
+def sink():
+    server = SinkServer()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def smtp_config(server, **settings):
+    config = {
+        "fromaddr": "track@localhost", "toaddr": "admin@localhost",
+        "smtp_host": "127.0.0.1", "smtp_port": server.server_address[1],
+        "smtp_starttls": False, "smtp_login": False,
+    }
+    config.update(settings)
+    return config
+
+
+def make_reports(directory, count, size=1000):
+    reports = []
+    for index in range(count):
+        path = os.path.join(directory, f"report_{index}.pdf")
+        with open(path, 'wb') as file:
+            file.write(os.urandom(size))
+        reports.append(path)
+    return reports
+
+
+def attachments(message):
+    return [(part.get_filename(), part.get_payload(decode=True))
+            for part in message.walk() if part.get_filename()]
+
+
+def test_reports_are_sent_over_one_connection_and_archived(tmp_path, sink):
+    reports = make_reports(str(tmp_path), 3)
+    contents = [open(path, 'rb').read() for path in reports]
+    failed = mail.deliver_reports(reports, smtp_config(sink), retries=0)
+    assert failed == []
+    assert sink.connections == 1
+    assert [attachments(message) for message in sink.messages] == [
+        [(os.path.basename(path), content)] for path, content in zip(reports, contents)
+    ]
+    for path in reports:
+        assert not os.path.exists(path)
+        assert os.path.exists(os.path.join(str(tmp_path), "reports", "pdf", os.path.basename(path)))
+
+
+def test_digest_packs_reports_into_batches(tmp_path, sink):
+    reports = make_reports(str(tmp_path), 5)
+    failed = mail.deliver_reports(reports, smtp_config(sink), digest=True, digest_size=2, retries=0)
+    assert failed == []
+    assert [len(attachments(message)) for message in sink.messages] == [2, 2, 1]
+    assert sink.messages[0]["Subject"].endswith("Hourly Reports (2)")
+
+
+def test_failed_send_is_retried_with_backoff(tmp_path, monkeypatch):
+    server = SinkServer(fail=2)
+    delays = []
+    monkeypatch.setattr(mail.time, "sleep", delays.append)
+    try:
+        reports = make_reports(str(tmp_path), 1)
+        failed = mail.deliver_reports(reports, smtp_config(server), retries=3, backoff=2)
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert failed == []
+    assert delays == [2, 4]
+    assert server.connections == 3  # Every retry starts on a fresh connection
+    assert len(server.messages) == 1
+
+
+def test_report_is_kept_when_every_attempt_fails(tmp_path, monkeypatch):
+    server = SinkServer(fail=10)
+    monkeypatch.setattr(mail.time, "sleep", lambda seconds: None)
+    try:
+        reports = make_reports(str(tmp_path), 1)
+        failed = mail.deliver_reports(reports, smtp_config(server), retries=1)
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert failed == reports
+    assert os.path.exists(reports[0])
+
+
+def test_large_attachment_is_streamed_from_disk(tmp_path, sink, monkeypatch):
+    reports = make_reports(str(tmp_path), 1, size=3 * mail.ENCODE_CHUNK_SIZE + 5)
+    content = open(reports[0], 'rb').read()
+    reads = []
+    real_open = open
+
+    def tracking_open(path, *args, **kwargs):
+        file = real_open(path, *args, **kwargs)
+        if path == reports[0]:
+            read = file.read
+            file = TrackingFile(file, lambda size=-1: reads.append(size) or read(size))
+        return file
+
+    monkeypatch.setattr(mail, "open", tracking_open, raising=False)
+    assert mail.deliver_reports(reports, smtp_config(sink), retries=0) == []
+    assert attachments(sink.messages[0]) == [(os.path.basename(reports[0]), content)]
+    # The attachment was read in bounded chunks, never as a whole.
+    assert reads and all(0 < size <= mail.ENCODE_CHUNK_SIZE for size in reads)
+
+
+class TrackingFile:
+    def __init__(self, file, read):
+        self._file = file
+        self.read = read
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._file.close()
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+def test_gzip_attachment_round_trip(tmp_path, sink, monkeypatch):
+    reports = make_reports(str(tmp_path), 1, size=2 * mail.ENCODE_CHUNK_SIZE)
+    content = open(reports[0], 'rb').read()
+    opened = []
+    real_open = open
+
+    def tracking_open(path, *args, **kwargs):
+        opened.append(path)
+        return real_open(path, *args, **kwargs)
+
+    monkeypatch.setattr(mail, "open", tracking_open, raising=False)
+    config = smtp_config(sink, attachment_compression="gzip")
+    assert mail.deliver_reports(reports, config, retries=0) == []
+    part = [part for part in sink.messages[0].walk() if part.get_filename()][0]
+    assert part.get_filename() == os.path.basename(reports[0]) + ".gz"
+    assert part.get_content_type() == "application/gzip"
+    assert gzip.decompress(part.get_payload(decode=True)) == content
+    # The encoder read the compressed file back from disk, not a copy held in memory.
+    assert any(path.endswith(".pdf.gz") for path in opened)
+
+
+def test_zip_attachment_round_trip(tmp_path, sink):
+    reports = make_reports(str(tmp_path), 2)
+    contents = {os.path.basename(path): open(path, 'rb').read() for path in reports}
+    config = smtp_config(sink, attachment_compression="zip")
+    assert mail.deliver_reports(reports, config, digest=True, retries=0) == []
+    (filename, payload), = attachments(sink.messages[0])
+    assert filename.endswith(".zip")
+    with zipfile.ZipFile(io.BytesIO(payload)) as archive:
+        assert {name: archive.read(name) for name in archive.namelist()} == contents
+
+
+def test_spooled_message_is_sent_in_chunks(tmp_path):
+    reports = make_reports(str(tmp_path), 1, size=4 * mail.SEND_CHUNK_SIZE)
+
+    class Server:
+        sent = []
+
+        def ehlo_or_helo_if_needed(self):
+            pass
+
+        def mail(self, address):
+            return 250, b"OK"
+
+        def rcpt(self, address):
+            return 250, b"OK"
+
+        def docmd(self, command):
+            return 354, b"Go ahead"
+
+        def send(self, data):
+            self.sent.append(data)
+
+        def getreply(self):
+            return 250, b"Accepted"
+
+    with open(str(tmp_path / "spool"), 'w+b') as spool:
+        mail.write_message(spool, "a@localhost", "b@localhost", "Report", "Body", reports)
+        size = spool.tell()
+        server = Server()
+        mail.send_spooled(server, "a@localhost", "b@localhost", spool)
+    assert len(server.sent) > 4
+    assert all(len(chunk) <= mail.SEND_CHUNK_SIZE for chunk in server.sent)
+    assert sum(len(chunk) for chunk in server.sent[:-1]) == size
@@ -0,0 +1,65 @@
+import urllib.request
+
+from metrics import MetricsRegistry, MetricsServer
+
+
+def test_counter_and_gauge_text_format():
+    registry = MetricsRegistry()
+    counter = registry.counter("test_total", "Things counted.", ("mode",))
+    counter.labels(mode='say "hi"\n').inc()
+    counter.labels(mode="plain").inc(2.5)
+    registry.gauge("test_depth", "Queue depth.", function=lambda: 3)
+
+    assert registry.render() == (
+        "# HELP test_total Things counted.\n"
+        "# TYPE test_total counter\n"
+        'test_total{mode="say \\"hi\\"\\n"} 1\n'
+        'test_total{mode="plain"} 2.5\n'
+        "# HELP test_depth Queue depth.\n"
+        "# TYPE test_depth gauge\n"
+        "test_depth 3\n"
+    )
+
+
+def test_registering_a_name_twice_returns_the_first_metric():
+    registry = MetricsRegistry()
+    first = registry.counter("test_total", "Things counted.")
+
+    assert registry.counter("test_total", "Things counted again.") is first
+
+
+def test_failing_function_is_left_out():
+    registry = MetricsRegistry()
+    registry.gauge("test_broken", "Always fails.", function=lambda: 1 / 0)
+
+    assert registry.render() == "# HELP test_broken Always fails.\n# TYPE test_broken gauge\n"
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("test_seconds", "Durations.", buckets=(1, 0.1))
+    for value in (0.05, 0.1, 0.5, 2):
+        histogram.observe(value)
+
+    lines = registry.render().splitlines()[2:]
+    assert lines == [
+        'test_seconds_bucket{le="0.1"} 2',
+        'test_seconds_bucket{le="1"} 3',
+        'test_seconds_bucket{le="+Inf"} 4',
+        "test_seconds_sum 2.65",
+        "test_seconds_count 4",
+    ]
+
+
+def test_server_serves_the_registry():
+    registry = MetricsRegistry()
+    registry.counter("test_total", "Things counted.").inc()
+    server = MetricsServer(port=0, registry=registry).start()
+    try:
+        url = "http://127.0.0.1:%d/metrics" % server.server_address[1]
+        with urllib.request.urlopen(url, timeout=5) as response:
+            body = response.read().decode('utf-8')
+    finally:
+        server.stop()
+
+    assert body == registry.render()
@@ -0,0 +1,36 @@
+from proc_events import (
+    CN_MSG_HEADER, FORK_EVENT, NLMSG_DONE, NLMSG_HEADER, PID_TGID, PROC_EVENT_EXEC, PROC_EVENT_EXIT,
+    PROC_EVENT_FORK, PROC_EVENT_HEADER, parse_events,
+)
+
+
+def message(what, body):
+    event = PROC_EVENT_HEADER.pack(what, 0, 0) + body
+    payload = CN_MSG_HEADER.pack(1, 1, 0, 0, len(event), 0) + event
+    data = NLMSG_HEADER.pack(NLMSG_HEADER.size + len(payload), NLMSG_DONE, 0, 0, 0) + payload
+    return data + b'\0' * (-len(data) % 4)
+
+
+def fork(child_pid, child_tgid):
+    return message(PROC_EVENT_FORK, FORK_EVENT.pack(1, 1, child_pid, child_tgid))
+
+
+def test_parses_each_event_of_a_datagram():
+    data = fork(100, 100) + message(PROC_EVENT_EXEC, PID_TGID.pack(100, 100)) + \
+        message(PROC_EVENT_EXIT, PID_TGID.pack(100, 100) + b'\0' * 8)
+
+    assert list(parse_events(data)) == [
+        (PROC_EVENT_FORK, 100), (PROC_EVENT_EXEC, 100), (PROC_EVENT_EXIT, 100)
+    ]
+
+
+def test_skips_threads_and_other_events():
+    data = fork(101, 100) + message(PROC_EVENT_EXIT, PID_TGID.pack(102, 100)) + \
+        message(0x00000004, PID_TGID.pack(100, 100)) + fork(103, 103)
+
+    assert list(parse_events(data)) == [(PROC_EVENT_FORK, 103)]
+
+
+def test_stops_at_a_truncated_or_malformed_message():
+    assert list(parse_events(fork(100, 100)[:NLMSG_HEADER.size - 1])) == []
+    assert list(parse_events(NLMSG_HEADER.pack(0, NLMSG_DONE, 0, 0, 0) + fork(100, 100))) == []
@@ -0,0 +1,109 @@
+import time
+import argparse
+from datetime import datetime, timezone
+
+import pytest
+
+import query
+
+LOG = """2026-03-29 00:10:00,000 - INFO - Computer Name: host-1
+2026-03-29 00:10:00,000 - INFO - Process: /usr/bin/a
+2026-03-29 01:30:00,000 - INFO - Process: /usr/bin/a
+2026-03-29 03:30:00,000 - INFO - Process: /usr/bin/a
+2026-03-29 03:40:00,000 - INFO - File Operation: /usr/bin/b | read=100 write=20 reads=1 writes=1
+2026-03-29 23:30:00,000 - INFO - Process: /usr/bin/b
+"""
+
+
+@pytest.fixture
+def local_time(monkeypatch):
+    def set_zone(zone):
+        monkeypatch.setenv("TZ", zone)
+        time.tzset()
+        query._utc_offset.cache_clear()
+
+    yield set_zone
+    monkeypatch.undo()
+    time.tzset()
+    query._utc_offset.cache_clear()
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc).timestamp()
+
+
+def test_hour_start_in_a_half_hour_zone(local_time):
+    local_time("Asia/Kolkata")
+    # 10:45 local time is 05:15 UTC; the local hour started at 04:30 UTC.
+    assert query.hour_start(utc(2026, 1, 1, 5, 15)) == utc(2026, 1, 1, 4, 30)
+
+
+def test_hour_start_across_dst_changes(local_time):
+    local_time("Europe/Berlin")
+    # 01:30 CET and 03:30 CEST, either side of the spring change.
+    assert query.hour_start(utc(2026, 3, 29, 0, 30)) == utc(2026, 3, 29, 0)
+    assert query.hour_start(utc(2026, 3, 29, 1, 30)) == utc(2026, 3, 29, 1)
+    # 02:30 CEST and 02:30 CET are different hours in the autumn.
+    assert query.hour_start(utc(2026, 10, 25, 0, 30)) == utc(2026, 10, 25, 0)
+    assert query.hour_start(utc(2026, 10, 25, 1, 30)) == utc(2026, 10, 25, 1)
+    assert query.day_start(utc(2026, 3, 29, 21, 30)) == utc(2026, 3, 28, 23)
+
+
+def write_log(logs_dir, text, name="system_monitor_29-03-2026_00-00.txt"):
+    day_dir = logs_dir / "29-03-2026"
+    day_dir.mkdir(exist_ok=True)
+    path = day_dir / name
+    with open(path, 'a', encoding='utf-8', newline='') as file:
+        file.write(text)
+    return path
+
+
+def test_index_is_updated_incrementally(tmp_path, local_time):
+    local_time("Europe/Berlin")
+    write_log(tmp_path, LOG + "2026-03-29 23:40:00,000 - INFO - Proc")
+    conn = query.open_index(str(tmp_path))
+    try:
+        query.update_index(conn, str(tmp_path))
+        assert [(row["exe"], row["count"]) for row in query.query_top(conn)] == [("/usr/bin/a", 3), ("/usr/bin/b", 1)]
+
+        # The partly written line is read once it is complete.
+        write_log(tmp_path, "ess: /usr/bin/b\n")
+        query.update_index(conn, str(tmp_path))
+        assert query.update_index(conn, str(tmp_path)) == 0
+        top = query.query_top(conn, limit=1)
+        assert [(row["exe"], row["count"]) for row in top] == [("/usr/bin/a", 3)]
+
+        [exe] = query.query_exe(conn, "/usr/bin/b")
+        assert (exe["hosts"], exe["processes"], exe["file_operations"]) == (1, 2, 1)
+        assert (exe["read_bytes"], exe["write_bytes"]) == (100, 20)
+        assert exe["first"] == "2026-03-29 03:40:00"
+    finally:
+        conn.close()
+
+
+def test_timeline_buckets_follow_local_time(tmp_path, local_time):
+    local_time("Europe/Berlin")
+    write_log(tmp_path, LOG)
+    conn = query.open_index(str(tmp_path))
+    try:
+        query.update_index(conn, str(tmp_path))
+        hours = query.query_timeline(conn, "bin/a")
+        days = query.query_timeline(conn, "bin/a", bucket="day")
+        since = query.query_timeline(conn, "bin/a", since=query.parse_time("2026-03-29 03:15"))
+    finally:
+        conn.close()
+
+    assert [(row["period"], row["count"]) for row in hours] == [
+        ("2026-03-29 00:00:00", 1), ("2026-03-29 01:00:00", 1), ("2026-03-29 03:00:00", 1)
+    ]
+    assert [(row["period"], row["count"]) for row in days] == [("2026-03-29 00:00:00", 3)]
+    # Ranges are widened to whole hours.
+    assert [row["period"] for row in since] == ["2026-03-29 03:00:00"]
+
+
+def test_parse_time():
+    now = datetime(2026, 10, 18, 12, 0)
+    assert query.parse_time("2h", now) == datetime(2026, 10, 18, 10, 0).timestamp()
+    assert query.parse_time("18-10-2026") == datetime(2026, 10, 18).timestamp()
+    with pytest.raises(argparse.ArgumentTypeError):
+        query.parse_time("yesterday")
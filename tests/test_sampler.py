@@ -0,0 +1,20 @@
+from sampler import AdaptiveInterval
+
+
+def test_quiet_machine_stays_at_ceiling():
+    adaptive = AdaptiveInterval(floor=5, ceiling=60)
+    for _ in range(5):
+        interval = adaptive.update(churn=0, elapsed=60, tick_cpu=0.001)
+    assert interval == 60
+
+
+def test_churn_shrinks_interval_towards_floor():
+    adaptive = AdaptiveInterval(floor=5, ceiling=60, target_churn=10)
+    intervals = [adaptive.update(churn=1000, elapsed=60, tick_cpu=0.001) for _ in range(10)]
+    assert intervals == sorted(intervals, reverse=True)
+    assert 5 <= intervals[-1] < 6
+
+
+def test_cpu_budget_takes_precedence_over_ceiling():
+    adaptive = AdaptiveInterval(floor=5, ceiling=60, cpu_budget=0.01)
+    assert adaptive.update(churn=1000, elapsed=60, tick_cpu=1.0) == 100
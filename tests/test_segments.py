@@ -0,0 +1,54 @@
+import os
+
+from segments import SegmentManifest, ACTIVE, PENDING, CONVERTED, MAILED
+
+
+def test_segment_moves_through_statuses(tmp_path):
+    logs_dir = str(tmp_path)
+    text = os.path.join(logs_dir, "01-01-2026", "system_monitor_01-01-2026_10-00.txt")
+    manifest = SegmentManifest(logs_dir)
+    with manifest.edit():
+        manifest.add(text, start=1)
+    assert manifest.files(ACTIVE) == [text]
+
+    with manifest.edit():
+        manifest.update(text, PENDING, end=2)
+    reloaded = SegmentManifest(logs_dir)
+    assert reloaded.files(PENDING) == [text]
+    assert reloaded.get(text)["end"] == 2
+    assert reloaded.get("system_monitor_01-01-2026_10-00")["status"] == PENDING
+
+    pdf = os.path.splitext(text)[0] + ".pdf"
+    with reloaded.edit():
+        reloaded.update(text, CONVERTED, pdf=pdf)
+    assert SegmentManifest(logs_dir).files(CONVERTED, "pdf") == [pdf]
+
+
+def test_edit_keeps_changes_of_other_instances(tmp_path):
+    first = SegmentManifest(str(tmp_path))
+    second = SegmentManifest(str(tmp_path))
+    with first.edit():
+        first.add(str(tmp_path / "a.txt"), start=1)
+    with second.edit():
+        second.add(str(tmp_path / "b.txt"), start=2)
+    assert [entry["name"] for entry in SegmentManifest(str(tmp_path)).with_status(ACTIVE)] == ["a", "b"]
+
+
+def test_oldest_mailed_segments_are_dropped(tmp_path):
+    manifest = SegmentManifest(str(tmp_path), keep_mailed=2)
+    with manifest.edit():
+        for index in range(3):
+            manifest.add(str(tmp_path / f"{index}.txt"), start=index, status=MAILED)
+    assert [entry["name"] for entry in SegmentManifest(str(tmp_path)).with_status(MAILED)] == ["1", "2"]
+
+
+def test_new_path_skips_names_in_use(tmp_path):
+    manifest = SegmentManifest(str(tmp_path))
+    path = str(tmp_path / "system_monitor_01-01-2026_10-00.txt")
+    assert manifest.new_path(path) == path
+    with manifest.edit():
+        manifest.add(path)
+    second = manifest.new_path(path)
+    assert second == str(tmp_path / "system_monitor_01-01-2026_10-00_1.txt")
+    open(os.path.splitext(second)[0] + ".samples", 'wb').close()
+    assert manifest.new_path(path) == str(tmp_path / "system_monitor_01-01-2026_10-00_2.txt")
@@ -0,0 +1,89 @@
+import os
+import logging
+
+from iostats import IOUsage, format_io_usage
+from store import (SampleStore, SampleStoreHandler, read_samples, truncate_partial, write_text_view,
+                   strings_path, io_path, RECORD, PROCESS, EXIT, FILE_OPERATION, IO_USAGE)
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "a.samples")
+    store = SampleStore(path)
+    store.append(1.0, 10, "/usr/bin/a", PROCESS)
+    store.append(2.0, 11, None, EXIT)
+    store.append(3.0, 12, "", PROCESS)
+    store.append(4.0, 13, "/usr/bin/a", PROCESS)
+    store.close()
+    assert list(read_samples(path)) == [
+        (1.0, 10, "/usr/bin/a", PROCESS), (2.0, 11, None, EXIT), (3.0, 12, "", PROCESS), (4.0, 13, "/usr/bin/a", PROCESS)
+    ]
+    assert list(read_samples(path, start=2.0, end=4.0, kinds={PROCESS})) == [(3.0, 12, "", PROCESS)]
+
+
+def test_reopened_store_keeps_string_ids(tmp_path):
+    path = str(tmp_path / "a.samples")
+    store = SampleStore(path)
+    store.append(1.0, 10, "/usr/bin/a", PROCESS)
+    store.close()
+    store = SampleStore(path)
+    store.append(2.0, 11, "/usr/bin/a", PROCESS)
+    store.close()
+    assert os.path.getsize(strings_path(path)) == len("/usr/bin/a") + 2
+    assert [exe for _, _, exe, _ in read_samples(path)] == ["/usr/bin/a", "/usr/bin/a"]
+
+
+def test_truncate_partial(tmp_path):
+    path = str(tmp_path / "a.samples")
+    store = SampleStore(path)
+    store.append(1.0, 10, "/usr/bin/a", PROCESS)
+    store.close()
+    with open(path, 'ab') as file:
+        file.write(b"\x01\x02\x03")
+    with open(strings_path(path), 'ab') as file:
+        file.write(b"\x10\x00/usr/b")  # A string cut short
+    truncate_partial(path)
+    assert os.path.getsize(path) == RECORD.size
+    store = SampleStore(path)
+    store.append(2.0, 11, "/usr/bin/b", PROCESS)
+    store.close()
+    assert [exe for _, _, exe, _ in read_samples(path)] == ["/usr/bin/a", "/usr/bin/b"]
+
+
+def test_handler_keeps_io_counters_out_of_the_string_table(tmp_path):
+    path = str(tmp_path / "a.samples")
+    store = SampleStore(path)
+    log = logging.Logger("test-store")
+    log.addHandler(SampleStoreHandler(store))
+    lines = []
+    for index in range(100):
+        usage = IOUsage(42, "/usr/bin/a", index * 4096, index, index, index, 7, ["/tmp/x", "/tmp/y"])
+        log.info("File Operation: %s", format_io_usage(usage), extra={"io_usage": usage})
+        lines.append("File Operation: " + format_io_usage(usage))
+    log.info("Process: %s", "/usr/bin/a")
+    store.close()
+
+    # Only the executable and the open files are interned.
+    assert os.path.getsize(strings_path(path)) < 100
+    assert os.path.getsize(io_path(path)) > 0
+    samples = list(read_samples(path))
+    assert [kind for _, _, _, kind in samples] == [IO_USAGE] * 100 + [PROCESS]
+    assert samples[0][1] == 42
+
+    txt_path = str(tmp_path / "a.txt")
+    write_text_view(path, txt_path)
+    with open(txt_path, encoding='utf-8') as file:
+        rendered = [line.split(" - INFO - ", 1)[1].rstrip("\n") for line in file]
+    assert rendered == lines + ["Process: /usr/bin/a"]
+
+
+def test_handler_stores_plain_lines_as_text(tmp_path):
+    path = str(tmp_path / "a.samples")
+    store = SampleStore(path)
+    log = logging.Logger("test-store")
+    log.addHandler(SampleStoreHandler(store))
+    log.info("File Operation: %s", "/usr/bin/a | read=1 write=2 reads=3 writes=4")
+    log.info("Not a sample line")
+    store.close()
+    assert [(exe, kind) for _, _, exe, kind in read_samples(path)] == [
+        ("/usr/bin/a | read=1 write=2 reads=3 writes=4", FILE_OPERATION)
+    ]
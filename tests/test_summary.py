@@ -0,0 +1,58 @@
+import summary
+from store import PROCESS, EXIT, COMPUTER_NAME, PROCESS_CHECK, FILE_OPERATION
+
+LOG = """2026-01-01 10:00:00,000 - INFO - Computer Name: host-1
+2026-01-01 10:00:00,000 - INFO - System Startup: 01-01-2026
+2026-01-01 10:00:01,000 - INFO - Process Check: 01-01-2026_10-00
+2026-01-01 10:00:01,000 - INFO - Process: /usr/bin/a
+2026-01-01 10:00:02,000 - INFO - Process: /usr/bin/b
+2026-01-01 10:05:00,000 - INFO - Process: /usr/bin/a
+2026-01-01 10:06:00,000 - INFO - File Operation: /usr/bin/a | read=100 write=20 reads=1 writes=1
+2026-01-01 10:07:00,000 - INFO - File Operation: /usr/bin/a | read=5 write=0 reads=1 writes=0
+2026-01-01 10:08:00,000 - INFO - Process Exit: /usr/bin/b
+not a log line
+"""
+
+
+def test_summarize_log(tmp_path):
+    path = tmp_path / "log.txt"
+    path.write_text(LOG, encoding='utf-8')
+    result = summary.summarize_log(str(path))
+    assert result["computer_name"] == "host-1"
+    assert result["system_startup"] == "01-01-2026"
+    assert result["start"] == "2026-01-01 10:00:00,000"
+    assert result["end"] == "2026-01-01 10:08:00,000"
+    assert result["checks"] == 1
+    assert result["lines"] == 10
+    assert result["processes"]["/usr/bin/a"] == [2, "2026-01-01 10:00:01,000", "2026-01-01 10:05:00,000"]
+    assert result["file_operations"]["/usr/bin/a"][0] == 2
+    assert result["io"] == {"/usr/bin/a": [105, 20]}
+    assert result["exits"] == {"/usr/bin/b": [1, "2026-01-01 10:08:00,000", "2026-01-01 10:08:00,000"]}
+
+
+def test_top_executables_orders_by_count_then_name():
+    stats = {"/b": [2, "t1", "t2"], "/a": [2, "t1", "t2"], "/c": [5, "t1", "t2"]}
+    assert [row[0] for row in summary.top_executables(stats)] == ["/c", "/a", "/b"]
+    assert [row[0] for row in summary.top_executables(stats, 1)] == ["/c"]
+
+
+def test_top_io_orders_by_total():
+    io = {"/a": [10, 0], "/b": [5, 20]}
+    assert summary.top_io(io) == [("/b", 5, 20), ("/a", 10, 0)]
+
+
+def test_summarize_samples_matches_the_log_sections():
+    samples = [
+        (1767261600.0, 0, "host-1", COMPUTER_NAME),
+        (1767261601.0, 0, "01-01-2026_10-00", PROCESS_CHECK),
+        (1767261601.0, 10, "/usr/bin/a", PROCESS),
+        (1767261660.0, 0, "/usr/bin/a | read=100 write=20 reads=1 writes=1", FILE_OPERATION),
+        (1767261680.0, 10, "/usr/bin/a", EXIT),
+    ]
+    result = summary.summarize_samples(samples)
+    assert result["computer_name"] == "host-1"
+    assert result["checks"] == 1
+    assert result["processes"]["/usr/bin/a"][0] == 1
+    assert result["file_operations"]["/usr/bin/a"][0] == 1
+    assert result["io"] == {"/usr/bin/a": [100, 20]}
+    assert result["exits"]["/usr/bin/a"][0] == 1
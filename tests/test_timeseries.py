@@ -0,0 +1,143 @@
+import time
+from collections import namedtuple
+from contextlib import nullcontext
+from datetime import datetime, timezone
+
+import pytest
+
+import query
+
+np = pytest.importorskip("numpy")  # An optional extra, see req.py
+import timeseries  # noqa: E402
+from sampler import Snapshot
+
+CpuTimes = namedtuple('CpuTimes', ['user', 'system'])
+MemoryInfo = namedtuple('MemoryInfo', ['rss'])
+
+
+@pytest.fixture
+def berlin(monkeypatch):
+    monkeypatch.setenv("TZ", "Europe/Berlin")
+    time.tzset()
+    query._utc_offset.cache_clear()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+    query._utc_offset.cache_clear()
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc).timestamp()
+
+
+def raw_samples(rows):
+    return np.array(rows, dtype=timeseries.RAW_DTYPE)
+
+
+def test_rollup_adds_up_processes_per_tick():
+    raw = raw_samples([
+        (60.0, 0, 1, 1.0, 10.0, 100), (60.0, 0, 2, 2.0, 20.0, 200), (60.0, 1, 3, 0.5, 5.0, 50),
+        (70.0, 0, 1, 3.0, 30.0, 150),
+    ])
+    result = timeseries.rollup(raw, 60)
+
+    assert list(result['exe']) == [0, 1]
+    assert list(result['samples']) == [2, 1]
+    assert list(result['cpu_seconds']) == [6.0, 0.5]
+    assert list(result['cpu_max']) == [30.0, 5.0]
+    assert list(result['rss_max']) == [300, 50]
+    assert list(result['rss_p95']) == [300, 50]
+
+
+def test_periods_follow_local_time_across_dst(berlin):
+    # 01:30 CET and 03:30 CEST on the day clocks go forward, and 02:30 CEST
+    # and 02:30 CET on the day they go back.
+    times = np.array([utc(2026, 3, 29, 0, 30), utc(2026, 3, 29, 1, 30),
+                      utc(2026, 10, 25, 0, 30), utc(2026, 10, 25, 1, 30)])
+    assert list(timeseries.period_starts(times, 3600)) == [
+        utc(2026, 3, 29, 0), utc(2026, 3, 29, 1), utc(2026, 10, 25, 0), utc(2026, 10, 25, 1)
+    ]
+    assert list(timeseries.period_starts(times, 86400)) == [
+        utc(2026, 3, 28, 23), utc(2026, 3, 28, 23), utc(2026, 10, 24, 22), utc(2026, 10, 24, 22)
+    ]
+    assert [query.hour_start(epoch) for epoch in times] == list(timeseries.period_starts(times, 3600))
+
+
+def test_merged_rollups_keep_sums_and_maxima(berlin):
+    raw = raw_samples([
+        (utc(2026, 3, 29, 0, 30), 0, 1, 1.0, 10.0, 100),
+        (utc(2026, 3, 29, 1, 30), 0, 1, 2.0, 20.0, 300),
+        (utc(2026, 3, 29, 1, 45), 0, 1, 4.0, 5.0, 200),
+    ])
+    minute = timeseries.rollup(raw, 60)
+    hour = timeseries.merge_rollups(minute, 3600)
+    day = timeseries.merge_rollups(hour, 86400)
+
+    assert list(hour['start']) == [utc(2026, 3, 29, 0), utc(2026, 3, 29, 1)]
+    assert list(hour['cpu_seconds']) == [1.0, 6.0]
+    assert list(day['start']) == [utc(2026, 3, 28, 23)]
+    assert (day['samples'][0], day['cpu_seconds'][0], day['cpu_max'][0], day['rss_max'][0]) == (3, 7.0, 20.0, 300)
+
+
+def test_downsample_drops_raw_then_minute_rollups(tmp_path):
+    day_dir = tmp_path / "18-10-2026"
+    day_dir.mkdir()
+    path = str(day_dir / ("segment" + timeseries.FILE_SUFFIX))
+    now = 1_000_000.0
+    timeseries.save_series(path, np.array(["/a"]), raw_samples([(now - 2 * 86400, 0, 1, 1.0, 1.0, 1)]))
+
+    assert timeseries.downsample(str(tmp_path), raw_days=1, minute_days=7, now=now) == 1
+    assert set(timeseries.load_series(path)) == {"exes", "minute", "hour", "day"}
+    assert timeseries.downsample(str(tmp_path), raw_days=1, minute_days=7, now=now) == 0
+    assert timeseries.downsample(str(tmp_path), raw_days=1, minute_days=1, now=now) == 1
+    assert set(timeseries.load_series(path)) == {"exes", "hour", "day"}
+
+
+class FakeProcess:
+    def __init__(self, pid):
+        self.pid = pid
+        self.cpu = 0.0
+
+    def oneshot(self):
+        return nullcontext()
+
+    def cpu_times(self):
+        return CpuTimes(self.cpu, 0.0)
+
+    def memory_info(self):
+        return MemoryInfo(1000)
+
+
+def tick(sampler, when, procs):
+    infos = [{'pid': proc.pid, 'exe': f"/bin/{proc.pid}"} for proc in procs]
+    sampler(Snapshot(when, infos, [], [], {proc.pid: proc for proc in procs}))
+
+
+def test_spooled_samples_leave_memory_and_are_saved(tmp_path):
+    segment = str(tmp_path / "segment.txt")
+    procs = [FakeProcess(1), FakeProcess(2)]
+    sampler = timeseries.ResourceSampler()
+    for second in range(3):
+        for proc in procs:
+            proc.cpu += 0.5
+        tick(sampler, 60.0 + second, procs)
+    exes = sampler.spool(segment)
+
+    assert sampler._chunks == []
+    assert exes == ["/bin/1", "/bin/2"]
+
+    # A restarted sampler continues the spool, past a partly written record.
+    with open(timeseries.spool_path(segment), 'ab') as file:
+        file.write(b"\0" * 5)
+    resumed = timeseries.ResourceSampler()
+    resumed.resume(segment, exes)
+    procs[0].cpu += 1.0
+    tick(resumed, 63.0, procs)
+    path = resumed.save(segment)
+
+    series = timeseries.load_series(path)
+    assert len(series["raw"]) == 8
+    assert list(series["exes"]) == ["/bin/1", "/bin/2"]
+    # The first sighting after the restart only sets the baseline again.
+    assert series["minute"]['cpu_seconds'].sum() == pytest.approx(2.0)
+    assert not (tmp_path / "segment.resources.spool").exists()
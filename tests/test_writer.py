@@ -0,0 +1,66 @@
+import logging
+import threading
+
+from writer import AsyncLogWriter
+
+
+def make_logger(name, writer):
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.handlers = [writer.handler]
+    return logger
+
+
+def read_messages(path):
+    with open(path, encoding='utf-8') as file:
+        return [line.rstrip('\n').split(' - ', 2)[2] for line in file]
+
+
+def test_records_are_written_in_order(tmp_path):
+    path = tmp_path / "log.txt"
+    writer = AsyncLogWriter(str(path), batch_size=7).start()
+    logger = make_logger("test-writer-order", writer)
+    for index in range(1000):
+        logger.info("line %d", index)
+    writer.stop()
+
+    assert read_messages(path) == [f"line {index}" for index in range(1000)]
+    assert writer.written == 1000
+    assert writer.dropped == 0
+
+
+def test_stop_drains_the_queue(tmp_path):
+    path = tmp_path / "log.txt"
+    writer = AsyncLogWriter(str(path), flush_interval=60).start()
+    release = threading.Event()
+    format_record = writer._format
+
+    def slow_format(record):
+        release.wait()
+        return format_record(record)
+
+    writer._format = slow_format
+    logger = make_logger("test-writer-drain", writer)
+    for index in range(100):
+        logger.info("line %d", index)
+    assert writer.depth > 0
+
+    release.set()
+    writer.stop()
+
+    assert read_messages(path) == [f"line {index}" for index in range(100)]
+    assert writer.depth == 0
+
+
+def test_full_queue_drops_and_counts(tmp_path):
+    path = tmp_path / "log.txt"
+    writer = AsyncLogWriter(str(path), max_queue=10)
+    logger = make_logger("test-writer-full", writer)
+    for index in range(15):
+        logger.info("line %d", index)
+    writer.start()
+    writer.stop()
+
+    assert writer.dropped == 5
+    assert read_messages(path) == [f"line {index}" for index in range(10)]
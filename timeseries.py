@@ -0,0 +1,455 @@
+"""
+Module for per-process CPU and memory time series kept in NumPy arrays.
+
+Every tick the CPU time and resident memory of each process are sampled into
+columnar arrays. When a segment is closed they are saved with minute, hour
+and day rollups per executable (CPU seconds, max and p95 CPU and RSS), all
+computed in vectorized batches. Raw samples and minute rollups are dropped
+from older files, so long histories only keep their coarser rollups:
+
+    python timeseries.py top --days 7 --by rss_max -n 10
+    python timeseries.py downsample
+"""
+
+import os
+import re
+import sys
+import glob
+import time
+import argparse
+from datetime import datetime
+import numpy as np
+import psutil
+from query import OFFSET_STEP, utc_offset
+
+# One sample of one process. cpu_seconds is the CPU time used since the
+# previous tick and cpu_percent the same as a percentage of one CPU.
+RAW_DTYPE = np.dtype([
+    ('time', 'f8'), ('exe', 'i4'), ('pid', 'i4'),
+    ('cpu_seconds', 'f4'), ('cpu_percent', 'f4'), ('rss', 'i8'),
+])
+# One executable over one period. CPU and RSS maxima and percentiles are over
+# the ticks in the period, with all processes of the executable added up.
+ROLLUP_DTYPE = np.dtype([
+    ('start', 'f8'), ('exe', 'i4'), ('samples', 'i4'), ('cpu_seconds', 'f8'),
+    ('cpu_max', 'f4'), ('cpu_p95', 'f4'), ('rss_max', 'i8'), ('rss_p95', 'i8'),
+])
+PERIODS = {"minute": 60, "hour": 3600, "day": 86400}
+PERCENTILE = 0.95
+FILE_SUFFIX = ".resources.npz"
+SPOOL_SUFFIX = ".resources.spool"
+
+
+def series_path(segment_path):
+    """
+    Returns the path of the resource series belonging to a segment.
+    """
+    return os.path.splitext(segment_path)[0] + FILE_SUFFIX
+
+
+def spool_path(segment_path):
+    """
+    Returns the path of the spool that holds the raw samples of a segment until it is closed.
+    """
+    return os.path.splitext(segment_path)[0] + SPOOL_SUFFIX
+
+
+def load_spool(segment_path):
+    """
+    Returns the raw samples spooled for a segment, ignoring a partial last record.
+    """
+    try:
+        with open(spool_path(segment_path), 'rb') as file:
+            data = file.read()
+    except FileNotFoundError:
+        return np.zeros(0, dtype=RAW_DTYPE)
+    return np.frombuffer(data, dtype=RAW_DTYPE, count=len(data) // RAW_DTYPE.itemsize).copy()
+
+
+def save_spool(segment_path, exes):
+    """
+    Saves the series of a segment closed by an earlier run from its spool and
+    removes the spool. Returns the path, or None if nothing was spooled.
+    """
+    raw = load_spool(segment_path)
+    path = save_series(series_path(segment_path), np.array(exes, dtype=str), raw) if len(raw) else None
+    if os.path.exists(spool_path(segment_path)):
+        os.remove(spool_path(segment_path))
+    return path
+
+
+def _group(keys):
+    """
+    Returns (unique keys, group index of each element, group sizes) for an array of keys.
+    """
+    unique, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    return unique, inverse.reshape(-1), counts
+
+
+def group_max(inverse, values, groups):
+    """
+    Returns the maximum of the values in each group.
+    """
+    result = np.full(groups, np.iinfo(values.dtype).min if values.dtype.kind == 'i' else -np.inf,
+                     dtype=values.dtype)
+    np.maximum.at(result, inverse, values)
+    return result
+
+
+def group_percentile(inverse, values, counts, fraction=PERCENTILE):
+    """
+    Returns the nearest-rank percentile of the values in each group.
+    """
+    order = np.lexsort((values, inverse))
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    ranks = np.maximum(np.ceil(counts * fraction).astype(np.int64) - 1, 0)
+    return values[order][starts + ranks]
+
+
+def per_tick(raw):
+    """
+    Adds up the samples of all processes of an executable in each tick and
+    returns them as a raw array with pid 0.
+    """
+    if not len(raw):
+        return raw
+    times = raw['time']
+    if np.all(times[1:] >= times[:-1]):
+        # Samples are appended tick by tick, so ticks can be numbered in one pass.
+        tick = np.concatenate(([0], np.cumsum(times[1:] != times[:-1])))
+    else:
+        _, tick = np.unique(times, return_inverse=True)
+    exe_count = int(raw['exe'].max()) + 1
+    unique, inverse, _ = _group(tick.astype(np.int64) * exe_count + raw['exe'])
+    first = np.zeros(len(unique), dtype=np.int64)
+    first[inverse[::-1]] = np.arange(len(inverse))[::-1]
+    ticks = np.zeros(len(unique), dtype=RAW_DTYPE)
+    ticks['time'] = times[first]
+    ticks['exe'] = (unique % exe_count).astype('i4')
+    for field in ('cpu_seconds', 'cpu_percent', 'rss'):
+        ticks[field] = np.bincount(inverse, weights=raw[field], minlength=len(unique))
+    return ticks
+
+
+def utc_offsets(times):
+    """
+    Returns the local UTC offset in effect at each of an array of epoch times.
+    """
+    steps, inverse = np.unique(np.floor(times / OFFSET_STEP), return_inverse=True)
+    offsets = np.array([utc_offset(step * OFFSET_STEP) for step in steps], dtype='f8')
+    return offsets[inverse.reshape(-1)]
+
+
+def period_starts(times, period):
+    """
+    Returns the epoch time of the start of the local period of the given
+    length each epoch time falls in, like query.hour_start, so periods follow
+    the local clock across DST changes.
+    """
+    local_starts = np.floor((times + utc_offsets(times)) / period) * period
+    # A day may start at another offset than the one its times fall in.
+    return (local_starts - utc_offsets(local_starts - utc_offsets(times))).astype(np.int64)
+
+
+def rollup(raw, period):
+    """
+    Rolls raw samples up per executable into periods of the given length in
+    seconds, aligned to the local day.
+    """
+    if not len(raw):
+        return np.zeros(0, dtype=ROLLUP_DTYPE)
+    ticks = per_tick(raw)
+    exe_count = int(ticks['exe'].max()) + 1
+    unique, inverse, counts = _group(period_starts(ticks['time'], period) * exe_count + ticks['exe'])
+
+    result = np.zeros(len(unique), dtype=ROLLUP_DTYPE)
+    result['start'] = unique // exe_count
+    result['exe'] = (unique % exe_count).astype('i4')
+    result['samples'] = counts
+    result['cpu_seconds'] = np.bincount(inverse, weights=ticks['cpu_seconds'], minlength=len(unique))
+    result['cpu_max'] = group_max(inverse, ticks['cpu_percent'], len(unique))
+    result['cpu_p95'] = group_percentile(inverse, ticks['cpu_percent'], counts)
+    result['rss_max'] = group_max(inverse, ticks['rss'], len(unique))
+    result['rss_p95'] = group_percentile(inverse, ticks['rss'], counts)
+    return result
+
+
+def merge_rollups(rollups, period):
+    """
+    Rolls finer rollups up into coarser periods. Sums and maxima are exact;
+    the p95 of the coarser period is the highest p95 of the periods it covers.
+    """
+    if not len(rollups):
+        return np.zeros(0, dtype=ROLLUP_DTYPE)
+    exe_count = int(rollups['exe'].max()) + 1
+    unique, inverse, _ = _group(period_starts(rollups['start'], period) * exe_count + rollups['exe'])
+    result = np.zeros(len(unique), dtype=ROLLUP_DTYPE)
+    result['start'] = unique // exe_count
+    result['exe'] = (unique % exe_count).astype('i4')
+    result['samples'] = np.bincount(inverse, weights=rollups['samples'], minlength=len(unique))
+    result['cpu_seconds'] = np.bincount(inverse, weights=rollups['cpu_seconds'], minlength=len(unique))
+    for field in ('cpu_max', 'cpu_p95', 'rss_max', 'rss_p95'):
+        result[field] = group_max(inverse, rollups[field], len(unique))
+    return result
+
+
+class ResourceSampler:
+    """
+    Sampler consumer that records the CPU time and resident memory of every
+    live process. Samples are kept as one NumPy array per tick until they are
+    spooled to disk; take() hands them over as a single array together with
+    the executable names. Reading
+    every process each tick costs more than the sampler's churn-based scan,
+    so the daemon only registers it when resource_sampling is enabled.
+    """
+
+    def __init__(self):
+        self._cpu = {}
+        self._exe_ids = {}
+        self.exes = []
+        self._chunks = []
+
+    def _exe_id(self, exe):
+        exe_id = self._exe_ids.get(exe)
+        if exe_id is None:
+            exe_id = self._exe_ids[exe] = len(self.exes)
+            self.exes.append(exe)
+        return exe_id
+
+    def __call__(self, snapshot):
+        """
+        Samples the processes of a snapshot.
+        """
+        for info in snapshot.exited:
+            self._cpu.pop(info['pid'], None)
+        rows = []
+        for info in snapshot.processes:
+            proc = snapshot.handles.get(info['pid'])
+            if proc is None:
+                continue
+            try:
+                with proc.oneshot():
+                    cpu = proc.cpu_times()
+                    rss = proc.memory_info().rss
+            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+                continue
+            total = cpu.user + cpu.system
+            previous = self._cpu.get(info['pid'])
+            self._cpu[info['pid']] = (proc, total, snapshot.time)
+            # psutil compares processes by pid and creation time, so a reused pid starts over.
+            if previous is None or previous[0] != proc:
+                used, percent = 0.0, 0.0  # First sighting only sets the baseline
+            else:
+                used = max(total - previous[1], 0.0)
+                elapsed = snapshot.time - previous[2]
+                percent = used / elapsed * 100 if elapsed > 0 else 0.0
+            rows.append((snapshot.time, self._exe_id(info.get('exe') or ''), info['pid'], used, percent, rss))
+        if rows:
+            self._chunks.append(np.array(rows, dtype=RAW_DTYPE))
+
+    def take(self, segment_path=None):
+        """
+        Returns (executable names, raw samples) collected since the previous
+        call, starting with those spooled for the given segment. The names
+        start over afterwards, as every saved series is self-contained.
+        """
+        chunks = self._chunks
+        if segment_path is not None:
+            chunks = [load_spool(segment_path)] + chunks
+        raw = np.concatenate(chunks) if chunks else np.zeros(0, dtype=RAW_DTYPE)
+        exes = np.array(self.exes, dtype=str)
+        self._chunks = []
+        self.exes = []
+        self._exe_ids = {}
+        return exes, raw
+
+    def spool(self, segment_path):
+        """
+        Appends the samples taken since the previous call to the spool of a
+        segment and returns the executable names they refer to, for a checkpoint.
+        Spooled samples are only kept on disk until the segment is saved.
+        """
+        with open(spool_path(segment_path), 'ab') as file:
+            for chunk in self._chunks:
+                file.write(chunk.tobytes())
+            file.flush()
+            os.fsync(file.fileno())
+        self._chunks = []
+        return list(self.exes)
+
+    def resume(self, segment_path, exes):
+        """
+        Continues the series of a segment from its spool, with the executable
+        names saved in the checkpoint.
+        """
+        self.exes = list(exes)
+        self._exe_ids = {exe: index for index, exe in enumerate(self.exes)}
+        self._chunks = []
+        try:
+            size = os.path.getsize(spool_path(segment_path))
+        except FileNotFoundError:
+            return
+        # Appends continue after whole records.
+        os.truncate(spool_path(segment_path), size - size % RAW_DTYPE.itemsize)
+
+    def save(self, segment_path):
+        """
+        Saves the samples of a segment collected since the previous call, with
+        their rollups, and removes its spool. Returns the path, or None if
+        there was nothing to save.
+        """
+        exes, raw = self.take(segment_path)
+        path = save_series(series_path(segment_path), exes, raw) if len(raw) else None
+        if os.path.exists(spool_path(segment_path)):
+            os.remove(spool_path(segment_path))
+        return path
+
+
+def save_series(path, exes, raw):
+    """
+    Saves raw samples with their minute, hour and day rollups.
+    """
+    minute = rollup(raw, PERIODS["minute"])
+    arrays = {"exes": exes, "raw": raw, "minute": minute}
+    arrays["hour"] = merge_rollups(minute, PERIODS["hour"])
+    arrays["day"] = merge_rollups(arrays["hour"], PERIODS["day"])
+    temp_path = path + ".tmp.npz"
+    np.savez_compressed(temp_path, **arrays)
+    os.replace(temp_path, path)
+    return path
+
+
+def load_series(path):
+    """
+    Loads a saved series as a dict of arrays; raw and minute may be missing once downsampled.
+    """
+    with np.load(path, allow_pickle=False) as data:
+        return {name: data[name] for name in data.files}
+
+
+def downsample(logs_dir, raw_days=1, minute_days=7, now=None):
+    """
+    Drops the raw samples of series older than raw_days and their minute
+    rollups once older than minute_days. Returns the number of files rewritten.
+    """
+    now = now or time.time()
+    rewritten = 0
+    for path in glob.glob(os.path.join(logs_dir, "*", "*" + FILE_SUFFIX)):
+        # Listing the arrays of an npz file does not load them, so fully
+        # downsampled files are skipped cheaply.
+        with np.load(path, allow_pickle=False) as data:
+            if "raw" not in data.files and "minute" not in data.files:
+                continue
+            hours = data["hour"]
+        if not len(hours):
+            continue
+        age_days = (now - float(hours['start'].min())) / 86400
+        drop = [name for name, days in (("raw", raw_days), ("minute", minute_days)) if age_days > days]
+        if not drop:
+            continue
+        series = load_series(path)
+        if any(name in series for name in drop):
+            for name in drop:
+                series.pop(name, None)
+            temp_path = path + ".tmp.npz"
+            np.savez_compressed(temp_path, **series)
+            os.replace(temp_path, path)
+            rewritten += 1
+    return rewritten
+
+
+def top_consumers(paths, period="hour", by="cpu_seconds", limit=10, since=None):
+    """
+    Returns the executables using the most CPU or memory across saved series,
+    as (exe, cpu seconds, max CPU %, p95 CPU %, max RSS, p95 RSS) rows ordered
+    by the given rollup field. Periods starting before since are left out.
+    """
+    names, rollups = [], []
+    for path in paths:
+        series = load_series(path)
+        if period not in series or not len(series[period]):
+            continue
+        rows = series[period]
+        if since is not None:
+            rows = rows[rows['start'] >= since]
+        names.append(series["exes"][rows['exe']])
+        rollups.append(rows)
+    if not rollups:
+        return []
+    names = np.concatenate(names)
+    rollups = np.concatenate(rollups)
+    if not len(rollups):
+        return []
+    unique, inverse, _ = _group(names)
+    totals = {
+        "cpu_seconds": np.bincount(inverse, weights=rollups['cpu_seconds'], minlength=len(unique)),
+    }
+    for field in ('cpu_max', 'cpu_p95', 'rss_max', 'rss_p95'):
+        totals[field] = group_max(inverse, rollups[field], len(unique))
+    order = np.argsort(-totals[by].astype('f8'), kind='stable')[:limit]
+    return [
+        (str(unique[index]), float(totals["cpu_seconds"][index]), float(totals["cpu_max"][index]),
+         float(totals["cpu_p95"][index]), int(totals["rss_max"][index]), int(totals["rss_p95"][index]))
+        for index in order
+    ]
+
+
+def resource_path(relative_path):
+    """
+    Returns the absolute path to a resource file.
+    """
+    try:
+        base_path = sys._MEIPASS
+    except AttributeError:
+        base_path = os.path.abspath(os.path.dirname(__file__))
+    return os.path.join(base_path, relative_path)
+
+
+def recent_series(logs_dir, days):
+    """
+    Returns the saved series of the last given number of days.
+    """
+    since = time.time() - days * 86400
+    paths = []
+    for path in glob.glob(os.path.join(logs_dir, "*", "*" + FILE_SUFFIX)):
+        match = re.search(r'(\d{2}-\d{2}-\d{4}_\d{2}-\d{2})', os.path.basename(path))
+        if match and datetime.strptime(match.group(1), '%d-%m-%Y_%H-%M').timestamp() < since - 86400:
+            continue  # Skip files that cannot overlap the range without loading them
+        paths.append(path)
+    return paths
+
+
+def main(argv=None):
+    """
+    This is the main function of the script.
+    It lists the top resource consumers or downsamples the saved series.
+    """
+    parser = argparse.ArgumentParser(description="Per-process CPU and memory time series.")
+    parser.add_argument("--logs", help="Logs directory (default: Logs next to this script)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    top = commands.add_parser("top", help="executables using the most CPU or memory")
+    top.add_argument("--days", type=float, default=1)
+    top.add_argument("--period", choices=("hour", "day"), default="hour")
+    top.add_argument("--by", choices=("cpu_seconds", "cpu_max", "cpu_p95", "rss_max", "rss_p95"),
+                     default="cpu_seconds")
+    top.add_argument("-n", "--limit", type=int, default=10)
+    downsample_parser = commands.add_parser("downsample", help="drop raw samples and minute rollups of old series")
+    downsample_parser.add_argument("--raw-days", type=float, default=1)
+    downsample_parser.add_argument("--minute-days", type=float, default=7)
+    args = parser.parse_args(argv)
+
+    logs_dir = args.logs or resource_path("Logs")
+    if args.command == "downsample":
+        print(f"Downsampled {downsample(logs_dir, args.raw_days, args.minute_days)} file(s)")
+        return 0
+    since = time.time() - args.days * 86400
+    rows = top_consumers(recent_series(logs_dir, args.days), args.period, args.by, args.limit, since)
+    print(f"{'CPU s':>10}  {'Max CPU%':>8}  {'P95 CPU%':>8}  {'Max RSS':>10}  {'P95 RSS':>10}  Executable")
+    for exe, cpu_seconds, cpu_max, cpu_p95, rss_max, rss_p95 in rows:
+        print(f"{cpu_seconds:>10.1f}  {cpu_max:>8.1f}  {cpu_p95:>8.1f}  "
+              f"{rss_max / 2**20:>8.1f}Mi  {rss_p95 / 2**20:>8.1f}Mi  {exe or '(unknown)'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
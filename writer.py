@@ -0,0 +1,233 @@
+"""
+Module for writing log records to a file from a background thread.
+"""
+
+import os
+import time
+import queue
+import logging
+import threading
+import logging.handlers
+from metrics import REGISTRY
+
+_STOP = object()
+# Writers whose thread is running, for the queue depth gauge.
+_running = set()
+
+QUEUE_DEPTH = REGISTRY.gauge(
+    "track_log_queue_depth", "Records waiting for the log writer thread.",
+    function=lambda: sum(writer.depth for writer in list(_running))
+)
+LOG_RECORDS = REGISTRY.counter(
+    "track_log_records_total", "Log records written by, or dropped before, the writer thread.", ("outcome",)
+)
+_WRITTEN = LOG_RECORDS.labels(outcome="written")
+_DROPPED = LOG_RECORDS.labels(outcome="dropped")
+_FAILED = LOG_RECORDS.labels(outcome="failed")
+# How long stop() and sync() wait for queue space at a time while the writer thread runs.
+STOP_POLL_SECONDS = 0.5
+
+
+class _Sync:
+    """
+    Queued by AsyncLogWriter.sync(); done is set once every record queued
+    before it was written out, and synced tells whether that reached the disk.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.synced = False
+
+
+def _is_marker(item):
+    return item is _STOP or isinstance(item, _Sync)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues records for a writer thread without formatting them on the calling
+    thread. When the queue is full the record is either dropped straight away
+    or, with ``block_timeout`` set, dropped after waiting that long for space.
+    Dropped records are counted.
+    """
+
+    def __init__(self, record_queue, block_timeout=None):
+        super().__init__(record_queue)
+        self.block_timeout = block_timeout
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Records stay in this process, so formatting is left to the writer thread.
+        return record
+
+    def enqueue(self, record):
+        try:
+            if self.block_timeout:
+                self.queue.put(record, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            _DROPPED.inc()
+
+
+class AsyncLogWriter:
+    """
+    Writes log records to a file on a background thread, so slow disks do not
+    delay the threads that log. Records are formatted and written in batches,
+    and the file is flushed once ``flush_bytes`` are pending or
+    ``flush_interval`` seconds have passed since the last flush.
+    """
+
+    def __init__(self, path, formatter=None, max_queue=10000, batch_size=512,
+                 flush_bytes=64 * 1024, flush_interval=1.0, block_timeout=None):
+        self.path = path
+        self.formatter = formatter or logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+        self.batch_size = batch_size
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.failed = 0
+        self.bytes_written = 0
+        self._queue = queue.Queue(max_queue)
+        self.handler = DroppingQueueHandler(self._queue, block_timeout)
+        self._file = None
+        self._thread = None
+
+    @property
+    def dropped(self):
+        """
+        Returns the number of records dropped because the queue was full.
+        """
+        return self.handler.dropped
+
+    @property
+    def depth(self):
+        """
+        Returns the number of records waiting to be written.
+        """
+        return self._queue.qsize()
+
+    def start(self):
+        """
+        Opens the file and starts the writer thread.
+        """
+        # Undecodable characters in exe paths are replaced rather than failing the write.
+        self._file = open(self.path, 'a', encoding='utf-8', errors='replace')
+        # A resumed segment keeps counting from the size of its existing text.
+        self.bytes_written = self._file.tell()
+        self._thread = threading.Thread(target=self._run, name="track-log-writer", daemon=True)
+        self._thread.start()
+        _running.add(self)
+        return self
+
+    def stop(self):
+        """
+        Writes every queued record, then stops the writer thread and closes the file.
+        """
+        if self._thread is None:
+            return
+        self._put_marker(_STOP)
+        self._thread.join()
+        self._thread = None
+        _running.discard(self)
+        self._file.close()
+        if self.dropped:
+            logging.warning("Dropped %d log record(s) for %s", self.dropped, self.path)
+        if self.failed:
+            logging.warning("Could not write %d log record(s) to %s", self.failed, self.path)
+
+    def _put_marker(self, marker, deadline=None):
+        """
+        Queues a marker behind the pending records. Returns False if the writer
+        thread died or the deadline passed first.
+        """
+        # Never block on a full queue whose writer thread has died.
+        while self._thread.is_alive():
+            try:
+                self._queue.put(marker, timeout=STOP_POLL_SECONDS)
+                return True
+            except queue.Full:
+                if deadline is not None and time.monotonic() >= deadline:
+                    return False
+        return False
+
+    def sync(self, timeout=None):
+        """
+        Waits until every record queued so far is written and has reached the
+        disk. Returns False if the writer is not running, a write failed or
+        ``timeout`` seconds passed first.
+        """
+        if self._thread is None:
+            return False
+        deadline = None if timeout is None else time.monotonic() + timeout
+        marker = _Sync()
+        if not self._put_marker(marker, deadline):
+            return False
+        while not marker.done.wait(STOP_POLL_SECONDS):
+            if not self._thread.is_alive() or (deadline is not None and time.monotonic() >= deadline):
+                return False
+        return marker.synced
+
+    def _format(self, record):
+        try:
+            return self.formatter.format(record) + '\n'
+        except Exception:  # A bad record must not stop the writer
+            self.handler.handleError(record)
+            return ''
+
+    def _run(self):
+        """
+        Drains the queue in batches, formatting and writing each batch at once.
+        """
+        pending = 0
+        last_flush = time.monotonic()
+        last_record = None  # Reported with a failed flush
+        lost = False  # Whether records were lost since the last sync
+        while True:
+            timeout = max(0.0, self.flush_interval - (time.monotonic() - last_flush))
+            try:
+                records = [self._queue.get(timeout=timeout if pending else None)]
+            except queue.Empty:
+                records = []
+            while records and len(records) < self.batch_size and not _is_marker(records[-1]):
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            marker = records.pop() if records and _is_marker(records[-1]) else None
+            stopping = marker is _STOP
+            if records:
+                last_record = records[-1]
+                text = ''.join(self._format(record) for record in records)
+                try:
+                    self._file.write(text)
+                except (OSError, ValueError):  # E.g. a full disk; keep draining the queue
+                    self.failed += len(records)
+                    _FAILED.inc(len(records))
+                    lost = True
+                    self.handler.handleError(records[-1])
+                else:
+                    self.written += len(records)
+                    _WRITTEN.inc(len(records))
+                    self.bytes_written += len(text)
+                    pending += len(text)
+
+            if marker is not None or pending >= self.flush_bytes or \
+               (pending and time.monotonic() - last_flush >= self.flush_interval):
+                try:
+                    self._file.flush()
+                    if isinstance(marker, _Sync):
+                        os.fsync(self._file.fileno())
+                        marker.synced = not lost
+                        lost = False
+                except (OSError, ValueError):
+                    if last_record is not None:
+                        self.handler.handleError(last_record)
+                pending = 0
+                last_flush = time.monotonic()
+            if stopping:
+                return
+            if marker is not None:
+                marker.done.set()